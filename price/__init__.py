@@ -3,8 +3,8 @@ import time
 from typing import Optional
 from utils import load_file, get_file_logger, epoch_seconds_to_local_timestamp, save_file, create_sub_dir, \
     files_in_path, timestamp_to_epoch_seconds, path_parts_to_abs_path, directory_exists, file_exists
-from utils.coingecko import get_historical_price, get_price
-from utils.exception import RequestTimedOut
+from utils.coingecko import get_historical_price, get_price, PRIORITY_LIVE, PRIORITY_BACKFILL
+from utils.exception import RequestTimedOut, TooManyRequests
 from price.coins import COINS
 import os
 import urllib3
@@ -25,8 +25,11 @@ DATABASE_PATH = ["..", "database", "price"]
 START_EPOCH = os.getenv("START_EPOCH") or 1596240000  # 2020-08-01 00:00:00 UTC+00:00 = 1596240000
 TIME_WINDOW = os.getenv("TIME_WINDOW") or 3600  # 1H = 3600
 VS_CURRENCY = os.getenv("VS_CURRENCY") or "usd"
-REQUESTS_PER_MINUTE = os.getenv("REQUESTS_PER_MINUTE") or 100
 MERGE_BATCH_SIZE = os.getenv("MERGE_BATCH_SIZE") or 100
+# Seconds between two polls of the current prices
+CURRENT_PRICE_INTERVAL = 60
+# Longest wait after failed polls, the interval doubles with every failed poll until then
+CURRENT_PRICE_MAX_BACKOFF = 960
 
 DENOM_TO_NAME = {}
 NAME_TO_DENOMS = {}
@@ -102,18 +105,33 @@ def main_current_price():
     coins = list(NAME_TO_DENOMS.keys())
     vs_currencies = [VS_CURRENCY, "eur", "btc", "eth"]
 
+    failures = 0
     while True:
-        prices = get_price(coins, vs_currencies)
-        denom_price = {}
-        for name in prices:
-            denoms = NAME_TO_DENOMS[name]
-            for denom in denoms:
-                denom_price[denom] = {}
-                for vs_currency in prices[name]:
-                    denom_price[denom][vs_currency] = "%.8f" % prices[name][vs_currency]
-        SHARED_MEMORY_DICT["current"]["prices"] = denom_price
-        SHARED_MEMORY_DICT["current"]["epoch_seconds"] = f"{time.time()}"
-        time.sleep(60)
+        # back off while coingecko fails, the former prices stay in place meanwhile
+        delay = min(CURRENT_PRICE_MAX_BACKOFF, CURRENT_PRICE_INTERVAL * pow(2, failures))
+        try:
+            # live prices are served before any waiting backfill request
+            prices = get_price(coins, vs_currencies, priority=PRIORITY_LIVE)
+            denom_price = {}
+            for name in prices:
+                denoms = NAME_TO_DENOMS[name]
+                for denom in denoms:
+                    denom_price[denom] = {}
+                    for vs_currency in prices[name]:
+                        denom_price[denom][vs_currency] = "%.8f" % prices[name][vs_currency]
+            SHARED_MEMORY_DICT["current"]["prices"] = denom_price
+            SHARED_MEMORY_DICT["current"]["epoch_seconds"] = f"{time.time()}"
+            failures = 0
+            delay = CURRENT_PRICE_INTERVAL
+        except TooManyRequests as error:
+            failures += 1
+            delay = max(delay, error.retry_after or 0)
+            LOGGER.warning(f"Current prices got rate limited, try again in {delay}sec")
+        except Exception as error:
+            # also unexpected responses, the thread must keep polling
+            failures += 1
+            LOGGER.warning(f"Fetching current prices failed: {error!r}, try again in {delay}sec")
+        time.sleep(delay)
 
 
 def main_history_data():
@@ -141,15 +159,19 @@ def load_prices_til_now(coin: str, start_time: Optional[float] = None):
     LOGGER.info(f"Start with coin: {coin} from {epoch_seconds_to_local_timestamp(start_time)}")
     while start_time < time.time():
         try:
-            data = get_historical_price(coin, VS_CURRENCY, start_time, end_time)
+            # paced by the shared coingecko rate limiter
+            data = get_historical_price(coin, VS_CURRENCY, start_time, end_time, priority=PRIORITY_BACKFILL)
         except RequestTimedOut:
             LOGGER.warning(f"Request timed out, wait 30sec and try again at {start_time}-{end_time}")
             time.sleep(30)
             continue
+        except TooManyRequests as error:
+            LOGGER.warning(f"Rate limited, wait {error.retry_after or 30}sec and try again at {start_time}-{end_time}")
+            time.sleep(error.retry_after or 30)
+            continue
         prices += data["prices"]
         start_time = end_time
         end_time = start_time+TIME_WINDOW * 24 * 90
-        time.sleep(60/REQUESTS_PER_MINUTE)
 
     grouped_by = {}
 
@@ -192,12 +214,12 @@ def load_predefined_coins():
     # make first a local dict and change reference
     name_to_denoms = {}
     for denom in coins.keys():
-        name = coins[denom]
+        name = coins[denom]["id"]
         if name not in name_to_denoms.keys():
             name_to_denoms[name] = []
         name_to_denoms[name].append(denom)
 
-    DENOM_TO_NAME = coins
+    DENOM_TO_NAME = {denom: coins[denom]["id"] for denom in coins.keys()}
     NAME_TO_DENOMS = name_to_denoms
 
 
@@ -8,6 +8,7 @@ import utils
 from price.coins import COINS
 from utils.postgresql import config, connect
 from utils.coingecko import get_historical_price
+from utils.metrics import start_http_server
 
 
 SQL_CREATE_TABLE_COINGECKO = """CREATE TABLE IF NOT EXISTS public.coingecko
@@ -123,6 +124,7 @@ def insert_prices(db_config, denom, prices):
 async def main():
     db_config = config("price/database.ini")
     create_tables(db_config)
+    start_http_server()
     while True:
         coins = select_all_coins(db_config)
         update_start_from(db_config, coins)
@@ -141,8 +143,11 @@ async def main():
             except utils.exception.RequestTimedOut:
                 print("timed out... try next round")
                 continue
+            except utils.exception.TooManyRequests as error:
+                print(f"rate limited... wait {error.retry_after or 30}sec and try next round")
+                time.sleep(error.retry_after or 30)
+                continue
 
-            time.sleep(3)
             if prices["prices"]:
                 insert_prices(db_config, denom, prices["prices"])
 
@@ -3,6 +3,7 @@ import uvicorn
 from fastapi import FastAPI
 from endpoint import API_ROUTER
 from price import load_predefined_coins, main_current_price, main_history_data
+from utils.metrics import instrument_app
 
 if __name__ == "__main__":
     load_predefined_coins()
@@ -14,4 +15,5 @@ if __name__ == "__main__":
     main_price_historic_thread.start()
     app = FastAPI()
     app.include_router(API_ROUTER, prefix="/price", tags=["Price"])
+    instrument_app(app)
     uvicorn.run(app, host="0.0.0.0", port=8002, loop="asyncio")
@@ -1,24 +1,43 @@
 import json
 import time
 import os
-from typing import Optional, Union
-from utils import create_sub_dir, load_files, get_file_logger, save_file
-from utils.rest import (get_blocks,
+import struct
+import threading
+from typing import List, Optional, Tuple
+from utils import create_sub_dir, get_file_logger, path_parts_to_abs_path, timestamp_to_epoch_seconds, PER_ITEM
+from utils.cache import MISSING_CACHE, RESPONSE_CACHE, set_block_height
+from utils.metrics import JOB_BUCKETS, counter, gauge, histogram
+from utils.resilience import circuit_states, get_circuit_breaker, is_available
+from utils.tokens import TokenRegistry
+from utils.rest import (REST_BASE_URI,
+                        get_blocks,
                         get_all_validators,
-                        get_balance,
-                        get_profile,
                         get_tokens,
                         get_liquidity_pools)
-from utils.cosmos import (get_validator_delegations,
-                          get_delegator_delegations,
-                          get_delegator_unbonding_delegations,
-                          get_delegator_distribution,
-                          get_validator_distribution)
-from utils.exception import DelegationDoesNotExist, ValidatorDoesNotExist, RequestTimedOut, NodeIsCatchingUp
+from utils.cosmos import COSMOS_BASE_URI
+from utils.exception import RequestTimedOut, NodeIsCatchingUp, TooManyRequests
 import richlist.endpoint
+from richlist.follower import FOLLOWER_MAX_BLOCKS, BlockFollower
+from richlist.harvest import DelegationHarvest
+from richlist.balance import Balance, base_units, parse_units
+from richlist.checkpoint import CHECKPOINT_DURATION, CHECKPOINT_INTERVAL, Checkpoint, checkpoint_file
+from richlist.events import EVENTS
+from richlist.ranking import Rankings
+from richlist.portfolio import PortfolioIndex
+from richlist.store import WalletStore
+from richlist.writer import WriteBehindWriter
+from richlist.refresh import refresh_wallets
+from richlist.scheduler import RefreshScheduler
+from richlist.shards import Coordinator, shard_of
 
 # DATABASE PATH as list to allow windows too.
-DATABASE_PATH = ["..", "database", "richlist", "wallet"]
+DATABASE_PATH = ["..", "database", "richlist"]
+# SQLite file inside DATABASE_PATH holding all wallets
+WALLET_STORE_FILE = "wallets.sqlite3"
+# JSON file inside DATABASE_PATH holding the tokens of the last refresh, loaded on start
+TOKEN_REGISTRY_FILE = "tokens.json"
+# Former storage with one json file per wallet, migrated into the wallet store on first start
+LEGACY_WALLET_PATH = ["..", "database", "richlist", "wallet"]
 
 # Seconds between each block fetch
 SECONDS_BETWEEN_BLOCK_FETCH = float(os.getenv("SECONDS_BETWEEN_BLOCK_FETCH")) if os.getenv("SECONDS_BETWEEN_BLOCK_FETCH") else 10
@@ -26,13 +45,31 @@ SECONDS_BETWEEN_BLOCK_FETCH = float(os.getenv("SECONDS_BETWEEN_BLOCK_FETCH")) if
 MAX_BLOCK_SPREAD_UPDATE_WALLET = float(os.getenv("MAX_BLOCK_SPREAD_UPDATE_WALLET")) if os.getenv("MAX_BLOCK_SPREAD_UPDATE_WALLET") else 2000
 # Max block height spread between for fetching wallet sources
 MAX_BLOCK_SPREAD_FETCH_SOURCES = float(os.getenv("MAX_BLOCK_SPREAD_FETCH_SOURCES")) if os.getenv("MAX_BLOCK_SPREAD_FETCH_SOURCES") else 5000
+# Max block height spread to refresh a wallet without transactions while the follower saw every block since its check
+MAX_BLOCK_SPREAD_IDLE_WALLET = float(os.getenv("MAX_BLOCK_SPREAD_IDLE_WALLET")) if os.getenv("MAX_BLOCK_SPREAD_IDLE_WALLET") else 50000
 
 # In memory storage for currently loaded wallets
 WALLETS = {}
-# In memory storage for token information(used by staking)
-TOKENS = {}
+# Token information with the decimals of every denom, kept in TOKEN_REGISTRY_FILE. The registry refreshes on its own
+# schedule and for unknown denoms, a cached token list would hide new tokens from both
+TOKENS = TokenRegistry(get_tokens.__wrapped__)
 # BLOCK dict of last fetched block
 BLOCK = {}
+# Ranking per coin and by portfolio value, published to the API endpoint
+RANKINGS = Rankings(richlist.endpoint.SHARED_MEMORY_DICT, PortfolioIndex(richlist.endpoint.SHARED_PORTFOLIO_DICT),
+                    on_publish=EVENTS.ranking_published)
+# Collects wallets touched by new blocks
+FOLLOWER = BlockFollower()
+# Staked amounts of all delegators fetched during discovery
+HARVEST = DelegationHarvest(FOLLOWER.covers)
+# Decides which wallets are refreshed within the upstream call budget
+SCHEDULER = RefreshScheduler()
+# Writes refreshed wallets in the background, created by update_richlist
+WRITER: Optional[WriteBehindWriter] = None
+# (shard, shards) inside a worker process, the process owns only the wallets of its shard
+SHARD: Optional[Tuple[int, int]] = None
+# Worker processes and their merged wallets, only if RICHLIST_WORKERS is set
+COORDINATOR: Optional[Coordinator] = None
 
 
 # Terminal log level
@@ -42,6 +79,15 @@ LOG_LEVEL_FILE = os.getenv("LOG_LEVEL_FILE") or "INFO"
 # Global richlist logger
 LOGGER = get_file_logger("richlist", terminal_log_level=LOG_LEVEL_TERMINAL, file_log_level=LOG_LEVEL_FILE)
 
+UPDATE_CYCLE_DURATION = histogram("richlist_update_cycle_seconds", "Duration of an update cycle with wallet updates.",
+                                  buckets=JOB_BUCKETS)
+DISCOVERY_DURATION = histogram("richlist_discovery_seconds", "Duration of fetching wallets via validators and pools.",
+                               buckets=JOB_BUCKETS)
+RANKING_DURATION = histogram("richlist_ranking_seconds", "Duration of rebuilding the richlist per coin.")
+UPDATED_WALLETS = counter("richlist_updated_wallets_total", "Successfully updated wallets.")
+FAILED_WALLETS = counter("richlist_failed_wallets_total", "Wallets skipped because the update failed.")
+TRACKED_WALLETS = gauge("richlist_wallets", "Wallets tracked by the richlist.")
+
 
 def update_richlist():
     """
@@ -49,17 +95,48 @@ def update_richlist():
     :return: None
     """
     # get global database path and other settings
-    global DATABASE_PATH, SECONDS_BETWEEN_BLOCK_FETCH, MAX_BLOCK_SPREAD_FETCH_SOURCES
+    global DATABASE_PATH, SECONDS_BETWEEN_BLOCK_FETCH, MAX_BLOCK_SPREAD_FETCH_SOURCES, WRITER
     # create database directories if not created yet
     # returns the abs path to directory
-    wallet_db: str = create_sub_dir(DATABASE_PATH)
-    # load wallets from db
-    load_wallets(wallet_db)
-    # update richlist
-    update_rich_list_per_coin()
+    wallet_db: WalletStore = WalletStore(os.path.join(create_sub_dir(DATABASE_PATH), WALLET_STORE_FILE),
+                                         TOKENS.known_decimals)
+    # tokens of the last run are known right away, the registry refreshes them in the background
+    LOGGER.info(f"Loaded {TOKENS.load(os.path.join(create_sub_dir(DATABASE_PATH), TOKEN_REGISTRY_FILE))} tokens")
+    token_thread = threading.Thread(target=TOKENS.follow, name="RichList Token Thread", daemon=True,
+                                    kwargs={"on_error": lambda error: LOGGER.warning(f"Refreshing tokens failed: {error}")})
+    token_thread.start()
+    # import wallets of the former one file per wallet storage once
+    migrated: int = wallet_db.migrate_json_files(
+        path_parts_to_abs_path(LEGACY_WALLET_PATH),
+        on_error=lambda filename, error: LOGGER.warning(f"Skipped unreadable wallet file {filename}: {error}"))
+    if migrated:
+        LOGGER.info(f"Migrated {migrated} wallet files into {wallet_db.path}")
+    # the checkpoint of the last run is decoded much faster than all stored wallets, the database only fills in the
+    # wallets written after it. Without a checkpoint the wallets are loaded from db
+    checkpoint_path: str = os.path.join(create_sub_dir(DATABASE_PATH), checkpoint_file(SHARD))
+    restored: bool = restore_checkpoint(checkpoint_path)
+    if not restored:
+        load_wallets(wallet_db)
+    # update richlist, the API serves it from here on
+    with RANKING_DURATION.time():
+        update_rich_list_per_coin()
+    if restored:
+        LOGGER.info(f"Reconciled {reconcile_wallets(wallet_db)} wallets with the database")
+    # wallets without history start it with their current balance
+    started: int = start_history(wallet_db)
+    if started:
+        LOGGER.info(f"Started the balance history with {started} balances")
+    # refreshed wallets are written in the background
+    WRITER = WriteBehindWriter(wallet_db)
+    WRITER.start()
+    # a cold start writes its checkpoint with the first cycle
+    checkpointed_at: float = time.monotonic() if restored else 0.0
     # get the lowest checked height of a wallet
     last_full_fetch_height: int = get_last_check_block_height()
+    # height of the last harvest whose delegators got wallets, only used by workers
+    harvested_height: Optional[int] = None
     LOGGER.info(f"Loaded {len(WALLETS.keys())} wallets, lowest block height: {last_full_fetch_height}")
+    TRACKED_WALLETS.set(len(WALLETS))
     LOGGER.info(f"ENVIRONMENT {LOG_LEVEL_TERMINAL} {LOG_LEVEL_FILE}")
     while True:
         try:
@@ -72,43 +149,104 @@ def update_richlist():
             block_height: int = int(block['block_height'])
             block_time: str = block['time']
             LOGGER.info(f"Current block {block_height} - {block_time}")
-            # check if full fetch is required
-            if block_height - last_full_fetch_height > MAX_BLOCK_SPREAD_FETCH_SOURCES:
-                fetch_wallets_via_validators()
-                fetch_amm_wallets()
+            LOGGER.info(f"Response cache {RESPONSE_CACHE.stats()}")
+            LOGGER.info(f"Missing cache {MISSING_CACHE.stats()}")
+            cycle_start: float = time.perf_counter()
+            # a full fetch is only required if the follower missed blocks since the last one
+            if block_height - last_full_fetch_height > MAX_BLOCK_SPREAD_FETCH_SOURCES and \
+                    not FOLLOWER.covers(last_full_fetch_height):
+                with DISCOVERY_DURATION.time():
+                    fetch_wallets_via_validators(block_height)
+                    fetch_amm_wallets()
                 last_full_fetch_height = block_height
-
-            # only update wallets with a max block spread to avoid to many IO operations
-            update_wallets = []
-            for wallet in WALLETS.values():
-                difference: int = block_height - wallet["last_checked_height"]
-                if difference > MAX_BLOCK_SPREAD_UPDATE_WALLET:
-                    update_wallets.append(wallet)
-            LOGGER.info(f"Found {len(update_wallets)} wallets to update")
-            # start update process
-            for i, wallet in enumerate(update_wallets):
-                update_wallet(wallet)
-                # use latest block infos
-                block: dict = BLOCK
-                block_height: int = int(block['block_height'])
-                block_time: str = block['time']
-                wallet["last_checked_height"] = block_height
-                wallet["last_checked_time"] = block_time
-                save_wallet(wallet_db, wallet)
-                LOGGER.info(f"Updated {i+1}/{len(update_wallets)} wallets.")
-
-            # Create a richlist for each coin found if wallets got updated
+            # the delegations of all wallets are harvested from the validators again once they got too old or the
+            # follower missed blocks since the harvest, e.g. the harvest at startup before the follower started
+            elif HARVEST.due(block_height) and SHARD is None:
+                with DISCOVERY_DURATION.time():
+                    fetch_wallets_via_validators(block_height)
+            # a worker gets the delegators of its shard from the harvest of the coordinator
+            if SHARD is not None and HARVEST.height != harvested_height:
+                harvested_height = HARVEST.height
+                for swth_address in list(HARVEST.totals.keys()):
+                    get_wallet(swth_address)
+
+            # wallets touched by transactions since the last round, new addresses are added to the wallets
+            changed: set = FOLLOWER.pop_changed()
+            for address in changed:
+                get_wallet(address)
+            # their delegations may have changed since the harvest
+            HARVEST.invalidate(changed)
+            TRACKED_WALLETS.set(len(WALLETS))
+            # the scheduler picks changed wallets and wallets with matured unbondings first, then the most overdue
+            # wallets within the call budget, top ranked wallets are due much earlier than the long tail. Only
+            # rewards can change without transactions, so the tail spread is much larger if the follower saw all
+            # blocks since the wallet got checked
+            update_wallets, deferred = SCHEDULER.select(
+                list(WALLETS.values()), changed, richlist.endpoint.SHARED_MEMORY_DICT, block_height, block_time,
+                lambda wallet: MAX_BLOCK_SPREAD_IDLE_WALLET if FOLLOWER.covers(wallet["last_checked_height"])
+                else MAX_BLOCK_SPREAD_UPDATE_WALLET)
+            LOGGER.info(f"Scheduled {len(update_wallets)} wallets to update, {len(changed)} changed on chain, "
+                        f"{len(deferred)} of them deferred")
+            # start update process, wallets are refreshed concurrently and written behind
+            updated, failed = refresh_wallets(update_wallets, WRITER)
+            LOGGER.info(f"Refreshed {updated} wallets, {failed} failed. Circuits: {circuit_states()}")
+            # wallets using harvested delegations skipped one call, the budget gets it back
+            saved: int = HARVEST.pop_saved()
+            SCHEDULER.charge(-saved)
+            LOGGER.info(f"Saved {saved} delegations calls with harvested delegations")
+            # changed wallets which could not be refreshed stay on the queue
+            FOLLOWER.mark({address for address in changed if WALLETS[address]["last_checked_height"] < block_height})
+            staleness: dict = SCHEDULER.staleness_report(list(WALLETS.values()), richlist.endpoint.SHARED_MEMORY_DICT,
+                                                         block_height)
+            LOGGER.info(f"Staleness in blocks per rank bucket {staleness}")
+            if time.monotonic() - checkpointed_at >= CHECKPOINT_INTERVAL:
+                save_checkpoint(checkpoint_path)
+                checkpointed_at = time.monotonic()
+
+            # the richlist per coin got updated with every refreshed wallet
             if update_wallets:
-                update_rich_list_per_coin()
+                UPDATE_CYCLE_DURATION.observe(time.perf_counter() - cycle_start)
 
             # wait until repeat
             time.sleep(SECONDS_BETWEEN_BLOCK_FETCH)
-        except RequestTimedOut:
-            LOGGER.warning(f"Request timed out, wait 30sec and retry.")
-            time.sleep(30)
-        except NodeIsCatchingUp:
-            LOGGER.warning(f"Node is catching up, wait 60sec")
-            time.sleep(60)
+        except (RequestTimedOut, NodeIsCatchingUp) as error:
+            # timeouts were already retried with backoff by the request layer, a catching up node is not retried but
+            # counts against the circuit of its host. Either way wait for the next block
+            LOGGER.warning(f"Upstream request failed: {error}. Circuits: {circuit_states()}")
+            time.sleep(SECONDS_BETWEEN_BLOCK_FETCH)
+        except TooManyRequests as error:
+            LOGGER.warning(f"Upstream rate limited: {error}. Retry in {error.retry_after or SECONDS_BETWEEN_BLOCK_FETCH}s")
+            time.sleep(max(SECONDS_BETWEEN_BLOCK_FETCH, error.retry_after or 0))
+
+
+def shutdown() -> None:
+    """
+    Write all wallets still waiting in the write behind queue.
+    :return: None
+    """
+    if COORDINATOR is not None:
+        COORDINATOR.stop()
+        LOGGER.info("Stopped all workers.")
+    if WRITER is not None:
+        WRITER.stop()
+        LOGGER.info("Wrote all pending wallets.")
+
+
+def upstreams_available() -> bool:
+    """
+    Check if the circuits of the tradehub and cosmos nodes allow requests.
+    :return: False if any of both is open
+    """
+    return is_available(REST_BASE_URI) and is_available(COSMOS_BASE_URI)
+
+
+def owns(address: str) -> bool:
+    """
+    Check if this process is responsible for a wallet.
+    :param address: wallet address
+    :return: True if the process runs without shards or the wallet belongs to its shard
+    """
+    return SHARD is None or shard_of(address, SHARD[1]) == SHARD[0]
 
 
 def update_block_height():
@@ -119,78 +257,152 @@ def update_block_height():
     global SECONDS_BETWEEN_BLOCK_FETCH, BLOCK
     while True:
         try:
-            block: dict = get_blocks(limit=1)[0]
+            blocks: list = get_blocks(limit=FOLLOWER_MAX_BLOCKS)
+            block: dict = blocks[0]
+            # subscribers of the event stream get every new height
+            if block.get("block_height") != BLOCK.get("block_height"):
+                EVENTS.publish_block(block)
             BLOCK = block
+            # let cached validators and pools expire with the chain
+            set_block_height(int(block["block_height"]))
+            # queue the wallets touched by the new blocks
+            FOLLOWER.follow(blocks)
             time.sleep(SECONDS_BETWEEN_BLOCK_FETCH)
-        except RequestTimedOut:
-            LOGGER.warning(f"Requesting last block timed out, wait 10sec and retry.")
-            time.sleep(10)
-        except NodeIsCatchingUp:
-            LOGGER.warning(f"Node is catching up, wait 60sec")
-            time.sleep(60)
+        except (RequestTimedOut, NodeIsCatchingUp) as error:
+            LOGGER.warning(f"Requesting last block failed: {error}")
+            # wait at least until the circuit allows a trial request again
+            time.sleep(max(SECONDS_BETWEEN_BLOCK_FETCH, get_circuit_breaker(REST_BASE_URI).retry_after()))
+        except TooManyRequests as error:
+            LOGGER.warning(f"Requesting last block got rate limited: {error}")
+            time.sleep(max(SECONDS_BETWEEN_BLOCK_FETCH, error.retry_after or 0))
 
 
 def update_rich_list_per_coin():
     """
-    Update the richlist per coin using the global wallet dict.
+    Rebuild the richlist per coin using the global wallet dict. Only required after loading the wallets, afterwards
+    changed wallets are repositioned one by one via RANKINGS.update_wallet.
     :return: None
     """
     # get global data
     # SHARED_MEMORY_DICT is from the API endpoint imported to share between main and sub thread.
     global TOKENS, WALLETS
 
-    # copy all wallets so the update process does not make problems if endpoint is requested
-    wallets = [wallet.copy() for wallet in WALLETS.values()]
+    RANKINGS.rebuild(list(WALLETS.values()))
+    for coin, index in richlist.endpoint.SHARED_MEMORY_DICT.items():
+        LOGGER.info(f"Updated richlist for coin '{coin}'. Wallets: {len(index)}")
 
-    wallets_per_coin = {}
 
-    # build dict for each coin containing all wallets owning this coin
-    for wallet in wallets:
-        for coin in wallet["balance"].keys():
-            if coin not in wallets_per_coin.keys():
-                wallets_per_coin[coin] = []
+def load_wallets(store: WalletStore) -> None:
+    """
+    Load all wallets of the store into global WALLETS.
+    :param store: wallet store
+    :return: None
+    """
+    for wallet in store.load(owns):
+        WALLETS[wallet["address"]] = wallet
 
-            wallets_per_coin[coin].append(wallet)
 
-    # save sorted dict to shared memory
-    for coin in wallets_per_coin:
-        richlist.endpoint.SHARED_MEMORY_DICT[coin] = sorted(wallets_per_coin[coin], key=lambda entry: float(entry["balance"][coin]["total"]), reverse=True)
-        LOGGER.info(f"Updated richlist for coin '{coin}'. Wallets: {len(richlist.endpoint.SHARED_MEMORY_DICT[coin])}")
+def restore_checkpoint(path: str) -> bool:
+    """
+    Load the wallets of the last checkpoint into global WALLETS and its tokens if the registry is empty.
+    :param path: file of the checkpoint
+    :return: False if there is no usable checkpoint
+    """
+    if not os.path.isfile(path):
+        return False
+    start: float = time.perf_counter()
+    try:
+        checkpoint: Checkpoint = Checkpoint.read(path)
+    except (OSError, ValueError, KeyError, struct.error) as error:
+        LOGGER.warning(f"Ignoring checkpoint {path}: {error}")
+        return False
+    for wallet in checkpoint.wallets:
+        WALLETS[wallet["address"]] = wallet
+    if not len(TOKENS):
+        TOKENS.set_tokens(checkpoint.tokens)
+    # the block is not taken over, refreshes wait for the current one so balance changes get the right height
+    LOGGER.info(f"Restored {len(checkpoint.wallets)} wallets in {time.perf_counter() - start:.3f}s from the "
+                f"checkpoint of block {checkpoint.block.get('block_height')}, "
+                f"written {time.time() - checkpoint.written_at:.0f}s ago")
+    return True
+
+
+def reconcile_wallets(store: WalletStore) -> int:
+    """
+    Replace restored wallets by the stored ones where their last checked heights differ. The database is the source
+    of truth: wallets written after the checkpoint are loaded and wallets refreshed before the checkpoint but never
+    written go back to their stored state, so the balance history continues from the stored balances. Wallets of the
+    checkpoint which were never written keep their state, start_history starts their history with it.
+    :param store: wallet store
+    :return: number of replaced wallets
+    """
+    stale: List[str] = [address for address, height in store.heights(owns).items()
+                        if address not in WALLETS or WALLETS[address]["last_checked_height"] != height]
+    for wallet in store.load_many(stale):
+        WALLETS[wallet["address"]] = wallet
+        RANKINGS.update_wallet(wallet)
+    RANKINGS.publish()
+    return len(stale)
 
 
-def load_wallets(path: str) -> None:
+def save_checkpoint(path: str) -> None:
     """
-    Load all wallets into global WALLETS and return the lowest checked block height
-    :param path:
-    :return:
+    Write a checkpoint of all wallets, the token registry and the last block. Called by the update thread between
+    two refreshes, no wallet changes while it is written.
+    :param path: file of the checkpoint
+    :return: None
     """
-    for data in load_files(path, ".json"):
-        wallet: dict = json.loads(data)
-        WALLETS[wallet["address"]] = wallet
-        LOGGER.info(f"Loaded wallet: {wallet['address']}")
+    try:
+        with CHECKPOINT_DURATION.time():
+            size: int = Checkpoint(list(WALLETS.values()), [token.data for token in TOKENS.tokens.values()],
+                                   BLOCK).write(path)
+    except OSError as error:
+        LOGGER.warning(f"Writing the checkpoint failed: {error}")
+        return
+    LOGGER.info(f"Wrote checkpoint of {len(WALLETS)} wallets, {size} bytes")
 
 
-def save_wallet(path: str, wallet: dict) -> None:
+def start_history(store: WalletStore) -> int:
     """
-    Save wallet to the defined path. The fill will be saved as .json.
-    :param path:
-    :param wallet:
-    :return:
+    Append the totals of loaded wallets which are not part of the balance history yet, e.g. after an upgrade. Later
+    refreshes only append the differences.
+    :param store: wallet store
+    :return: number of appended balances
+    """
+    known: set = store.history.known_addresses()
+    changes: List[tuple] = [(address, denom, wallet["last_checked_height"], balance.total)
+                            for address, wallet in WALLETS.items() if address not in known
+                            for denom, balance in wallet["balance"].items() if balance.total]
+    store.save([], changes)
+    return len(changes)
+
+
+def save_wallets(store: WalletStore, wallets: List[dict]) -> None:
+    """
+    Save wallets to the store in one transaction.
+    :param store: wallet store
+    :param wallets: wallets to save
+    :return: None
+    """
+    store.save(wallets)
+
+
+def save_wallet(store: WalletStore, wallet: dict) -> None:
+    """
+    Save a single wallet to the store.
+    :param store: wallet store
+    :param wallet: wallet to save
+    :return: None
     """
-    data: str = json.dumps(wallet, indent=4)
-    save_file(path, f"{wallet['address']}.json", data)
+    save_wallets(store, [wallet])
 
 
 def get_last_check_block_height() -> int:
     """
-    Sorts the wallets by last checked block height and returns the lowest height. If no wallets are available
-    return 0.
+    Returns the lowest last checked block height of all wallets. If no wallets are available return 0.
     :return: last checked height or 0.
     """
-    sorted_by_block_height: list = sorted(WALLETS.values(), key=lambda entry: entry["last_checked_height"])
-    if sorted_by_block_height:
-        return sorted_by_block_height[0]["last_checked_height"]
-    return 0
+    return min((wallet["last_checked_height"] for wallet in WALLETS.values()), default=0)
 
 
 def get_wallet(swth_address: str):
@@ -208,6 +420,7 @@ def get_wallet(swth_address: str):
             "last_checked_height": 0,
             "username": None,
             "validator": None,
+            "unbonding_completion_time": None,
             "balance": {
 
             }
@@ -217,15 +430,16 @@ def get_wallet(swth_address: str):
 
 def set_wallet_balance(wallet: dict,
                        denom: str,
-                       available: Optional[float] = None,
-                       staking: Optional[float] = None,
-                       unbonding: Optional[float] = None,
-                       rewards: Optional[float] = None,
-                       commission: Optional[float] = None,
-                       orders: Optional[float] = None,
-                       positions: Optional[float] = None):
+                       available: Optional[int] = None,
+                       staking: Optional[int] = None,
+                       unbonding: Optional[int] = None,
+                       rewards: Optional[int] = None,
+                       commission: Optional[int] = None,
+                       orders: Optional[int] = None,
+                       positions: Optional[int] = None):
     """
-    Set the balance of a specific denom. Will automatically trigger an total update for the denom.
+    Set the balance of a specific denom. All amounts are integer base units of the denom, the total of the denom is
+    updated along with every sub balance.
 
     :param wallet: wallet as dict.
     :param denom: the asset to update.
@@ -239,70 +453,58 @@ def set_wallet_balance(wallet: dict,
     :return: None
     """
     if denom not in wallet["balance"].keys():
-        wallet["balance"][denom] = {
-            "available": "0.0",
-            "staking": "0.0",
-            "unbonding": "0.0",
-            "rewards": "0.0",
-            "commission": "0.0",
-            "orders": "0.0",
-            "positions": "0.0",
-            "total": "0.0"
-        }
+        wallet["balance"][denom] = Balance(get_denom_decimals(denom))
+    balance: Balance = wallet["balance"][denom]
 
     if available is not None:
-        wallet["balance"][denom]["available"] = add_floats_to_str(denom, available, 0.0)
+        balance.set("available", available)
 
     if staking is not None:
-        wallet["balance"][denom]["staking"] = add_floats_to_str(denom, staking, 0.0)
+        balance.set("staking", staking)
 
     if unbonding is not None:
-        wallet["balance"][denom]["unbonding"] = add_floats_to_str(denom, unbonding, 0.0)
+        balance.set("unbonding", unbonding)
 
     if rewards is not None:
-        wallet["balance"][denom]["rewards"] = add_floats_to_str(denom, rewards, 0.0)
+        balance.set("rewards", rewards)
 
     if commission is not None:
-        wallet["balance"][denom]["commission"] = add_floats_to_str(denom, commission, 0.0)
+        balance.set("commission", commission)
 
     if orders is not None:
-        wallet["balance"][denom]["orders"] = add_floats_to_str(denom, orders, 0.0)
+        balance.set("orders", orders)
 
     if positions is not None:
-        wallet["balance"][denom]["positions"] = add_floats_to_str(denom, positions, 0.0)
-
-    # update total
-    keys = list(wallet["balance"][denom].keys())
-    keys.remove("total")
-    total: str = "0.0"
-    for key in keys:
-        total = add_floats_to_str(denom, total, wallet["balance"][denom][key])
-    wallet["balance"][denom]["total"] = total
+        balance.set("positions", positions)
 
 
-def fetch_wallets_via_validators() -> None:
+def fetch_wallets_via_validators(block_height: int) -> None:
     """
     Fetch delegator and validator wallets using the staking endpoints. Simplest and fastest way to get wallets. Will
-    create wallets in global storage.
+    create wallets in global storage. The delegation lists of all validators are fetched concurrently and their
+    amounts are harvested, refreshes skip the delegations call of the delegators afterwards. Workers leave the harvest
+    to the coordinator.
 
+    :param block_height: current block height
     :return: None
     """
     json_validators = get_all_validators()
     LOGGER.info(f"Found {len(json_validators)} Validators in total")
     for json_val in json_validators:
         wallet_address = json_val["WalletAddress"]
-        moniker = json_val["Description"]["moniker"]
-        swthval_address = json_val["OperatorAddress"]
-        validator = get_wallet(wallet_address)
-        # update the validator wallet and add operator address and moniker as username
-        validator["validator"] = swthval_address
-        validator["username"] = moniker
-        delegations = get_validator_delegations(swthval_address)["result"]
-        LOGGER.info(f"Validator {moniker} with wallet {wallet_address} has {len(delegations)} delegators")
-        for delegator in delegations:
-            swth_address = delegator["delegator_address"]
-            # use get wallet to initialize wallet if not existed yet
-            get_wallet(swth_address)
+        if owns(wallet_address):
+            validator = get_wallet(wallet_address)
+            # update the validator wallet and add operator address and moniker as username
+            validator["validator"] = json_val["OperatorAddress"]
+            validator["username"] = json_val["Description"]["moniker"]
+    if SHARD is None:
+        delegators, calls = HARVEST.harvest([json_val["OperatorAddress"] for json_val in json_validators], owns,
+                                            block_height)
+        SCHEDULER.charge(calls)
+        LOGGER.info(f"Harvested delegations of {delegators} delegators with {calls} calls")
+    for swth_address in list(HARVEST.totals.keys()):
+        # use get wallet to initialize wallet if not existed yet
+        get_wallet(swth_address)
     LOGGER.info(f"Total fetched wallets via staking: {len(WALLETS.values())}")
 
 
@@ -313,105 +515,64 @@ def fetch_amm_wallets() -> None:
     """
     amm_wallets = get_liquidity_pools()
     for pool in amm_wallets:
+        if not owns(pool["pool_address"]):
+            continue
         wallet: dict = get_wallet(pool["pool_address"])
         wallet["username"] = pool["name"]
-        LOGGER.info(f"AMM Pool {wallet['username']} fetched with wallet {wallet['address']}")
+        LOGGER.info(f"AMM Pool {wallet['username']} fetched with wallet {wallet['address']}", extra=PER_ITEM)
 
 
-def update_wallet(wallet: dict):
-    """
-    Updating procedure for a wallet.
-    :param wallet: wallet to update
-    :return: None
+def apply_wallet_balance(wallet: dict, balance: dict) -> None:
     """
-    try:
-        LOGGER.info(f"Start updating {wallet['address']}")
-
-        # Rest balance to avoid staking/unbonding not to be displayed correct
-        wallet["balance"] = {}
-
-        # update currently balances
-        update_wallet_balance(wallet)
-
-        # update wallet delegations
-        update_delegations(wallet)
-
-        # update wallet infos
-        update_wallet_info(wallet)
-
-        # update wallet unbonding delegations
-        update_delegator_unbonding_delegation(wallet)
-        # check if wallet is validator and fetch rewards + commission or only rewards
-        if wallet["validator"]:
-            update_validator_distribution(wallet)
-        else:
-            update_delegator_distribution(wallet)
-
-    except RequestTimedOut:
-        LOGGER.info(f"Request timed out while updating delegator: {wallet['address']}. Wait 30sec and continue")
-        time.sleep(30)
-        update_wallet(wallet)
-    except (DelegationDoesNotExist, ValidatorDoesNotExist):
-        # Old unbonded validators can have no delegations which causes an API error. Remove them as validator and use
-        # the normal delegator endpoint
-        LOGGER.info(f"Validator {wallet['username']} has no more delegations. Treat them as usual wallet.")
-        wallet["validator"] = None
-        wallet["username"] = None
-        update_wallet(wallet)
-    except NodeIsCatchingUp:
-        # sadly happens to often
-        LOGGER.info(f"Node is catching up while updating wallet: {wallet['address']}. Wait 60sec and continue")
-        time.sleep(60)
-        update_wallet(wallet)
-
-
-def update_wallet_balance(wallet: dict) -> None:
-    """
-    Update currently available, in orders and positions balance.
+    Apply a balance response to the wallet.
     :param wallet: wallet to update
+    :param balance: response of get_balance
     :return: None
     """
-    # get sub dict to access faster
-    balance = get_balance(wallet["address"])
-
     if balance:
         for coin in balance.values():
             denom: str = coin["denom"]
-            available: float = float(coin["available"])
-            order: float = float(coin["order"])
-            position: float = float(coin["position"])
+            decimals: int = get_denom_decimals(denom)
+            available: int = parse_units(coin["available"], decimals)
+            order: int = parse_units(coin["order"], decimals)
+            position: int = parse_units(coin["position"], decimals)
             set_wallet_balance(wallet, denom, available=available, orders=order, positions=position)
 
 
-def update_delegations(wallet: dict) -> None:
+def apply_delegations(wallet: dict, delegations: dict) -> None:
     """
-    Update currently delegated amounts.
+    Apply a delegator delegations response to the wallet.
     :param wallet: wallet to update
+    :param delegations: response of get_delegator_delegations
     :return: None
     """
-
-    delegations: dict = get_delegator_delegations(wallet["address"])
     totals: dict = {}
     for delegation_json in delegations["result"]:
         denom: str = delegation_json["balance"]["denom"]
         if denom not in totals.keys():
-            totals[denom] = 0.0
-        amount: float = big_float_to_real_float(denom, float(delegation_json["balance"]["amount"]))
-        totals[denom] += amount
+            totals[denom] = 0
+        totals[denom] += base_units(delegation_json["balance"]["amount"])
+    apply_delegation_totals(wallet, totals)
 
+
+def apply_delegation_totals(wallet: dict, totals: dict) -> None:
+    """
+    Apply staked amounts to the wallet, e.g. the harvested ones.
+    :param wallet: wallet to update
+    :param totals: denom -> staked base units
+    :return: None
+    """
     for denom in totals.keys():
         set_wallet_balance(wallet, denom, staking=totals[denom])
 
 
-def update_wallet_info(wallet: dict) -> None:
+def apply_wallet_info(wallet: dict, info: dict) -> None:
     """
-    Update profile information like username, last seen time and height.
+    Apply a profile response to the wallet.
     :param wallet: wallet to update
+    :param info: response of get_profile
     :return: None
     """
-
-    info = get_profile(wallet["address"])
-
     if info["username"]:
         wallet["username"] = info["username"]
 
@@ -419,89 +580,67 @@ def update_wallet_info(wallet: dict) -> None:
     wallet["last_seen_time"] = info["last_seen_time"]
 
 
-def update_delegator_unbonding_delegation(wallet: dict) -> None:
+def apply_delegator_unbonding_delegation(wallet: dict, unbonding: dict) -> None:
     """
-    Update unbonding delegations.
+    Apply an unbonding delegations response to the wallet.
     :param wallet: wallet to update
+    :param unbonding: response of get_delegator_unbonding_delegations
     :return: None
     """
-    unbonding = get_delegator_unbonding_delegations(wallet["address"])
-    total: float = 0.0
+    total: int = 0
+    completion_times: List[str] = []
     for unbond_process in unbonding["result"]:
         for i in range(len(unbond_process["entries"])):
             # TODO no info about denom in response
-            denom: str = "swth"
-            amount: float = big_float_to_real_float(denom, float(unbond_process["entries"][i]["balance"]))
-            total += amount
+            total += base_units(unbond_process["entries"][i]["balance"])
+            completion_times.append(unbond_process["entries"][i]["completion_time"])
     set_wallet_balance(wallet, denom="swth", unbonding=total)
+    # the balance moves from unbonding to available at this time, the scheduler refreshes the wallet then
+    wallet["unbonding_completion_time"] = min(completion_times, key=timestamp_to_epoch_seconds) \
+        if completion_times else None
 
 
-def update_validator_distribution(wallet: dict) -> None:
+def apply_validator_distribution(wallet: dict, commission: dict) -> None:
     """
-    Update validator outstanding self staking rewards and the commissions.
+    Apply a validator distribution response to the wallet.
     :param wallet: wallet to update
+    :param commission: response of get_validator_distribution
     :return: None
     """
-    commission = get_validator_distribution(wallet["validator"])
     if "result" in commission.keys():
         if commission["result"]:
             if "self_bond_rewards" in commission["result"].keys():
                 for token in commission["result"]["self_bond_rewards"]:
                     denom: str = token["denom"]
-                    amount: float = big_float_to_real_float(denom, float(token["amount"]))
+                    amount: int = base_units(token["amount"])
                     set_wallet_balance(wallet, denom, rewards=amount)
             if "val_commission" in commission["result"].keys():
                 for token in commission["result"]["val_commission"]:
                     denom: str = token["denom"]
-                    amount: float = big_float_to_real_float(denom, float(token["amount"]))
+                    amount: int = base_units(token["amount"])
                     set_wallet_balance(wallet, denom, commission=amount)
 
 
-def update_delegator_distribution(wallet: dict) -> None:
+def apply_delegator_distribution(wallet: dict, rewards: dict) -> None:
     """
-    Update normal wallet outstanding rewards.
+    Apply a delegator rewards response to the wallet.
     :param wallet: wallet to update
+    :param rewards: response of get_delegator_distribution
     :return: None
     """
-    rewards = get_delegator_distribution(wallet["address"])
     if rewards["result"]["total"]:
         for denom_dict in rewards["result"]["total"]:
             denom: str = denom_dict["denom"]
-            amount: float = big_float_to_real_float(denom, float(denom_dict["amount"]))
+            amount: int = base_units(denom_dict["amount"])
             set_wallet_balance(wallet, denom, rewards=amount)
 
 
-def add_floats_to_str(denom: str, number_1: Union[str, float], number_2: Union[str, float]) -> str:
-    """
-    Add two floats to produce a float as string with the decimal precision of the denom.
-    This is a helper function of set_wallet_balance.
-
-    :param denom: denom of the asset
-    :param number_1: float or string
-    :param number_2: float or string
-    :return: string
-    """
-    if isinstance(number_1, str):
-        number_1: float = float(number_1)
-
-    if isinstance(number_2, str):
-        number_2: float = float(number_2)
-
-    number: float = number_1 + number_2
-    decimals: int = get_denom_decimals(denom)
-    return ("%%.%df" % decimals) % number
-
-
 def update_tokens() -> None:
     """
     Update global token information
     :return: None
     """
-    global TOKENS
-    response = get_tokens()
-    for token in response:
-        asset: str = token["denom"]
-        TOKENS[asset] = token
+    TOKENS.refresh()
 
 
 def get_denom_decimals(denom: str) -> int:
@@ -510,19 +649,7 @@ def get_denom_decimals(denom: str) -> int:
     :param denom: denom of the assest
     :return: decimals as int
     """
-    global TOKENS
-    # check if tokens are not fetched yet
-    if not TOKENS:
-        # request tokens
-        update_tokens()
-        if not TOKENS:
-            raise RuntimeError(f"Could not find token infos in general even after refetching!")
-    if denom not in TOKENS.keys():
-        update_tokens()
-        if denom not in TOKENS.keys():
-            raise RuntimeError(f"Could not find token info about {denom} even after refetching!")
-
-    return TOKENS[denom]["decimals"]
+    return TOKENS.get(denom).decimals
 
 
 def big_float_to_real_float(denom: str, amount: float) -> float:
@@ -532,5 +659,4 @@ def big_float_to_real_float(denom: str, amount: float) -> float:
     :param amount: cosmos amount
     :return: amount as float
     """
-    decimals = get_denom_decimals(denom)
-    return amount / pow(10, decimals)
+    return TOKENS.get(denom).to_float(amount)
@@ -0,0 +1,53 @@
+import os
+from threading import Thread
+from typing import Optional
+from fastapi import FastAPI
+import richlist.endpoint
+from richlist.events import EVENTS, EVENTS_SOCKET, follow_relay
+from richlist.snapshot import SNAPSHOT_PATH_ENV, SnapshotReader
+from utils import create_sub_dir
+from utils.metrics import instrument_app
+
+
+def create_app(snapshot_path: Optional[str] = None) -> FastAPI:
+    """
+    Create the API app.
+    :param snapshot_path: directory of the ranking snapshots in API worker processes, None serves the rankings of this
+    process
+    :return: FastAPI app
+    """
+    if snapshot_path:
+        richlist.endpoint.SNAPSHOTS = SnapshotReader(snapshot_path)
+        # decimals of the denoms for the history, stored by the updater process
+        richlist.TOKENS.load(os.path.join(create_sub_dir(richlist.DATABASE_PATH), richlist.TOKEN_REGISTRY_FILE))
+        # events of the updater process for the event stream
+        relay_thread = Thread(target=follow_relay, daemon=True,
+                              args=(os.path.join(snapshot_path, EVENTS_SOCKET), EVENTS),
+                              kwargs={"on_error": lambda error: richlist.LOGGER.warning(f"Event relay lost: {error}")})
+        relay_thread.setName("RichList Event Relay Thread")
+        relay_thread.start()
+    tags_metadata = [
+        {
+            "name": "RichList",
+            "description": "Tracks all staking wallets and sort them by their total balance per coin.",
+            "version": "0.1.0"
+        }
+    ]
+    app = FastAPI(title="Additional Tradehub Python API Endpoints",
+                  description="The default API endpoints are lacking of some few interesting data or do not allow simple requests. These endpoints are designed to provide simple to use data.",
+                  version="0.1.0",
+                  openapi_tags=tags_metadata)
+    app.include_router(richlist.endpoint.API_ROUTER, prefix="/richlist", tags=["RichList"])
+    instrument_app(app)
+    return app
+
+
+def __getattr__(name: str):
+    # App of the API worker processes started by richlist.main with RICHLIST_API_WORKERS, built when uvicorn looks up
+    # richlist.api:app in the worker. The updater process sets the snapshot directory before it starts them and imports
+    # this module for create_app only.
+    if name == "app":
+        app: FastAPI = create_app(os.getenv(SNAPSHOT_PATH_ENV))
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,147 @@
+from typing import Callable, Dict, Optional, Sequence, Union
+
+# Sub balances of a denom in the order of RichListBalance, total is the sum of all of them
+FIELDS = ("available", "staking", "unbonding", "rewards", "commission", "orders", "positions")
+# Scale factor per number of decimals, tokens have up to 18 decimals and cosmos decimal coins 18 more
+SCALES = tuple(pow(10, decimals) for decimals in range(37))
+
+
+def scale_of(decimals: int) -> int:
+    return SCALES[decimals] if decimals < len(SCALES) else pow(10, decimals)
+
+
+def parse_units(amount: Union[str, int, float], decimals: int) -> int:
+    """
+    Convert a human readable amount like '4123.69426603' to integer base units without going through float.
+    Digits beyond the precision of the denom are cut off.
+    :param amount: amount as decimal string, a number is converted via str
+    :param decimals: decimals of the denom
+    :return: amount in base units
+    """
+    text: str = str(amount).strip()
+    negative: bool = text.startswith("-")
+    if negative or text.startswith("+"):
+        text = text[1:]
+    if "e" in text or "E" in text:
+        # only floats from older data end up here
+        text = "%.*f" % (decimals, float(text))
+    integer, _, fraction = text.partition(".")
+    units: int = int(integer or "0") * scale_of(decimals) + int((fraction[:decimals]).ljust(decimals, "0") or "0")
+    return -units if negative else units
+
+
+def base_units(amount: Union[str, int]) -> int:
+    """
+    Convert a cosmos amount, which already is in base units, to int. Decimal coins like rewards have a fraction of
+    base units, it is cut off.
+    :param amount: amount like '1234' or '1234.567000000000000000'
+    :return: amount in base units
+    """
+    return parse_units(amount, 0)
+
+
+def format_units(units: int, decimals: int) -> str:
+    """
+    Format base units with the decimals of the denom, e.g. 412369426603 with 8 decimals is '4123.69426603'. Amounts
+    of denoms without decimals have no fraction, so the decimals taken from the string stay the same.
+    :param units: amount in base units
+    :param decimals: decimals of the denom
+    :return: amount as decimal string
+    """
+    sign: str = "-" if units < 0 else ""
+    integer, fraction = divmod(abs(units), scale_of(decimals))
+    if not decimals:
+        return f"{sign}{integer}"
+    return f"{sign}{integer}.{fraction:0{decimals}d}"
+
+
+class Balance:
+    """
+    Balance of one denom of a wallet. All sub balances are integer base units, the total is kept up to date with
+    every change instead of summing up all sub balances again. Formatted as strings only when serialized.
+    """
+
+    __slots__ = FIELDS + ("total", "decimals")
+
+    def __init__(self, decimals: int):
+        self.decimals: int = decimals
+        self.total: int = 0
+        for field in FIELDS:
+            setattr(self, field, 0)
+
+    def set(self, field: str, units: int) -> None:
+        self.total += units - getattr(self, field)
+        setattr(self, field, units)
+
+    def units(self) -> tuple:
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    @classmethod
+    def from_units(cls, decimals: int, units: Sequence[int]) -> "Balance":
+        """
+        Balance from its sub balances in base units, e.g. read from a checkpoint.
+        :param decimals: decimals of the denom
+        :param units: sub balances in the order of FIELDS
+        :return: Balance
+        """
+        balance: Balance = cls.__new__(cls)
+        balance.decimals = decimals
+        (balance.available, balance.staking, balance.unbonding, balance.rewards, balance.commission, balance.orders,
+         balance.positions) = units
+        balance.total = sum(units)
+        return balance
+
+    def to_json(self) -> Dict[str, str]:
+        """
+        Balance in the format of RichListBalance.
+        :return: dict with all sub balances and the total as strings
+        """
+        data: Dict[str, str] = {field: format_units(getattr(self, field), self.decimals) for field in FIELDS}
+        data["total"] = format_units(self.total, self.decimals)
+        return data
+
+    @classmethod
+    def from_json(cls, data: Dict[str, str], decimals: Optional[int] = None) -> "Balance":
+        """
+        Read a balance in the format of RichListBalance.
+        :param data: dict with the sub balances as strings
+        :param decimals: decimals of the denom, taken from the strings if not given
+        :return: Balance
+        """
+        if decimals is None:
+            # stored balances are formatted with the decimals of the denom, older ones wrote untouched sub balances as '0.0'
+            decimals = max(len(str(data.get(field, "0.0")).partition(".")[2]) for field in FIELDS)
+        balance: Balance = cls(decimals)
+        for field in FIELDS:
+            balance.set(field, parse_units(data.get(field, "0.0"), decimals))
+        return balance
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Balance) and self.to_json() == other.to_json()
+
+    def __repr__(self) -> str:
+        return f"Balance({self.to_json()})"
+
+
+def encode(value):
+    """
+    Hook for json.dumps(..., default=encode) to write Balance objects in the format of RichListBalance.
+    """
+    if isinstance(value, Balance):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode_wallet(wallet: dict, decimals: Optional[Callable[[str], Optional[int]]] = None) -> dict:
+    """
+    Turn the balances of a wallet read from json into Balance objects.
+    :param wallet: wallet as read from json
+    :param decimals: decimals of a denom or None if unknown, unknown decimals are taken from the strings
+    :return: same wallet
+    """
+    if decimals is None:
+        wallet["balance"] = {denom: Balance.from_json(balance) for denom, balance in wallet["balance"].items()}
+    else:
+        wallet["balance"] = {denom: Balance.from_json(balance, decimals(denom))
+                             for denom, balance in wallet["balance"].items()}
+    return wallet
@@ -0,0 +1,319 @@
+"""
+Benchmarks of the richlist internals on synthetic data, no node is required.
+
+    python -m richlist.benchmark balance --wallets 100000
+    python -m richlist.benchmark history --wallets 100000 --cycles 50
+    python -m richlist.benchmark startup --wallets 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List
+
+from richlist.balance import Balance, base_units, parse_units
+from richlist.checkpoint import Checkpoint
+from richlist.store import WalletStore
+from richlist.ranking import Rankings
+
+# denom -> decimals of the synthetic tokens
+DECIMALS = {"swth": 8, "eth1": 18, "usdc1": 6, "wbtc1": 8, "nneo2": 8}
+
+
+def synthetic_responses(wallets: int, seed: int = 42) -> List[dict]:
+    """
+    Balance, delegation and reward responses of the synthetic wallets in the format of the upstream endpoints.
+    """
+    rng = random.Random(seed)
+    responses: List[dict] = []
+    for index in range(wallets):
+        balance: dict = {}
+        for denom, decimals in DECIMALS.items():
+            if denom != "swth" and rng.random() > 0.3:
+                continue
+            available: float = rng.paretovariate(1.1) * 100
+            balance[denom] = {
+                "denom": denom,
+                "available": "%.*f" % (decimals, available),
+                "order": "%.*f" % (decimals, available * 0.1 if rng.random() < 0.2 else 0.0),
+                "position": "%.*f" % (decimals, 0.0),
+            }
+        responses.append({
+            "address": f"swth1{index:038d}",
+            "balance": balance,
+            "staking": str(int(rng.paretovariate(1.2) * 1000 * pow(10, 8))),
+            "rewards": "%.18f" % (rng.random() * pow(10, 8)),
+        })
+    return responses
+
+
+def legacy_add_floats_to_str(denom: str, number_1, number_2) -> str:
+    # former balance math, every sub balance is a string and parsed again for each addition
+    if isinstance(number_1, str):
+        number_1 = float(number_1)
+    if isinstance(number_2, str):
+        number_2 = float(number_2)
+    return ("%%.%df" % DECIMALS[denom]) % (number_1 + number_2)
+
+
+def legacy_set_wallet_balance(wallet: dict, denom: str, **amounts) -> None:
+    if denom not in wallet["balance"]:
+        wallet["balance"][denom] = {"available": "0.0", "staking": "0.0", "unbonding": "0.0", "rewards": "0.0",
+                                    "commission": "0.0", "orders": "0.0", "positions": "0.0", "total": "0.0"}
+    for key, amount in amounts.items():
+        wallet["balance"][denom][key] = legacy_add_floats_to_str(denom, amount, 0.0)
+    keys = list(wallet["balance"][denom].keys())
+    keys.remove("total")
+    total: str = "0.0"
+    for key in keys:
+        total = legacy_add_floats_to_str(denom, total, wallet["balance"][denom][key])
+    wallet["balance"][denom]["total"] = total
+
+
+def legacy_apply(responses: List[dict]) -> List[dict]:
+    wallets: List[dict] = []
+    for response in responses:
+        wallet: dict = {"address": response["address"], "balance": {}}
+        for denom, coin in response["balance"].items():
+            legacy_set_wallet_balance(wallet, denom, available=float(coin["available"]),
+                                      orders=float(coin["order"]), positions=float(coin["position"]))
+        legacy_set_wallet_balance(wallet, "swth", staking=float(response["staking"]) / pow(10, DECIMALS["swth"]))
+        legacy_set_wallet_balance(wallet, "swth", rewards=float(response["rewards"]) / pow(10, DECIMALS["swth"]))
+        wallets.append(wallet)
+    return wallets
+
+
+def legacy_rank(wallets: List[dict]) -> Dict[str, list]:
+    # former update_rich_list_per_coin
+    copies: List[dict] = [wallet.copy() for wallet in wallets]
+    wallets_per_coin: Dict[str, list] = {}
+    for wallet in copies:
+        for coin in wallet["balance"].keys():
+            wallets_per_coin.setdefault(coin, []).append(wallet)
+    return {coin: sorted(wallets_per_coin[coin], key=lambda entry: float(entry["balance"][coin]["total"]), reverse=True)
+            for coin in wallets_per_coin}
+
+
+def fixed_point_apply(responses: List[dict]) -> List[dict]:
+    wallets: List[dict] = []
+    for response in responses:
+        wallet: dict = {"address": response["address"], "balance": {}}
+        for denom, coin in response["balance"].items():
+            balance: Balance = wallet["balance"].setdefault(denom, Balance(DECIMALS[denom]))
+            balance.set("available", parse_units(coin["available"], DECIMALS[denom]))
+            balance.set("orders", parse_units(coin["order"], DECIMALS[denom]))
+            balance.set("positions", parse_units(coin["position"], DECIMALS[denom]))
+        balance: Balance = wallet["balance"].setdefault("swth", Balance(DECIMALS["swth"]))
+        balance.set("staking", base_units(response["staking"]))
+        balance.set("rewards", base_units(response["rewards"]))
+        wallets.append(wallet)
+    return wallets
+
+
+def fixed_point_rank(wallets: List[dict]) -> Dict[str, object]:
+    shared: dict = {}
+    Rankings(shared).rebuild(wallets)
+    return shared
+
+
+def measure(function: Callable, argument, repeat: int = 3) -> tuple:
+    """
+    Best duration of several runs.
+    :return: tuple of seconds and the result of the last run
+    """
+    best: float = float("inf")
+    result = None
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name: str, before: float, after: float) -> None:
+    print(f"{name:<16} {before:10.3f}s {after:10.3f}s {before / after:9.2f}x")
+
+
+def benchmark_balance(arguments: argparse.Namespace) -> None:
+    responses: List[dict] = synthetic_responses(arguments.wallets)
+    print(f"{arguments.wallets} wallets, best of {arguments.repeat}")
+    print(f"{'':<16} {'strings':>11} {'fixed point':>11} {'speedup':>10}")
+    legacy_applied, legacy_wallets = measure(legacy_apply, responses, arguments.repeat)
+    fixed_applied, fixed_wallets = measure(fixed_point_apply, responses, arguments.repeat)
+    report("apply balances", legacy_applied, fixed_applied)
+    legacy_ranked, _ = measure(legacy_rank, legacy_wallets, arguments.repeat)
+    fixed_ranked, _ = measure(fixed_point_rank, fixed_wallets, arguments.repeat)
+    report("rank per denom", legacy_ranked, fixed_ranked)
+    report("full cycle", legacy_applied + legacy_ranked, fixed_applied + fixed_ranked)
+
+    # an update cycle after startup: a share of the wallets changed, the former code sorted all wallets again
+    changed: List[dict] = synthetic_responses(arguments.wallets * arguments.changed // 100, seed=7)
+    legacy_wallets_by_address: Dict[str, dict] = {wallet["address"]: wallet for wallet in legacy_wallets}
+    rankings = Rankings({})
+    rankings.rebuild(fixed_wallets)
+
+    def legacy_cycle(responses_changed: List[dict]) -> None:
+        for wallet in legacy_apply(responses_changed):
+            legacy_wallets_by_address[wallet["address"]] = wallet
+        legacy_rank(list(legacy_wallets_by_address.values()))
+
+    def fixed_point_cycle(responses_changed: List[dict]) -> None:
+        for wallet in fixed_point_apply(responses_changed):
+            rankings.update_wallet(wallet)
+
+    legacy_updated, _ = measure(legacy_cycle, changed, arguments.repeat)
+    fixed_updated, _ = measure(fixed_point_cycle, changed, arguments.repeat)
+    report(f"{arguments.changed}% changed", legacy_updated, fixed_updated)
+
+
+def database_size(path: str) -> int:
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def benchmark_history(arguments: argparse.Namespace) -> None:
+    rng = random.Random(42)
+    denoms: List[str] = list(DECIMALS)
+    totals: Dict[tuple, int] = {}
+    for index in range(arguments.wallets):
+        for denom in denoms:
+            if denom == "swth" or rng.random() < 0.3:
+                totals[(f"swth1{index:038d}", denom)] = int(rng.paretovariate(1.1) * pow(10, DECIMALS[denom] + 2))
+    keys: List[tuple] = list(totals)
+    print(f"{arguments.wallets} wallets, {len(keys)} balances, {arguments.cycles} cycles with "
+          f"{arguments.changed}% changed balances")
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = os.path.join(directory, "wallets.sqlite3")
+        store = WalletStore(path)
+        start: float = time.perf_counter()
+        store.save([], [(address, denom, 0, total) for (address, denom), total in totals.items()])
+        baseline: float = time.perf_counter() - start
+        store.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        baseline_size: int = database_size(path)
+        snapshot_size: int = 0
+        appended: int = 0
+        append_time: float = 0.0
+        for cycle in range(1, arguments.cycles + 1):
+            changes: List[tuple] = []
+            for key in rng.sample(keys, len(keys) * arguments.changed // 100):
+                # mostly small moves like rewards, sometimes transfers
+                delta: int = rng.randrange(1, pow(10, DECIMALS[key[1]])) if rng.random() < 0.9 \
+                    else -totals[key] // rng.randrange(2, 10)
+                totals[key] += delta
+                changes.append((key[0], key[1], cycle * 100, delta))
+            start = time.perf_counter()
+            store.save([], changes)
+            append_time += time.perf_counter() - start
+            appended += len(changes)
+            # former alternative: keep a full compressed snapshot of every cycle
+            snapshot_size += len(zlib.compress(json.dumps(sorted(totals.items())).encode("utf-8")))
+        store.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        growth: int = database_size(path) - baseline_size
+        print(f"baseline         {baseline:10.3f}s {baseline_size / 1024 / 1024:10.1f} MiB")
+        print(f"append           {appended / append_time:10.0f} changes/s")
+        print(f"storage          {growth / appended:10.1f} bytes/change {growth / arguments.cycles / 1024:10.1f} KiB/cycle")
+        print(f"full snapshots   {snapshot_size / arguments.cycles / 1024:10.1f} KiB/cycle "
+              f"{snapshot_size / max(growth, 1):10.1f}x of the history")
+        for height in (arguments.cycles * 50, arguments.cycles * 100):
+            start = time.perf_counter()
+            ranking: List[tuple] = store.history.ranking_at("swth", height)
+            print(f"ranking at {height:<6}{time.perf_counter() - start:10.3f}s {len(ranking):10d} wallets")
+        start = time.perf_counter()
+        for index in range(100):
+            store.history.wallet_history(f"swth1{index:038d}")
+        print(f"wallet history   {(time.perf_counter() - start) * 10:10.3f}ms per wallet")
+        store.close()
+
+
+def stored_wallets(wallets: int) -> List[dict]:
+    # synthetic wallets with all fields of a refreshed wallet
+    stored: List[dict] = fixed_point_apply(synthetic_responses(wallets))
+    for index, wallet in enumerate(stored):
+        wallet.update({
+            "last_seen_time": "2021-06-01T12:00:00.000000Z",
+            "last_seen_height": 9000000 + index % 5000,
+            "last_checked_time": "2021-06-02T12:00:00.000000Z",
+            "last_checked_height": 9100000 + index % 5000,
+            "username": f"user{index}" if index % 10 == 0 else None,
+            "validator": None,
+            "unbonding_completion_time": None,
+        })
+        wallet["balance"] = wallet.pop("balance")
+    return stored
+
+
+def benchmark_startup(arguments: argparse.Namespace) -> None:
+    print(f"best of {arguments.repeat}, seconds until the rankings are served")
+    print(f"{'':<16} {'database':>11} {'checkpoint':>11} {'speedup':>10}")
+    for wallets in arguments.wallets:
+        with tempfile.TemporaryDirectory() as directory:
+            store = WalletStore(os.path.join(directory, "wallets.sqlite3"))
+            store.save(stored_wallets(wallets))
+            checkpoint_path: str = os.path.join(directory, "checkpoint.bin")
+            checkpoint_size: int = Checkpoint(list(store.load()), [], {"block_height": "9105000"}).write(checkpoint_path)
+
+            def cold_load(_) -> List[dict]:
+                # former load_wallets
+                return list(store.load())
+
+            def warm_load(_) -> List[dict]:
+                return Checkpoint.read(checkpoint_path).wallets
+
+            def legacy_lowest(loaded: List[dict]) -> int:
+                # former get_last_check_block_height
+                return sorted(loaded, key=lambda entry: entry["last_checked_height"])[0]["last_checked_height"]
+
+            def lowest(loaded: List[dict]) -> int:
+                return min(wallet["last_checked_height"] for wallet in loaded)
+
+            def reconcile(_) -> int:
+                # a warm start still compares the stored heights with the restored wallets
+                return len(store.heights())
+
+            print(f"{wallets} wallets, database {database_size(store.path) / 1024 / 1024:.1f} MiB, "
+                  f"checkpoint {checkpoint_size / 1024 / 1024:.1f} MiB")
+            cold_loaded, loaded = measure(cold_load, None, arguments.repeat)
+            warm_loaded, restored = measure(warm_load, None, arguments.repeat)
+            if [json.dumps(wallet, sort_keys=True, default=Balance.to_json) for wallet in restored] != \
+                    [json.dumps(wallet, sort_keys=True, default=Balance.to_json) for wallet in loaded]:
+                raise AssertionError("restored wallets differ from the stored ones")
+            report("load wallets", cold_loaded, warm_loaded)
+            ranked, _ = measure(fixed_point_rank, restored, arguments.repeat)
+            report("rank per denom", ranked, ranked)
+            legacy_lowest_time, _ = measure(legacy_lowest, loaded, arguments.repeat)
+            lowest_time, _ = measure(lowest, restored, arguments.repeat)
+            report("lowest height", legacy_lowest_time, lowest_time)
+            report("serving", cold_loaded + ranked + legacy_lowest_time, warm_loaded + ranked + lowest_time)
+            reconciled, _ = measure(reconcile, None, arguments.repeat)
+            print(f"{'reconcile':<16} {'':>11} {reconciled:10.3f}s in the background")
+            store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Richlist benchmarks on synthetic data.")
+    commands = parser.add_subparsers(dest="command")
+    command = commands.add_parser("balance", help="Fixed point balances against the former string balances.")
+    command.add_argument("--wallets", type=int, default=100000)
+    command.add_argument("--repeat", type=int, default=3)
+    command.add_argument("--changed", type=int, default=1, help="Percent of wallets changed per update cycle.")
+    command.set_defaults(run=benchmark_balance)
+    command = commands.add_parser("history", help="Growth and query times of the balance history.")
+    command.add_argument("--wallets", type=int, default=100000)
+    command.add_argument("--cycles", type=int, default=50)
+    command.add_argument("--changed", type=int, default=5, help="Percent of balances changed per update cycle.")
+    command.set_defaults(run=benchmark_history)
+    command = commands.add_parser("startup", help="Startup from the database against startup from a checkpoint.")
+    command.add_argument("--wallets", type=int, nargs="+", default=[10000, 100000])
+    command.add_argument("--repeat", type=int, default=3)
+    command.set_defaults(run=benchmark_startup)
+    arguments = parser.parse_args()
+    if not arguments.command:
+        parser.print_help()
+        return
+    arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    main()
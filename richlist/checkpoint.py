@@ -0,0 +1,158 @@
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from richlist.balance import FIELDS, Balance
+from utils.metrics import counter, histogram
+
+# Seconds between two checkpoints of the wallets in memory
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL_SEC")) if os.getenv("CHECKPOINT_INTERVAL_SEC") else 300.0
+
+# magic, position and length of the meta data
+MAGIC = b"RLCHKP01"
+HEADER = struct.Struct("<8sQQ")
+# sub balances beyond 64 bit, e.g. of 18 decimal tokens, are replaced by this marker and kept in the meta data
+LARGE = -pow(2, 63)
+MAX_INTEGER = pow(2, 63) - 1
+# wallet index, denom index, decimals and sub balances of a balance, in native byte order
+OWNER, DENOM, DECIMALS, AMOUNT = "I", "H", "B", "q"
+
+CHECKPOINTS_WRITTEN = counter("richlist_checkpoints_written_total", "Checkpoints of the wallets written.")
+CHECKPOINT_DURATION = histogram("richlist_checkpoint_seconds", "Duration of writing a checkpoint of the wallets.")
+
+
+def checkpoint_file(shard: Optional[Tuple[int, int]]) -> str:
+    # every worker process keeps the wallets of its shard
+    return "checkpoint.bin" if shard is None else f"checkpoint-{shard[0]}-of-{shard[1]}.bin"
+
+
+def column(buffer: mmap.mmap, section: List[int], typecode: str) -> list:
+    # decoded straight from the mapping, the views are released before the mapping gets closed
+    position, length = section
+    with memoryview(buffer) as view, view[position:position + length] as part, part.cast(typecode) as values:
+        return values.tolist()
+
+
+class Checkpoint:
+    """
+    State of the wallets in memory along with the token registry and the last block, written every
+    CHECKPOINT_INTERVAL so a restart does not parse every stored wallet again. Wallet fields are one json array
+    decoded with a single call, balances are columns of native integers decoded straight from the mapped file.
+
+    Layout: header, wallet fields, owner, denom, decimals and sub balance columns of all balances, meta data.
+    """
+
+    def __init__(self, wallets: List[dict], tokens: List[dict], block: dict, written_at: Optional[float] = None):
+        """
+        :param wallets: all wallets
+        :param tokens: tokens as returned by get_tokens
+        :param block: last fetched block
+        :param written_at: epoch seconds the checkpoint was written, None for now
+        """
+        self.wallets: List[dict] = wallets
+        self.tokens: List[dict] = tokens
+        self.block: dict = block
+        self.written_at: float = written_at if written_at is not None else time.time()
+
+    def write(self, path: str) -> int:
+        """
+        Write the checkpoint and replace the former one at once.
+        :param path: file of the checkpoint
+        :return: size of the file in bytes
+        """
+        fields: List[dict] = []
+        denoms: Dict[str, int] = {}
+        owners, denom_ids, decimals, amounts = (array.array(OWNER), array.array(DENOM), array.array(DECIMALS),
+                                                array.array(AMOUNT))
+        large: List[str] = []
+        for index, wallet in enumerate(self.wallets):
+            # keeps the position of the balance, decoded wallets have their keys in the former order
+            fields.append(dict(wallet, balance=None))
+            for denom, balance in wallet["balance"].items():
+                owners.append(index)
+                denom_ids.append(denoms.setdefault(denom, len(denoms)))
+                decimals.append(balance.decimals)
+                units: tuple = balance.units()
+                if -MAX_INTEGER <= min(units) and max(units) <= MAX_INTEGER:
+                    amounts.extend(units)
+                    continue
+                for amount in units:
+                    if -MAX_INTEGER <= amount <= MAX_INTEGER:
+                        amounts.append(amount)
+                    else:
+                        amounts.append(LARGE)
+                        large.append(str(amount))
+
+        sections: List[bytes] = [json.dumps(fields, separators=(",", ":")).encode("utf-8"), owners.tobytes(),
+                                 denom_ids.tobytes(), decimals.tobytes(), amounts.tobytes()]
+        positions: List[List[int]] = []
+        position: int = HEADER.size
+        for data in sections:
+            positions.append([position, len(data)])
+            # columns start 8 byte aligned
+            position += len(data) + -len(data) % 8
+        meta: bytes = json.dumps({
+            "byteorder": sys.byteorder,
+            "written_at": self.written_at,
+            "block": self.block,
+            "tokens": self.tokens,
+            "denoms": list(denoms),
+            "large": large,
+            "sections": positions,
+        }, separators=(",", ":")).encode("utf-8")
+
+        temporary: str = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(HEADER.pack(MAGIC, position, len(meta)))
+            for data in sections:
+                file.write(data)
+                file.write(bytes(-len(data) % 8))
+            file.write(meta)
+            file.flush()
+            os.fsync(file.fileno())
+        # a crash while writing leaves the former checkpoint in place
+        os.replace(temporary, path)
+        CHECKPOINTS_WRITTEN.inc()
+        return position + len(meta)
+
+    @classmethod
+    def read(cls, path: str) -> "Checkpoint":
+        """
+        Map a checkpoint into memory and decode it.
+        :param path: file of the checkpoint
+        :return: checkpoint
+        """
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, meta_position, meta_length = HEADER.unpack_from(buffer, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is no richlist checkpoint")
+            meta: dict = json.loads(buffer[meta_position:meta_position + meta_length].decode("utf-8"))
+            if meta["byteorder"] != sys.byteorder:
+                raise ValueError(f"{path} was written with {meta['byteorder']} endian integers")
+            fields_section, owners_section, denoms_section, decimals_section, amounts_section = meta["sections"]
+            wallets: List[dict] = json.loads(buffer[fields_section[0]:sum(fields_section)].decode("utf-8"))
+            owners: list = column(buffer, owners_section, OWNER)
+            denom_ids: list = column(buffer, denoms_section, DENOM)
+            decimals: list = column(buffer, decimals_section, DECIMALS)
+            amounts: list = column(buffer, amounts_section, AMOUNT)
+        finally:
+            buffer.close()
+
+        for wallet in wallets:
+            wallet["balance"] = {}
+        denoms: List[str] = meta["denoms"]
+        large = iter(meta["large"])
+        width: int = len(FIELDS)
+        for index, owner in enumerate(owners):
+            units: list = amounts[index * width:index * width + width]
+            if LARGE in units:
+                units = [int(next(large)) if amount == LARGE else amount for amount in units]
+            wallets[owner]["balance"][denoms[denom_ids[index]]] = Balance.from_units(decimals[index], units)
+        return cls(wallets, meta["tokens"], meta["block"], meta["written_at"])
@@ -1,9 +1,28 @@
-from fastapi import APIRouter, Query, Path
-from fastapi.responses import JSONResponse
-from richlist.models import RichListGetDenoms, RichListTop, RichListError
+import os
+from typing import Optional
+from fastapi import APIRouter, Header, Query, Path
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import richlist
+from richlist.history import HistoryStore, serialize_history
+from richlist.pages import PAGE_CACHE, encode, etag, etag_matches
+from richlist.balance import format_units
+from richlist.events import EVENT_TYPES, EVENTS, EVENTS_TOP_LIMIT
+from richlist.ranking import serialize_record, serialize_stats
+from richlist.portfolio import serialize_portfolio
+from richlist.snapshot import DENOM, PORTFOLIO, Snapshot, SnapshotReader
+from richlist.models import RichListGetDenoms, RichListTop, RichListRank, RichListStats, RichListPortfolioTop, RichListHistoryTop, \
+    RichListWalletHistory, RichListError
+from utils import create_sub_dir
 
-# Shared memory dict for main and sub thread.
+# Shared memory dict for main and sub thread. Maps a denom to its richlist.ranking.RankingIndex.
 SHARED_MEMORY_DICT = {}
+# Maps the currency of the portfolio values to the richlist.ranking.RankingIndex of the portfolios.
+SHARED_PORTFOLIO_DICT = {}
+# Read connection of the balance history, opened on first use.
+HISTORY = {}
+# Snapshots of the rankings written by the updater process. Set in API worker processes, which hold no rankings, see
+# richlist.api
+SNAPSHOTS: Optional[SnapshotReader] = None
 
 # FAST API router
 API_ROUTER = APIRouter()
@@ -15,36 +34,250 @@ async def get_denoms():
     Request currently managed coins. To all returned coins there is a richlist available.
     """
     data = {
-        "denoms": list(SHARED_MEMORY_DICT.keys())
+        "denoms": SNAPSHOTS.names(DENOM) if SNAPSHOTS is not None else list(SHARED_MEMORY_DICT.keys())
     }
     return JSONResponse(data, status_code=200)
 
 
+@API_ROUTER.get("/portfolio/top", response_class=JSONResponse, response_model=RichListPortfolioTop, responses={404: {"model": RichListError}})
+async def get_portfolio_list(vs_currency: str = Query("usd", description="Currency of the values."),
+                             limit: int = Query(10, ge=1, le=100, description="Limit the response result."),
+                             offset: int = Query(0, ge=0, description="Request result with offset."),
+                             if_none_match: Optional[str] = Header(None)):
+    """
+    Request the richlist over all coins. Every balance is valued with its current price, the returned list is sorted
+    by the value of all balances of a wallet. Responses carry an ETag like '/{denom}/top'.
+    """
+    if SNAPSHOTS is not None:
+        return snapshot_page(SNAPSHOTS.get(PORTFOLIO, vs_currency), {"vs_currency": vs_currency}, ("portfolio", vs_currency),
+                             limit, offset, if_none_match, f"Currency '{vs_currency}' is not known")
+    if vs_currency not in SHARED_PORTFOLIO_DICT.keys():
+        data = {
+            "error": f"Currency '{vs_currency}' is not known"
+        }
+        return JSONResponse(data, status_code=404)
+
+    sorted_portfolios = SHARED_PORTFOLIO_DICT[vs_currency].view()
+
+    def build() -> dict:
+        subset_wallets = [serialize_portfolio(record) for record in sorted_portfolios[offset:offset+limit]]
+        return {
+            "vs_currency": vs_currency,
+            "total": len(sorted_portfolios),
+            "total_subset": len(subset_wallets),
+            "limit": limit,
+            "offset": offset,
+            "wallets": subset_wallets
+        }
+
+    key: tuple = ("portfolio", vs_currency, sorted_portfolios.generation, limit, offset)
+    tag: str = etag(*key)
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    _, body = PAGE_CACHE.get(key, build)
+    return Response(body, status_code=200, media_type="application/json", headers={"ETag": tag})
+
+
 @API_ROUTER.get("/{denom}/top", response_class=JSONResponse, response_model=RichListTop, responses={404: {"model": RichListError}})
 async def get_rich_list(denom: str = Path("swth", min_length=3, description="Requested denom, see '/get_denoms'."),
                         limit: int = Query(10, ge=1, le=100, description="Limit the response result."),
-                        offset: int = Query(0, ge=0, description="Request result with offset.")):
+                        offset: int = Query(0, ge=0, description="Request result with offset."),
+                        if_none_match: Optional[str] = Header(None)):
     """
-    Request the richlist for a denom. The returned list is sorted by total balance.
+    Request the richlist for a denom. The returned list is sorted by total balance. Responses carry an ETag, send it
+    as If-None-Match to get a 304 as long as the richlist did not change.
     """
+    if SNAPSHOTS is not None:
+        return snapshot_page(SNAPSHOTS.get(DENOM, denom), {"denom": denom}, (denom,), limit, offset, if_none_match,
+                             f"Denom '{denom}' is not known")
     if denom not in SHARED_MEMORY_DICT.keys():
         data = {
             "error": f"Denom '{denom}' is not known"
         }
         return JSONResponse(data, status_code=404)
 
-    sorted_wallets = SHARED_MEMORY_DICT[denom]
+    # consistent snapshot, total and wallets belong to the same state of the ranking
+    sorted_wallets = SHARED_MEMORY_DICT[denom].view()
+
+    def build() -> dict:
+        # records already only contain the balance of this denom, format it for the requested page only
+        subset_wallets = [serialize_record(record, denom) for record in sorted_wallets[offset:offset+limit]]
+        return {
+            "denom": denom,
+            "total": len(sorted_wallets),
+            "total_subset": len(subset_wallets),
+            "limit": limit,
+            "offset": offset,
+            "wallets": subset_wallets
+        }
+
+    key: tuple = (denom, sorted_wallets.generation, limit, offset)
+    # a client with the current version gets its 304 without the page being encoded or taking a cache slot
+    tag: str = etag(*key)
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    # pages of a generation never change, encode them once
+    _, body = PAGE_CACHE.get(key, build)
+    return Response(body, status_code=200, media_type="application/json", headers={"ETag": tag})
 
-    # copy the wallets to remove not used balanced
-    subset_wallets = [wallet.copy() for wallet in sorted_wallets[offset:offset+limit]]
 
-    # throw away not used balanced
-    for wallet in subset_wallets:
-        wallet["balance"] = wallet["balance"][denom]
+@API_ROUTER.get("/{denom}/rank/{address}", response_class=JSONResponse, response_model=RichListRank, responses={404: {"model": RichListError}})
+async def get_rank(denom: str = Path("swth", min_length=3, description="Requested denom, see '/get_denoms'."),
+                   address: str = Path(..., min_length=3, description="Wallet address.")):
+    """
+    Request the position of a wallet in the richlist of a denom.
+    """
+    if SNAPSHOTS is not None:
+        return snapshot_rank(SNAPSHOTS.get(DENOM, denom), denom, address)
+    if denom not in SHARED_MEMORY_DICT.keys():
+        data = {
+            "error": f"Denom '{denom}' is not known"
+        }
+        return JSONResponse(data, status_code=404)
 
+    # rank, total and wallet belong to the same state of the ranking
+    sorted_wallets, rank = SHARED_MEMORY_DICT[denom].locate(address)
+    if rank is None:
+        data = {
+            "error": f"Wallet '{address}' does not hold '{denom}'"
+        }
+        return JSONResponse(data, status_code=404)
     data = {
         "denom": denom,
+        "rank": rank + 1,
         "total": len(sorted_wallets),
+        "wallet": serialize_record(sorted_wallets[rank], denom)
+    }
+    return JSONResponse(data, status_code=200)
+
+
+@API_ROUTER.get("/{denom}/stats", response_class=JSONResponse, response_model=RichListStats, responses={404: {"model": RichListError}})
+async def get_stats(denom: str = Path("swth", min_length=3, description="Requested denom, see '/get_denoms'."),
+                    if_none_match: Optional[str] = Header(None)):
+    """
+    Request distribution statistics of a denom: supply held by all wallets, wallets per balance bucket, balance
+    cutoffs of the top percents and the share of the richest wallets.
+    """
+    if SNAPSHOTS is not None:
+        snapshot: Optional[Snapshot] = SNAPSHOTS.get(DENOM, denom)
+        if snapshot is None:
+            return JSONResponse({"error": f"Denom '{denom}' is not known"}, status_code=404)
+        tag: str = etag(denom, snapshot.generation, "stats", started_at=snapshot.started_at)
+        if etag_matches(if_none_match, tag):
+            return Response(status_code=304, headers={"ETag": tag})
+        return Response(snapshot.stats, status_code=200, media_type="application/json", headers={"ETag": tag})
+    if denom not in SHARED_MEMORY_DICT.keys():
+        data = {
+            "error": f"Denom '{denom}' is not known"
+        }
+        return JSONResponse(data, status_code=404)
+
+    sorted_wallets = SHARED_MEMORY_DICT[denom].view()
+    key: tuple = (denom, sorted_wallets.generation, "stats")
+    tag: str = etag(*key)
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    # computed once per generation like the pages
+    _, body = PAGE_CACHE.get(key, lambda: serialize_stats(sorted_wallets, denom))
+    return Response(body, status_code=200, media_type="application/json", headers={"ETag": tag})
+
+
+@API_ROUTER.get("/events", response_class=StreamingResponse, responses={404: {"model": RichListError}, 503: {"model": RichListError}})
+async def get_events(denoms: Optional[str] = Query(None, description="Comma separated denoms of the rank events, all denoms if not set."),
+                     types: str = Query(",".join(EVENT_TYPES), description="Comma separated event types: block, enter, exit, balance."),
+                     top: int = Query(10, ge=1, le=EVENTS_TOP_LIMIT, description="Top wallets per denom watched for rank events."),
+                     last_event_id: Optional[int] = Header(None)):
+    """
+    Stream server-sent events instead of polling '/{denom}/top': 'block' for every new block height, 'enter' and
+    'exit' when a wallet enters or leaves the top of a denom and 'balance' when the total of a wallet within the top
+    changes. Ranks outside of the top watched by the server are null. A client reading too slow skips events and gets
+    a 'lagged' event, it should fetch the rankings again. Reconnecting with the Last-Event-ID header resumes the
+    stream.
+    """
+    requested: set = {name.strip() for name in types.split(",") if name.strip()}
+    unknown: set = requested - set(EVENT_TYPES)
+    if unknown:
+        return JSONResponse({"error": f"Event types {sorted(unknown)} are not known"}, status_code=404)
+    if EVENTS.full():
+        return JSONResponse({"error": "Too many clients streaming events"}, status_code=503)
+    denom_filter: Optional[set] = {denom.strip() for denom in denoms.split(",")} if denoms else None
+    return StreamingResponse(EVENTS.stream(denom_filter, requested, top, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def snapshot_page(snapshot: Optional[Snapshot], head: dict, key: tuple, limit: int, offset: int,
+                  if_none_match: Optional[str], error: str) -> Response:
+    """
+    Page of a ranking served from its snapshot, with the same body and ETag as a page built from memory.
+    :param snapshot: snapshot of the ranking, None if it is not known
+    :param head: fields in front of the totals
+    :param key: fields of the page cache key in front of the generation
+    :param limit: limit of the page
+    :param offset: offset of the page
+    :param if_none_match: If-None-Match header
+    :param error: error message if the ranking is not known
+    :return: response
+    """
+    if snapshot is None:
+        return JSONResponse({"error": error}, status_code=404)
+    tag: str = etag(*key, snapshot.generation, limit, offset, started_at=snapshot.started_at)
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    return Response(snapshot.page(head, limit, offset), status_code=200, media_type="application/json",
+                    headers={"ETag": tag})
+
+
+def snapshot_rank(snapshot: Optional[Snapshot], denom: str, address: str) -> Response:
+    if snapshot is None:
+        return JSONResponse({"error": f"Denom '{denom}' is not known"}, status_code=404)
+    rank: Optional[int] = snapshot.find(address)
+    if rank is None:
+        return JSONResponse({"error": f"Wallet '{address}' does not hold '{denom}'"}, status_code=404)
+    head: bytes = encode({"denom": denom, "rank": rank + 1, "total": len(snapshot)})
+    return Response(head[:-1] + b',"wallet":' + snapshot.record(rank) + b"}", status_code=200,
+                    media_type="application/json")
+
+
+def history_store() -> HistoryStore:
+    if "store" not in HISTORY:
+        HISTORY["store"] = HistoryStore.open(os.path.join(create_sub_dir(richlist.DATABASE_PATH), richlist.WALLET_STORE_FILE))
+    return HISTORY["store"]
+
+
+def denom_decimals() -> dict:
+    if SNAPSHOTS is not None:
+        snapshots = [SNAPSHOTS.get(DENOM, denom) for denom in SNAPSHOTS.names(DENOM)]
+        decimals: dict = {snapshot.name: snapshot.decimals for snapshot in snapshots if snapshot is not None}
+    else:
+        decimals = {denom: index.decimals for denom, index in list(SHARED_MEMORY_DICT.items())}
+    # denoms nobody holds anymore only have a history, and an empty ranking does not know its decimals
+    decimals.update({denom: token.decimals for denom, token in list(richlist.TOKENS.tokens.items())})
+    return decimals
+
+
+# sync endpoints, the history is read from disk in the thread pool instead of the event loop
+@API_ROUTER.get("/{denom}/history", response_class=JSONResponse, response_model=RichListHistoryTop, responses={404: {"model": RichListError}})
+def get_rich_list_history(denom: str = Path("swth", min_length=3, description="Requested denom, see '/get_denoms'."),
+                          height: int = Query(..., ge=0, description="Block height of the richlist."),
+                          limit: int = Query(10, ge=1, le=100, description="Limit the response result."),
+                          offset: int = Query(0, ge=0, description="Request result with offset.")):
+    """
+    Request the richlist of a denom as it was at a block height, rebuilt from the balance history. Balances are known
+    from the height the wallet got checked at.
+    """
+    ranking = history_store().ranking_at(denom, height)
+    if not ranking:
+        data = {
+            "error": f"No history of denom '{denom}' at height {height}"
+        }
+        return JSONResponse(data, status_code=404)
+    decimals: int = denom_decimals().get(denom, 0)
+    subset_wallets = [{"address": address, "total": format_units(total, decimals)}
+                      for address, total in ranking[offset:offset+limit]]
+    data = {
+        "denom": denom,
+        "height": height,
+        "total": len(ranking),
         "total_subset": len(subset_wallets),
         "limit": limit,
         "offset": offset,
@@ -52,3 +285,21 @@ async def get_rich_list(denom: str = Path("swth", min_length=3, description="Req
     }
     return JSONResponse(data, status_code=200)
 
+
+@API_ROUTER.get("/wallet/{address}/history", response_class=JSONResponse, response_model=RichListWalletHistory, responses={404: {"model": RichListError}})
+def get_wallet_history(address: str = Path(..., min_length=3, description="Wallet address."),
+                       denom: Optional[str] = Query(None, description="Only changes of this denom.")):
+    """
+    Request the total balances of a wallet after every change, sorted by block height.
+    """
+    history = history_store().wallet_history(address, denom)
+    if not history:
+        data = {
+            "error": f"No history of wallet '{address}'"
+        }
+        return JSONResponse(data, status_code=404)
+    data = {
+        "address": address,
+        "changes": serialize_history(history, denom_decimals())
+    }
+    return JSONResponse(data, status_code=200)
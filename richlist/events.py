@@ -0,0 +1,462 @@
+import asyncio
+import itertools
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from richlist.balance import format_units
+from richlist.ranking import RankingIndex, RankingView
+from utils.metrics import counter, gauge
+
+# Top wallets per denom watched for entries, exits and balance changes, the largest top a client can ask for
+EVENTS_TOP_LIMIT = int(os.getenv("EVENTS_TOP_LIMIT")) if os.getenv("EVENTS_TOP_LIMIT") else 100
+# Events kept for clients reading behind, a client falling further behind skips the older ones
+EVENTS_BUFFER = int(os.getenv("EVENTS_BUFFER")) if os.getenv("EVENTS_BUFFER") else 10000
+# Clients streaming events at the same time
+EVENTS_MAX_CLIENTS = int(os.getenv("EVENTS_MAX_CLIENTS")) if os.getenv("EVENTS_MAX_CLIENTS") else 1000
+# Seconds without events after which a client gets a keep alive comment
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT_SEC")) if os.getenv("EVENTS_HEARTBEAT_SEC") else 15.0
+# Seconds an API worker process may not take relayed events before the updater process drops its connection
+EVENTS_RELAY_TIMEOUT = float(os.getenv("EVENTS_RELAY_TIMEOUT_SEC")) if os.getenv("EVENTS_RELAY_TIMEOUT_SEC") else 5.0
+
+# Socket in the snapshot directory the updater process relays the events to the API worker processes over
+EVENTS_SOCKET = "events.sock"
+
+BLOCK = "block"
+ENTER = "enter"
+EXIT = "exit"
+BALANCE = "balance"
+# sent instead of the events a client skipped
+LAGGED = "lagged"
+EVENT_TYPES = (BLOCK, ENTER, EXIT, BALANCE)
+
+PUBLISHED_EVENTS = counter("richlist_events_published_total", "Events published to the event stream.", ["kind"])
+LAGGED_CLIENTS = counter("richlist_events_lagged_total", "Times a client fell behind the event buffer.")
+EVENT_CLIENTS = gauge("richlist_event_clients", "Clients streaming events.")
+
+
+class Event:
+    """
+    Published event, encoded once and shared by all clients. A ranking event holds the ranks of a wallet before and
+    after a publish, so every client can tell with its own top whether the wallet entered, left or stayed in it.
+    """
+
+    __slots__ = ("id", "kind", "denom", "previous_rank", "rank", "changed", "data")
+
+    def __init__(self, kind: str, data: dict, denom: Optional[str] = None, previous_rank: Optional[int] = None,
+                 rank: Optional[int] = None, changed: bool = False):
+        """
+        :param kind: BLOCK or "rank"
+        :param data: payload of the event
+        :param denom: denom of a ranking event
+        :param previous_rank: rank before the publish, None if the wallet was not within EVENTS_TOP_LIMIT
+        :param rank: rank after the publish, None if the wallet is not within EVENTS_TOP_LIMIT
+        :param changed: True if the total of the wallet changed
+        """
+        self.id: int = 0
+        self.kind: str = kind
+        self.denom: Optional[str] = denom
+        self.previous_rank: Optional[int] = previous_rank
+        self.rank: Optional[int] = rank
+        self.changed: bool = changed
+        self.data: bytes = json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    def name(self, top: int) -> Optional[str]:
+        """
+        Type of the event for a client.
+        :param top: top wallets the client watches
+        :return: BLOCK, ENTER, EXIT, BALANCE or None if nothing changed within the top of the client
+        """
+        if self.kind == BLOCK:
+            return BLOCK
+        before: bool = self.previous_rank is not None and self.previous_rank < top
+        after: bool = self.rank is not None and self.rank < top
+        if after and not before:
+            return ENTER
+        if before and not after:
+            return EXIT
+        if after and self.changed:
+            return BALANCE
+        return None
+
+
+def encode_event(event: Event) -> bytes:
+    """
+    Encode an event as one line for the relay to the API worker processes.
+    :param event: published event
+    :return: encoded line, the encoded JSON of the payload never contains a newline or a tab
+    """
+    header: list = [event.id, event.kind, event.denom, event.previous_rank, event.rank, event.changed]
+    return json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\t" + event.data + b"\n"
+
+
+def decode_event(line: bytes) -> Event:
+    """
+    Decode a relayed event.
+    :param line: line written by encode_event without its newline
+    :return: event with the id given by the updater process
+    """
+    header, data = line.split(b"\t", 1)
+    event_id, kind, denom, previous_rank, rank, changed = json.loads(header)
+    event = Event(kind, {}, denom, previous_rank, rank, changed)
+    event.id = event_id
+    event.data = data
+    return event
+
+
+def block_event(block: dict) -> Event:
+    return Event(BLOCK, {"height": int(block["block_height"]), "time": block["time"]})
+
+
+def ranking_events(index: RankingIndex, before: RankingView, top: int = EVENTS_TOP_LIMIT) -> List[Event]:
+    """
+    Changes of the top wallets of a ranking between two views. Wallets which only moved because others passed them
+    are part of it too, they may have crossed the top of some client.
+    :param index: ranking right after its publish
+    :param before: former view of the ranking
+    :param top: top wallets compared
+    :return: events sorted by the new rank, wallets which left the top last
+    """
+    previous: Dict[str, Tuple[int, int]] = {record["address"]: (rank, record["balance"][index.denom].total)
+                                            for rank, record in enumerate(before.records(0, top))}
+    current: Dict[str, Tuple[int, int]] = {record["address"]: (rank, record["balance"][index.denom].total)
+                                           for rank, record in enumerate(index.view().records(0, top))}
+    events: List[Event] = []
+    for address in itertools.chain(current, (address for address in previous if address not in current)):
+        previous_rank, previous_total = previous.get(address, (None, None))
+        rank, total = current.get(address, (None, None))
+        if total is None:
+            # left the top, the wallet may still be ranked further down or own nothing of the denom anymore
+            key: Optional[tuple] = index.keys.get(address)
+            total = -key[0] if key is not None else 0
+        if rank == previous_rank and total == previous_total:
+            continue
+        events.append(Event("rank", {
+            "denom": index.denom,
+            "address": address,
+            "rank": rank + 1 if rank is not None else None,
+            "previous_rank": previous_rank + 1 if previous_rank is not None else None,
+            "total": format_units(total, index.decimals),
+            "previous_total": format_units(previous_total, index.decimals) if previous_total is not None else None,
+        }, index.denom, previous_rank, rank, total != previous_total))
+    return events
+
+
+class EventBroker:
+    """
+    Fans out events to all streaming clients. Events are kept once in a ring buffer and every client reads them with
+    its own cursor, publishing never waits for a client. A slow client is paused by the flow control of the server
+    while the buffer moves on, once it falls more than EVENTS_BUFFER events behind it skips them and gets a LAGGED
+    event telling it to fetch the rankings again.
+
+    Ranking events are only computed while at least one client is connected, to this process or to an API worker
+    process the events are relayed to.
+    """
+
+    def __init__(self, capacity: int = EVENTS_BUFFER, max_clients: int = EVENTS_MAX_CLIENTS,
+                 heartbeat: float = EVENTS_HEARTBEAT):
+        self.events: Deque[Event] = deque(maxlen=capacity)
+        self.max_clients: int = max_clients
+        self.heartbeat: float = heartbeat
+        self.last_id: int = 0
+        # id before the first event of this broker, a worker process joins the relay with higher ids
+        self.origin: int = 0
+        self.clients: int = 0
+        # clients of the API worker processes, see EventRelay
+        self.remote_clients: int = 0
+        # called with every appended list of events while the lock is held, so they get them in the order of the ids
+        self.subscribers: List[Callable[[List[Event]], None]] = []
+        # event loop and flag of every waiting client, set from the publishing threads
+        self.waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.lock = threading.Lock()
+
+    def full(self) -> bool:
+        return self.clients >= self.max_clients
+
+    def subscribe(self, callback: Callable[[List[Event]], None]) -> None:
+        """
+        Get all events appended from now on. The callback must not block, it is called while the broker is locked.
+        :param callback: called with every list of new events
+        :return: None
+        """
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def publish(self, events: List[Event]) -> None:
+        """
+        Append events and wake up all waiting clients. Called from any thread.
+        :param events: new events
+        :return: None
+        """
+        if not events:
+            return
+        with self.lock:
+            for event in events:
+                self.last_id += 1
+                event.id = self.last_id
+                PUBLISHED_EVENTS.inc(kind=event.kind)
+            waiters: list = self.append(events)
+        self.wake(waiters)
+
+    def relay(self, events: List[Event]) -> None:
+        """
+        Append events published by the updater process keeping their ids, so a client can resume on any API worker
+        process. Called from any thread.
+        :param events: relayed events in the order of their ids
+        :return: None
+        """
+        if not events:
+            return
+        with self.lock:
+            if not self.last_id:
+                self.origin = events[0].id - 1
+            elif events[0].id != self.last_id + 1:
+                # missed while reconnecting, read expects consecutive ids and reports the gap as skipped events
+                self.events.clear()
+            self.last_id = events[-1].id
+            waiters: list = self.append(events)
+        self.wake(waiters)
+
+    def append(self, events: List[Event]) -> list:
+        # the lock must be held, returns the waiters to wake up
+        self.events.extend(events)
+        for subscriber in self.subscribers:
+            subscriber(events)
+        return list(self.waiters)
+
+    @staticmethod
+    def wake(waiters: list) -> None:
+        for loop, flag in waiters:
+            try:
+                loop.call_soon_threadsafe(flag.set)
+            except RuntimeError:
+                # loop of a stopped server
+                pass
+
+    def publish_block(self, block: dict) -> None:
+        self.publish([block_event(block)])
+
+    def ranking_published(self, index: RankingIndex, before: RankingView) -> None:
+        """
+        Hook for Rankings.publish, publishes the changes of the top wallets of a ranking.
+        :param index: published ranking
+        :param before: view of the ranking before the publish
+        :return: None
+        """
+        if self.clients or self.remote_clients:
+            self.publish(ranking_events(index, before))
+
+    def read(self, after: int) -> Tuple[List[Event], int]:
+        """
+        Events after an event id.
+        :param after: id of the last event the client got
+        :return: tuple of the events and the number of events which already left the buffer
+        """
+        with self.lock:
+            after = max(after, self.origin)
+            if after >= self.last_id or not self.events:
+                return [], 0
+            first: int = self.events[0].id
+            return list(itertools.islice(self.events, max(0, after + 1 - first), None)), max(0, first - after - 1)
+
+    async def stream(self, denoms: Optional[Set[str]], types: Set[str], top: int,
+                     last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Server-sent events of a client. Ends when the client disconnects and the response cancels it.
+        :param denoms: denoms of the ranking events, None for all denoms
+        :param types: event types sent to the client
+        :param top: top wallets per denom the client watches
+        :param last_event_id: id of the last event of a former connection, the stream resumes after it
+        :return: async generator of encoded events
+        """
+        flag = asyncio.Event()
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        waiter: Tuple[asyncio.AbstractEventLoop, asyncio.Event] = (loop, flag)
+        with self.lock:
+            cursor: int = last_event_id if last_event_id is not None and last_event_id <= self.last_id else self.last_id
+            self.waiters.add(waiter)
+            self.clients += 1
+            EVENT_CLIENTS.set(self.clients)
+        try:
+            yield b"retry: 5000\n\n"
+            written_at: float = loop.time()
+            while True:
+                # cleared before reading, an event published meanwhile sets it again
+                flag.clear()
+                events, missed = self.read(cursor)
+                chunks: List[bytes] = []
+                if missed:
+                    LAGGED_CLIENTS.inc()
+                    chunks.append(b"event: %s\ndata: %s\n\n" % (LAGGED.encode(), json.dumps({"missed": missed}).encode()))
+                for event in events:
+                    cursor = event.id
+                    if event.denom is not None and denoms is not None and event.denom not in denoms:
+                        continue
+                    name: Optional[str] = event.name(top)
+                    if name in types:
+                        chunks.append(b"id: %d\nevent: %s\ndata: %s\n\n" % (event.id, name.encode(), event.data))
+                if chunks:
+                    # waits while the client does not take more data
+                    yield b"".join(chunks)
+                    written_at = loop.time()
+                if events:
+                    continue
+                try:
+                    await asyncio.wait_for(flag.wait(), timeout=max(0.0, written_at + self.heartbeat - loop.time()))
+                except asyncio.TimeoutError:
+                    pass
+                # also if all events were filtered out, proxies close idle connections
+                if loop.time() - written_at >= self.heartbeat:
+                    yield b": keep-alive\n\n"
+                    written_at = loop.time()
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+                self.clients -= 1
+                EVENT_CLIENTS.set(self.clients)
+
+
+class EventRelay:
+    """
+    Relays the events of the updater process to the API worker processes over a unix socket. Every worker connects with
+    follow_relay and gets all events with their ids. It reports the number of its streaming clients back, ranking events
+    are only computed while any worker has one. A worker not taking the events within EVENTS_RELAY_TIMEOUT is dropped
+    and connects again, its clients get a lagged event if they missed more than the buffer holds.
+    """
+
+    def __init__(self, path: str, broker: EventBroker, timeout: float = EVENTS_RELAY_TIMEOUT):
+        """
+        :param path: path of the socket, see EVENTS_SOCKET
+        :param broker: broker of the events to relay
+        :param timeout: seconds a worker may not take events
+        """
+        self.path: str = path
+        self.broker: EventBroker = broker
+        self.timeout: float = timeout
+        self.queue: queue.Queue = queue.Queue()
+        # connection -> clients of the worker
+        self.connections: Dict[socket.socket, int] = {}
+        self.lock = threading.Lock()
+
+    def run(self, on_error: Optional[Callable[[Exception], None]] = None) -> None:
+        """
+        Accept the API worker processes, runs forever.
+        :param on_error: called with errors of accepting a worker, optional
+        :return: None
+        """
+        if os.path.exists(self.path):
+            # left behind by a former run
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        self.broker.subscribe(self.queue.put)
+        sender = threading.Thread(target=self.send, daemon=True)
+        sender.setName("RichList Event Relay Sender Thread")
+        sender.start()
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError as error:
+                if on_error is not None:
+                    on_error(error)
+                time.sleep(1)
+                continue
+            connection.settimeout(self.timeout)
+            with self.lock:
+                self.connections[connection] = 0
+            receiver = threading.Thread(target=self.receive, args=(connection,), daemon=True)
+            receiver.setName("RichList Event Relay Receiver Thread")
+            receiver.start()
+
+    def send(self) -> None:
+        # in the order the broker appended the events, publishing never waits for a worker
+        while True:
+            events: List[Event] = self.queue.get()
+            data: bytes = b"".join(encode_event(event) for event in events)
+            with self.lock:
+                connections: List[socket.socket] = list(self.connections)
+            for connection in connections:
+                try:
+                    connection.sendall(data)
+                except OSError:
+                    self.drop(connection)
+
+    def receive(self, connection: socket.socket) -> None:
+        # client counts reported by a worker, one per line
+        buffer: bytes = b""
+        try:
+            while True:
+                try:
+                    chunk: bytes = connection.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                if lines:
+                    self.set_clients(connection, int(lines[-1]))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.drop(connection)
+
+    def set_clients(self, connection: socket.socket, clients: int) -> None:
+        with self.lock:
+            if connection in self.connections:
+                self.connections[connection] = clients
+                self.broker.remote_clients = sum(self.connections.values())
+
+    def drop(self, connection: socket.socket) -> None:
+        with self.lock:
+            self.connections.pop(connection, None)
+            self.broker.remote_clients = sum(self.connections.values())
+        connection.close()
+
+
+def follow_relay(path: str, broker: EventBroker, on_error: Optional[Callable[[Exception], None]] = None,
+                 interval: float = 1.0) -> None:
+    """
+    Receive the events of the updater process in an API worker process and report the clients of the worker, runs
+    forever and connects again after errors.
+    :param path: path of the socket of the EventRelay
+    :param broker: broker of this process the events are relayed to
+    :param on_error: called with every lost or failed connection, optional
+    :param interval: seconds between two connection attempts, also the max delay of a changed client count
+    :return: None
+    """
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.connect(path)
+                connection.settimeout(interval)
+                reported: Optional[int] = None
+                buffer: bytes = b""
+                while True:
+                    if broker.clients != reported:
+                        reported = broker.clients
+                        connection.sendall(b"%d\n" % reported)
+                    try:
+                        chunk: bytes = connection.recv(65536)
+                    except socket.timeout:
+                        continue
+                    if not chunk:
+                        raise ConnectionError("Event relay closed the connection")
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b"\n")
+                    broker.relay([decode_event(line) for line in lines])
+        except (OSError, ValueError) as error:
+            if on_error is not None:
+                on_error(error)
+        time.sleep(interval)
+
+
+# Broker of the rank and block events, fed by the update and block threads of this process or by the EventRelay of the
+# updater process in API worker processes
+EVENTS = EventBroker()
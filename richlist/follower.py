@@ -0,0 +1,125 @@
+import json
+import os
+import re
+import threading
+from typing import List, Optional, Set
+
+from utils.exception import RequestTimedOut, NodeIsCatchingUp, TooManyRequests
+from utils.metrics import counter, gauge
+from utils.rest import get_transactions
+
+# Blocks requested per poll of the block feed, blocks older than that are lost if the follower falls behind
+FOLLOWER_MAX_BLOCKS = int(os.getenv("FOLLOWER_MAX_BLOCKS")) if os.getenv("FOLLOWER_MAX_BLOCKS") else 100
+# Transactions requested per page of a block
+FOLLOWER_TRANSACTIONS_LIMIT = 200
+
+# Wallet addresses inside transactions, validator operator addresses (swthvaloper1...) do not match
+ADDRESS_PATTERN = re.compile(r"\bt?swth1[02-9ac-hj-np-z]{38}\b")
+
+FOLLOWED_HEIGHT = gauge("richlist_follower_height", "Last block scanned for changed wallets.")
+CHANGED_ADDRESSES = counter("richlist_follower_changed_addresses_total", "Wallet addresses found in transactions.")
+FOLLOWER_GAPS = counter("richlist_follower_gaps_total", "Times blocks were missed and wallets need a full refresh.")
+
+
+def addresses_of(transaction: dict) -> Set[str]:
+    """
+    All wallet addresses involved in a transaction: the signer and every address inside its messages, like receivers
+    of transfers or delegators.
+    :param transaction: transaction as returned by '/get_transactions'
+    :return: set of addresses
+    """
+    addresses: Set[str] = set()
+    if transaction.get("address"):
+        addresses.add(transaction["address"])
+    for message in transaction.get("msgs") or []:
+        msg = message.get("msg")
+        text: str = msg if isinstance(msg, str) else json.dumps(msg)
+        addresses.update(ADDRESS_PATTERN.findall(text))
+    return addresses
+
+
+class BlockFollower:
+    """
+    Follows the block feed polled by update_block_height and collects the wallets touched by the transactions of
+    every new block. The update thread takes them with pop_changed() and refreshes exactly these wallets.
+
+    followed_since is the first height of the current unbroken run of scanned blocks. Changes of a wallet checked at
+    or after that height are known to the follower, older wallets fall back to the block spread based refresh.
+    """
+
+    def __init__(self):
+        self.height: Optional[int] = None
+        self.followed_since: Optional[int] = None
+        self.changed: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def covers(self, height: int) -> bool:
+        """
+        Check if every block after the given height was scanned for changes.
+        :param height: block height, e.g. last checked height of a wallet
+        :return: True if the follower would have seen any change since then
+        """
+        followed_since: Optional[int] = self.followed_since
+        return followed_since is not None and height >= followed_since
+
+    def follow(self, blocks: List[dict]) -> None:
+        """
+        Scan the blocks not seen yet. Stops at the first block whose transactions can not be fetched, the block is
+        scanned again with the next poll.
+        :param blocks: latest blocks as returned by get_blocks, newest first
+        :return: None
+        """
+        if not blocks:
+            return
+        heights: List[int] = sorted(int(block["block_height"]) for block in blocks)
+        counts: dict = {int(block["block_height"]): block.get("count") for block in blocks}
+        if self.height is None or heights[0] > self.height + 1:
+            if self.height is not None:
+                FOLLOWER_GAPS.inc()
+            # nothing is known about blocks before the first one, start a new run from there
+            self.height = heights[0] - 1
+            self.followed_since = heights[0]
+        for height in heights:
+            if height <= self.height:
+                continue
+            if counts[height] is None or int(counts[height]) > 0:
+                try:
+                    addresses: Set[str] = self.scan(height)
+                except (RequestTimedOut, NodeIsCatchingUp, TooManyRequests):
+                    return
+                if addresses:
+                    CHANGED_ADDRESSES.inc(len(addresses))
+                    with self.lock:
+                        self.changed.update(addresses)
+            self.height = height
+            FOLLOWED_HEIGHT.set(height)
+
+    def scan(self, height: int) -> Set[str]:
+        addresses: Set[str] = set()
+        before_id: Optional[int] = None
+        while True:
+            transactions: list = get_transactions(height=height, before_id=before_id, limit=FOLLOWER_TRANSACTIONS_LIMIT)
+            for transaction in transactions:
+                addresses.update(addresses_of(transaction))
+            if len(transactions) < FOLLOWER_TRANSACTIONS_LIMIT:
+                return addresses
+            before_id = min(int(transaction["id"]) for transaction in transactions)
+
+    def mark(self, addresses: Set[str]) -> None:
+        """
+        Put wallets on the refresh queue again, e.g. after their refresh failed.
+        :param addresses: wallet addresses
+        :return: None
+        """
+        with self.lock:
+            self.changed.update(addresses)
+
+    def pop_changed(self) -> Set[str]:
+        """
+        Take all wallets changed since the last call.
+        :return: set of wallet addresses
+        """
+        with self.lock:
+            changed: Set[str] = self.changed
+            self.changed = set()
+        return changed
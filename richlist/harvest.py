@@ -0,0 +1,171 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from richlist.balance import base_units
+from richlist.refresh import limited
+from utils.cosmos import COSMOS_BASE_URI, iter_validator_delegations
+from utils.exception import DelegationDoesNotExist, UnexpectedResponse, ValidatorDoesNotExist
+from utils.metrics import counter, gauge
+
+# Validators whose delegations are fetched at the same time during discovery
+HARVEST_CONCURRENCY = int(os.getenv("HARVEST_CONCURRENCY")) if os.getenv("HARVEST_CONCURRENCY") else 8
+# Delegations per page of a validator delegation list
+HARVEST_PAGE_SIZE = int(os.getenv("HARVEST_PAGE_SIZE")) if os.getenv("HARVEST_PAGE_SIZE") else 1000
+# Max blocks harvested delegations are used instead of the delegations call of a wallet, discovery runs again
+# once they are older
+HARVEST_MAX_AGE_BLOCKS = int(os.getenv("HARVEST_MAX_AGE_BLOCKS")) if os.getenv("HARVEST_MAX_AGE_BLOCKS") else 5000
+
+HARVEST_CALLS = counter("richlist_harvest_calls_total", "Upstream calls of the delegation harvest.")
+SAVED_CALLS = counter("richlist_harvest_saved_calls_total",
+                      "Delegator delegations calls skipped because harvested delegations were used.")
+HARVESTED_DELEGATORS = gauge("richlist_harvest_delegators", "Delegators of the last delegation harvest.")
+
+
+def harvest_validator(validator: str, owns: Callable[[str], bool],
+                      page_size: int = HARVEST_PAGE_SIZE) -> Tuple[Dict[str, Dict[str, int]], int]:
+    """
+    Fetch all delegations of a validator page by page. Any failed page fails the whole validator, a partial list
+    would drop the delegations of the remaining delegators.
+    :param validator: operator address of the validator
+    :param owns: delegators of other shards are counted but not kept
+    :param page_size: delegations per page
+    :return: tuple of delegator -> denom -> staked base units and the number of calls
+    """
+    totals: Dict[str, Dict[str, int]] = {}
+    page: int = 1
+    first: Optional[dict] = None
+    while True:
+        count: int = 0
+        try:
+            for delegation in iter_validator_delegations(validator, page, page_size):
+                # a node without pagination returns the whole list for every page
+                if count == 0 and page > 1 and delegation == first:
+                    return totals, page
+                if count == 0 and page == 1:
+                    first = delegation
+                count += 1
+                address: str = delegation["delegator_address"]
+                if not owns(address):
+                    continue
+                denom: str = delegation["balance"]["denom"]
+                staked: Dict[str, int] = totals.setdefault(address, {})
+                staked[denom] = staked.get(denom, 0) + base_units(delegation["balance"]["amount"])
+        except (DelegationDoesNotExist, ValidatorDoesNotExist):
+            # unbonded validators without any delegation, the list of a validator can not vanish after its first page
+            if page == 1:
+                return totals, page
+            raise UnexpectedResponse(f"Delegations of {validator} ended at page {page} without a partial page")
+        if count != page_size:
+            return totals, page
+        page += 1
+
+
+class DelegationHarvest:
+    """
+    Staked amounts of all delegators taken from the delegation lists of the validators. One harvest costs a few calls
+    per validator and replaces the delegations call of every refreshed wallet for HARVEST_MAX_AGE_BLOCKS.
+
+    Delegations only change with transactions of the delegator, so the harvested amounts of a wallet stay valid until
+    the block follower sees the wallet in a transaction. Such wallets and all wallets after blocks the follower
+    missed use the delegations call again until the next harvest.
+    """
+
+    def __init__(self, covers: Callable[[int], bool], max_age: int = HARVEST_MAX_AGE_BLOCKS):
+        """
+        :param covers: checks if the block follower saw every block after a height, e.g. BlockFollower.covers
+        :param max_age: max blocks the harvested amounts are used
+        """
+        self.covers: Callable[[int], bool] = covers
+        self.max_age: int = max_age
+        self.lock = threading.Lock()
+        self.height: Optional[int] = None
+        # delegator -> denom -> staked base units, delegators without delegations are not part of it
+        self.totals: Dict[str, Dict[str, int]] = {}
+        # wallets changed since the harvest
+        self.stale: Set[str] = set()
+        self.saved: int = 0
+
+    def expired(self, block_height: int) -> bool:
+        return self.height is None or block_height - self.height > self.max_age
+
+    def due(self, block_height: int) -> bool:
+        """
+        Check if the delegations should be harvested again.
+        :param block_height: current block height
+        :return: True if the harvest expired or the follower missed blocks since it but follows the chain again
+        """
+        return self.expired(block_height) or (not self.covers(self.height) and self.covers(block_height))
+
+    def harvest(self, validators: Iterable[str], owns: Callable[[str], bool], block_height: int) -> Tuple[int, int]:
+        """
+        Fetch the delegations of all validators concurrently and replace the harvested amounts. A failed validator
+        fails the harvest and the former amounts are kept.
+        :param validators: operator addresses of all validators
+        :param owns: only delegators this process is responsible for are kept
+        :param block_height: current block height
+        :return: tuple of delegators and calls
+        """
+        totals: Dict[str, Dict[str, int]] = {}
+        calls: int = 0
+        with ThreadPoolExecutor(max_workers=HARVEST_CONCURRENCY, thread_name_prefix="RichList Harvest") as executor:
+            # every validator holds one slot of the cosmos host while its pages download
+            futures: List = [executor.submit(limited, COSMOS_BASE_URI, harvest_validator, validator, owns)
+                             for validator in validators]
+            for future in as_completed(futures):
+                try:
+                    delegators, pages = future.result()
+                except Exception:
+                    # the harvest is incomplete anyway, validators not started yet are not fetched
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                calls += pages
+                for address, staked in delegators.items():
+                    merged: Dict[str, int] = totals.setdefault(address, {})
+                    for denom, amount in staked.items():
+                        merged[denom] = merged.get(denom, 0) + amount
+        HARVEST_CALLS.inc(calls)
+        self.replace(totals, block_height)
+        return len(totals), calls
+
+    def replace(self, totals: Dict[str, Dict[str, int]], block_height: int) -> None:
+        """
+        Use new harvested amounts, e.g. the part of a harvest done by another process.
+        :param totals: delegator -> denom -> staked base units
+        :param block_height: block height of the harvest
+        :return: None
+        """
+        HARVESTED_DELEGATORS.set(len(totals))
+        with self.lock:
+            self.totals = totals
+            self.height = block_height
+            self.stale = set()
+
+    def invalidate(self, addresses: Iterable[str]) -> None:
+        with self.lock:
+            self.stale.update(addresses)
+
+    def take(self, address: str, block_height: int) -> Optional[Dict[str, int]]:
+        """
+        Harvested amounts of a wallet. The saved call is counted with count_saved once the refresh of the wallet
+        succeeded.
+        :param address: wallet address
+        :param block_height: current block height
+        :return: denom -> staked base units or None if the delegations call is required
+        """
+        with self.lock:
+            if self.expired(block_height) or not self.covers(self.height) or address in self.stale:
+                return None
+            return self.totals.get(address, {})
+
+    def count_saved(self) -> None:
+        with self.lock:
+            self.saved += 1
+        SAVED_CALLS.inc()
+
+    def pop_saved(self) -> int:
+        with self.lock:
+            saved, self.saved = self.saved, 0
+        return saved
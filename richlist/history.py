@@ -0,0 +1,270 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from richlist.balance import format_units
+from utils.metrics import counter
+
+# Changes of a denom after which its next keyframe is written, at least as many as the denom has holders. Keyframes
+# never take more rows than the changes they cover, so history grows at most twice as fast as the changes
+HISTORY_KEYFRAME_CHANGES = int(os.getenv("HISTORY_KEYFRAME_CHANGES")) if os.getenv("HISTORY_KEYFRAME_CHANGES") else 100000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_addresses (
+    id INTEGER PRIMARY KEY,
+    address TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS history_denoms (
+    id INTEGER PRIMARY KEY,
+    denom TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS balance_changes (
+    id INTEGER PRIMARY KEY,
+    height INTEGER NOT NULL,
+    address_id INTEGER NOT NULL,
+    denom_id INTEGER NOT NULL,
+    delta NOT NULL
+);
+CREATE INDEX IF NOT EXISTS balance_changes_by_denom ON balance_changes (denom_id, id);
+CREATE INDEX IF NOT EXISTS balance_changes_by_address ON balance_changes (address_id, height);
+CREATE TABLE IF NOT EXISTS balance_keyframes (
+    denom_id INTEGER NOT NULL,
+    change_id INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (denom_id, change_id)
+) WITHOUT ROWID;
+"""
+
+# Deltas beyond 64 bit, e.g. of 18 decimal tokens, are stored as text
+MAX_INTEGER = pow(2, 63) - 1
+
+HISTORY_CHANGES = counter("richlist_history_changes_total", "Balance changes appended to the history.")
+HISTORY_KEYFRAMES = counter("richlist_history_keyframes_total", "Keyframes written to the history.")
+
+
+def balance_changes(before: dict, after: dict) -> List[Tuple[str, int, int]]:
+    """
+    Changes of the totals between two states of a wallet.
+    :param before: wallet before the refresh
+    :param after: wallet after the refresh
+    :return: list of (denom, height, delta), empty if no total changed
+    """
+    changes: List[Tuple[str, int, int]] = []
+    height: int = after["last_checked_height"]
+    for denom in set(before["balance"]) | set(after["balance"]):
+        old: int = before["balance"][denom].total if denom in before["balance"] else 0
+        new: int = after["balance"][denom].total if denom in after["balance"] else 0
+        if old != new:
+            changes.append((denom, height, new - old))
+    return changes
+
+
+def encode_delta(delta: int):
+    return delta if -MAX_INTEGER <= delta <= MAX_INTEGER else str(delta)
+
+
+class HistoryStore:
+    """
+    Time series of the total balance per wallet and denom. Every refresh that changes a total appends the difference
+    to the previous total as one row, so an unchanged wallet costs nothing and a change costs a few bytes. Addresses
+    and denoms are stored once and referenced by id.
+
+    Keyframes hold the totals of all holders of a denom up to a change id. The state at a height is the latest
+    keyframe whose changes are all at or before that height plus the later changes up to that height. Changes may
+    be committed after a keyframe although they happened at a lower height, they are never part of that keyframe
+    because keyframes are bound to change ids, not heights.
+
+    The tables live in the wallet database and are written in the same transaction as the wallets.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock):
+        self.connection: sqlite3.Connection = connection
+        self.lock = lock
+        self.connection.executescript(SCHEMA)
+        self.address_ids: Dict[str, int] = {}
+        self.addresses: Dict[int, str] = {}
+        self.denom_ids: Dict[str, int] = {}
+        # changes per denom id since its last keyframe, loaded on first write
+        self.pending: Optional[Dict[int, int]] = None
+        # changes per denom id before its next keyframe
+        self.thresholds: Dict[int, int] = {}
+
+    @classmethod
+    def open(cls, path: str) -> "HistoryStore":
+        """
+        Open a history with its own connection, e.g. to read it from the API while the update thread writes.
+        :param path: path of the wallet database
+        :return: history store
+        """
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return cls(connection, threading.Lock())
+
+    def address_id(self, address: str) -> int:
+        if address not in self.address_ids:
+            self.connection.execute("INSERT OR IGNORE INTO history_addresses (address) VALUES (?)", (address,))
+            self.address_ids[address] = self.connection.execute(
+                "SELECT id FROM history_addresses WHERE address = ?", (address,)).fetchone()[0]
+        return self.address_ids[address]
+
+    def denom_id(self, denom: str, create: bool = True) -> Optional[int]:
+        if denom not in self.denom_ids:
+            if create:
+                self.connection.execute("INSERT OR IGNORE INTO history_denoms (denom) VALUES (?)", (denom,))
+            row: Optional[tuple] = self.connection.execute("SELECT id FROM history_denoms WHERE denom = ?",
+                                                           (denom,)).fetchone()
+            if row is None:
+                return None
+            self.denom_ids[denom] = row[0]
+        return self.denom_ids[denom]
+
+    def reset(self) -> None:
+        # after a rollback, ids and counts of the failed transaction are gone
+        self.address_ids = {}
+        self.denom_ids = {}
+        self.pending = None
+
+    def known_addresses(self) -> Set[str]:
+        """
+        Addresses with at least one change in the history.
+        :return: set of addresses
+        """
+        with self.lock:
+            return {address for (address,) in self.connection.execute("SELECT address FROM history_addresses")}
+
+    def write(self, changes: Iterable[Tuple[str, str, int, int]]) -> None:
+        """
+        Append changes inside the transaction of the caller, which holds the lock. Writes a keyframe for every denom
+        with enough changes since its last one.
+        :param changes: list of (address, denom, height, delta)
+        :return: None
+        """
+        rows: List[tuple] = [(height, self.address_id(address), self.denom_id(denom), encode_delta(delta))
+                             for address, denom, height, delta in changes]
+        if not rows:
+            return
+        self.connection.executemany("INSERT INTO balance_changes (height, address_id, denom_id, delta) "
+                                    "VALUES (?, ?, ?, ?)", rows)
+        HISTORY_CHANGES.inc(len(rows))
+        if self.pending is None:
+            self.pending = self.count_pending()
+        else:
+            for row in rows:
+                self.pending[row[2]] = self.pending.get(row[2], 0) + 1
+        for denom_id, pending in list(self.pending.items()):
+            if pending >= self.thresholds.get(denom_id, HISTORY_KEYFRAME_CHANGES):
+                self.write_keyframe(denom_id)
+
+    def count_pending(self) -> Dict[int, int]:
+        return {denom_id: count for denom_id, count in self.connection.execute(
+            "SELECT c.denom_id, COUNT(*) FROM balance_changes c WHERE c.id > COALESCE("
+            "(SELECT MAX(k.change_id) FROM balance_keyframes k WHERE k.denom_id = c.denom_id), 0) "
+            "GROUP BY c.denom_id")}
+
+    def write_keyframe(self, denom_id: int) -> None:
+        change_id, height, totals = self.replay(denom_id, None)
+        # keyframes are only worth it once they replace at least as many changes as they take
+        self.thresholds[denom_id] = max(HISTORY_KEYFRAME_CHANGES, len(totals))
+        if len(totals) > self.pending[denom_id]:
+            return
+        data: bytes = zlib.compress(json.dumps(sorted(totals.items()), separators=(",", ":")).encode("utf-8"))
+        self.connection.execute("INSERT OR REPLACE INTO balance_keyframes (denom_id, change_id, height, data) "
+                                "VALUES (?, ?, ?, ?)", (denom_id, change_id, height, data))
+        self.pending[denom_id] = 0
+        HISTORY_KEYFRAMES.inc()
+
+    def replay(self, denom_id: int, height: Optional[int]) -> Tuple[int, int, Dict[int, int]]:
+        """
+        Totals of all holders of a denom, inside a transaction of the caller.
+        :param denom_id: id of the denom
+        :param height: block height, None for the latest state
+        :return: tuple of the last change id and the highest height included and address id -> total
+        """
+        query: str = "SELECT change_id, height, data FROM balance_keyframes WHERE denom_id = ?"
+        parameters: tuple = (denom_id,)
+        if height is not None:
+            query += " AND height <= ?"
+            parameters += (height,)
+        keyframe: Optional[tuple] = self.connection.execute(query + " ORDER BY change_id DESC LIMIT 1",
+                                                            parameters).fetchone()
+        change_id, last_height, totals = 0, 0, {}
+        if keyframe is not None:
+            change_id, last_height = keyframe[0], keyframe[1]
+            totals = {address_id: total for address_id, total in json.loads(zlib.decompress(keyframe[2]))}
+        query = "SELECT id, height, address_id, delta FROM balance_changes WHERE denom_id = ? AND id > ?"
+        parameters = (denom_id, change_id)
+        if height is not None:
+            query += " AND height <= ?"
+            parameters += (height,)
+        for change_id_row, change_height, address_id, delta in self.connection.execute(query, parameters):
+            totals[address_id] = totals.get(address_id, 0) + int(delta)
+            change_id = max(change_id, change_id_row)
+            last_height = max(last_height, change_height)
+        return change_id, last_height, {address_id: total for address_id, total in totals.items() if total}
+
+    def ranking_at(self, denom: str, height: int) -> List[Tuple[str, int]]:
+        """
+        Ranking of a denom as it was at a block height.
+        :param denom: denom
+        :param height: block height
+        :return: list of (address, total) sorted like the live ranking
+        """
+        with self.lock:
+            denom_id: Optional[int] = self.denom_id(denom, create=False)
+            if denom_id is None:
+                return []
+            # one read transaction, keyframe and changes belong to the same state
+            self.connection.execute("BEGIN")
+            try:
+                _, _, totals = self.replay(denom_id, height)
+                self.load_addresses()
+            finally:
+                self.connection.execute("COMMIT")
+            ranking: List[Tuple[str, int]] = [(self.addresses[address_id], total) for address_id, total in totals.items()]
+        ranking.sort(key=lambda entry: (-entry[1], entry[0]))
+        return ranking
+
+    def load_addresses(self) -> None:
+        # ids never change, only fetch the ones added since the last call
+        known: int = max(self.addresses) if self.addresses else 0
+        for address_id, address in self.connection.execute(
+                "SELECT id, address FROM history_addresses WHERE id > ?", (known,)):
+            self.addresses[address_id] = address
+
+    def wallet_history(self, address: str, denom: Optional[str] = None) -> List[Tuple[str, int, int]]:
+        """
+        Totals of a wallet after every change.
+        :param address: wallet address
+        :param denom: only this denom if set
+        :return: list of (denom, height, total) sorted by height
+        """
+        with self.lock:
+            row: Optional[tuple] = self.connection.execute("SELECT id FROM history_addresses WHERE address = ?",
+                                                           (address,)).fetchone()
+            if row is None:
+                return []
+            rows: List[tuple] = self.connection.execute(
+                "SELECT d.denom, c.height, c.delta FROM balance_changes c JOIN history_denoms d ON d.id = c.denom_id "
+                "WHERE c.address_id = ? ORDER BY c.height, c.id", (row[0],)).fetchall()
+        totals: Dict[str, int] = {}
+        history: List[Tuple[str, int, int]] = []
+        for change_denom, height, delta in rows:
+            totals[change_denom] = totals.get(change_denom, 0) + int(delta)
+            if denom is None or change_denom == denom:
+                history.append((change_denom, height, totals[change_denom]))
+        return history
+
+
+def serialize_history(history: List[Tuple[str, int, int]], decimals: Dict[str, int]) -> List[dict]:
+    """
+    Wallet history in the format of RichListHistoryEntry.
+    :param history: list of (denom, height, total)
+    :param decimals: denom -> decimals
+    :return: list of dicts with totals as strings
+    """
+    return [{"denom": denom, "height": height, "total": format_units(total, decimals.get(denom, 0))}
+            for denom, height, total in history]
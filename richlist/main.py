@@ -1,27 +1,56 @@
+import os
 import uvicorn
 from threading import Thread
-from fastapi import FastAPI
+import richlist
 import richlist.endpoint
-from richlist import update_richlist, update_block_height
+from richlist import update_richlist, update_block_height, shutdown
+from richlist.api import create_app
+from richlist.events import EVENTS, EVENTS_SOCKET, EventRelay
+from richlist.portfolio import follow_prices
+from richlist.shards import RICHLIST_WORKERS, Coordinator
+from richlist.snapshot import RICHLIST_API_WORKERS, SNAPSHOT_DIRECTORY, SNAPSHOT_PATH_ENV, SnapshotWriter
+from price import load_predefined_coins, main_current_price
+from utils import create_sub_dir
 
 
 if __name__ == "__main__":
-    main_richlist_thread = Thread(target=update_richlist)
-    main_richlist_thread.setName("RichList Update Thread")
-    main_richlist_thread.start()
-    update_block_height_thread = Thread(target=update_block_height)
+    # daemon threads end with the API server, pending wallets are written by shutdown()
+    if RICHLIST_WORKERS:
+        # wallets are refreshed by worker processes, this process only merges their changes
+        richlist.COORDINATOR = Coordinator(RICHLIST_WORKERS)
+        richlist.COORDINATOR.start()
+    else:
+        main_richlist_thread = Thread(target=update_richlist, daemon=True)
+        main_richlist_thread.setName("RichList Update Thread")
+        main_richlist_thread.start()
+    update_block_height_thread = Thread(target=update_block_height, daemon=True)
     update_block_height_thread.setName("RichList Block Height Thread")
     update_block_height_thread.start()
-    tags_metadata = [
-        {
-            "name": "RichList",
-            "description": "Tracks all staking wallets and sort them by their total balance per coin.",
-            "version": "0.1.0"
-        }
-    ]
-    app = FastAPI(title="Additional Tradehub Python API Endpoints",
-                  description="The default API endpoints are lacking of some few interesting data or do not allow simple requests. These endpoints are designed to provide simple to use data.",
-                  version="0.1.0",
-                  openapi_tags=tags_metadata)
-    app.include_router(richlist.endpoint.API_ROUTER, prefix="/richlist", tags=["RichList"])
-    uvicorn.run(app, host="0.0.0.0", port=8001, loop="asyncio")
+    # current prices to value the portfolios
+    load_predefined_coins()
+    price_thread = Thread(target=main_current_price, daemon=True)
+    price_thread.setName("RichList Current Price Thread")
+    price_thread.start()
+    portfolio_thread = Thread(target=follow_prices, daemon=True)
+    portfolio_thread.setName("RichList Portfolio Thread")
+    portfolio_thread.start()
+    if RICHLIST_API_WORKERS:
+        # API worker processes serve the rankings from snapshots written by this process
+        snapshot_path: str = create_sub_dir(richlist.DATABASE_PATH + [SNAPSHOT_DIRECTORY])
+        snapshot_writer = SnapshotWriter(snapshot_path, richlist.endpoint.SHARED_MEMORY_DICT,
+                                         richlist.endpoint.SHARED_PORTFOLIO_DICT)
+        snapshot_thread = Thread(target=snapshot_writer.run, daemon=True,
+                                 kwargs={"on_error": lambda error: richlist.LOGGER.error(f"Writing snapshots failed: {error}")})
+        snapshot_thread.setName("RichList Snapshot Thread")
+        snapshot_thread.start()
+        # the event streams are served by the workers as well
+        event_relay = EventRelay(os.path.join(snapshot_path, EVENTS_SOCKET), EVENTS)
+        event_relay_thread = Thread(target=event_relay.run, daemon=True,
+                                    kwargs={"on_error": lambda error: richlist.LOGGER.error(f"Relaying events failed: {error}")})
+        event_relay_thread.setName("RichList Event Relay Thread")
+        event_relay_thread.start()
+        os.environ[SNAPSHOT_PATH_ENV] = snapshot_path
+        uvicorn.run("richlist.api:app", host="0.0.0.0", port=8001, loop="asyncio", workers=RICHLIST_API_WORKERS)
+    else:
+        uvicorn.run(create_app(), host="0.0.0.0", port=8001, loop="asyncio")
+    shutdown()
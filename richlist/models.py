@@ -29,6 +29,7 @@ class RichListWallet(BaseModel):
     last_checked_height: int = Field(..., description="Last updated block height.", example=6855507)
     username: Optional[str] = Field(None, description="Username if set, Moniker if wallet is from Validator or AMM Name if wallet is Automated Market Maker.", example="Switcheo Wallet #1")
     validator: Optional[str] = Field(None, description="Operator address if wallet is from Validator.")
+    unbonding_completion_time: Optional[str] = Field(None, description="Completion time of the next unbonding entry.", example="2021-02-11T10:17:42.384259Z")
     balance: RichListBalance
 
 
@@ -38,4 +39,91 @@ class RichListTop(BaseModel):
     total_subset: int = Field(description="Total wallets holding the requested denom after applying filters.",  example=10)
     limit: int = Field(description="Parameter limiting the result",  example=10)
     offset: int = Field(description="Parameter offsetting the result",  example=0)
-    wallets: Optional[List[RichListWallet]] = Field(description="Sorted list with wallets. Sort by 'total'")
\ No newline at end of file
+    wallets: Optional[List[RichListWallet]] = Field(description="Sorted list with wallets. Sort by 'total'")
+
+class RichListRank(BaseModel):
+    denom: str = Field(description="Requested denom.", example="swth")
+    rank: int = Field(description="Position in the richlist of the denom, 1 is the richest wallet.", example=42)
+    total: int = Field(description="Total wallets holding the requested denom.", example=1972)
+    wallet: RichListWallet
+
+
+class RichListBucket(BaseModel):
+    min: str = Field(description="Lowest balance of the bucket in whole coins.", example="100")
+    max: str = Field(description="Balance the bucket ends before in whole coins.", example="1000")
+    wallets: int = Field(description="Wallets with a total balance within the bucket.", example=312)
+
+
+class RichListPercentile(BaseModel):
+    percent: int = Field(description="Top percent of the wallets.", example=10)
+    wallets: int = Field(description="Wallets within the top percent.", example=197)
+    balance: str = Field(description="Lowest total balance within the top percent.", example="84120.51000000")
+
+
+class RichListConcentration(BaseModel):
+    top: int = Field(description="Number of the richest wallets.", example=10)
+    balance: str = Field(description="Total balance held by these wallets.", example="512387120.12000000")
+    share: float = Field(description="Share of the supply held by these wallets.", example=0.4312)
+
+
+class RichListStats(BaseModel):
+    denom: str = Field(description="Requested denom.", example="swth")
+    wallets: int = Field(description="Total wallets holding the requested denom.", example=1972)
+    supply: str = Field(description="Sum of the total balances of all wallets.", example="1188239112.52100000")
+    buckets: List[RichListBucket] = Field(description="Wallets per order of magnitude of their total balance.")
+    percentiles: List[RichListPercentile] = Field(description="Balance cutoffs of the top percents of the wallets.")
+    concentration: List[RichListConcentration] = Field(description="Share of the supply held by the richest wallets.")
+
+
+class RichListPortfolioBalance(BaseModel):
+    total: str = Field(..., description="Total balance of the denom.", example="116314290.57018535")
+    price: str = Field(..., description="Price of the denom used for the value.", example="0.01863214")
+    value: str = Field(..., description="Value of the total balance.", example="2167185.36291411")
+
+
+class RichListPortfolioWallet(BaseModel):
+    address: str = Field(..., description="Official 'swth1' address", example="swth1uv20wttn7nvy65m5368zcgrqz99te88z3xa7f8")
+    last_seen_time: str = Field(..., description="Last seen local sentry timestamp.", example="2021-01-25T10:17:42.384259+01:00")
+    last_seen_height: int = Field(..., description="Last seen block height.", example=6733065)
+    last_checked_time: str = Field(..., description="Last updated local sentry timestamp.", example="2021-01-28T12:13:18.203613+01:00")
+    last_checked_height: int = Field(..., description="Last updated block height.", example=6855507)
+    username: Optional[str] = Field(None, description="Username if set, Moniker if wallet is from Validator or AMM Name if wallet is Automated Market Maker.", example="Switcheo Wallet #1")
+    validator: Optional[str] = Field(None, description="Operator address if wallet is from Validator.")
+    unbonding_completion_time: Optional[str] = Field(None, description="Completion time of the next unbonding entry.", example="2021-02-11T10:17:42.384259Z")
+    value: str = Field(..., description="Value of all priced balances.", example="2187301.12000000")
+    balance: Dict[str, RichListPortfolioBalance] = Field(..., description="Priced balances per denom.")
+
+
+class RichListPortfolioTop(BaseModel):
+    vs_currency: str = Field(description="Currency of the values.", example="usd")
+    total: int = Field(description="Total wallets holding any priced denom.", example=1972)
+    total_subset: int = Field(description="Total wallets in the response.", example=10)
+    limit: int = Field(description="Parameter limiting the result", example=10)
+    offset: int = Field(description="Parameter offsetting the result", example=0)
+    wallets: Optional[List[RichListPortfolioWallet]] = Field(description="Sorted list with wallets. Sort by 'value'")
+
+
+class RichListHistoryWallet(BaseModel):
+    address: str = Field(..., description="Official 'swth1' address", example="swth1uv20wttn7nvy65m5368zcgrqz99te88z3xa7f8")
+    total: str = Field(..., description="Total balance at the requested height.", example="116314290.57018535")
+
+
+class RichListHistoryTop(BaseModel):
+    denom: str = Field(description="Requested denom.", example="swth")
+    height: int = Field(description="Requested block height.", example=6855507)
+    total: int = Field(description="Total wallets holding the requested denom at the height.", example=1972)
+    total_subset: int = Field(description="Total wallets in the response.", example=10)
+    limit: int = Field(description="Parameter limiting the result", example=10)
+    offset: int = Field(description="Parameter offsetting the result", example=0)
+    wallets: Optional[List[RichListHistoryWallet]] = Field(description="Sorted list with wallets. Sort by 'total'")
+
+
+class RichListHistoryEntry(BaseModel):
+    denom: str = Field(..., description="Denom of the changed balance.", example="swth")
+    height: int = Field(..., description="Block height the wallet got checked at.", example=6855507)
+    total: str = Field(..., description="Total balance after the change.", example="116314290.57018535")
+
+
+class RichListWalletHistory(BaseModel):
+    address: str = Field(..., description="Official 'swth1' address", example="swth1uv20wttn7nvy65m5368zcgrqz99te88z3xa7f8")
+    changes: List[RichListHistoryEntry] = Field(..., description="Total balances after every change, sorted by height.")
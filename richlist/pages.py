@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from utils.metrics import counter, gauge
+
+# Encoded richlist pages kept in memory, least recently used pages are dropped first
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE")) if os.getenv("PAGE_CACHE_SIZE") else 512
+
+# Generations start again at 1 after a restart, the start time keeps ETags of different processes apart
+STARTED_AT = "%x" % int(time.time())
+
+PAGE_LOOKUPS = counter("richlist_page_cache_lookups_total", "Lookups of encoded richlist pages.", ["result"])
+PAGE_ENTRIES = gauge("richlist_page_cache_entries", "Encoded richlist pages in memory.")
+
+
+def encode(data: dict) -> bytes:
+    """
+    Encode a response body the same way as JSONResponse.
+    :param data: response data
+    :return: json as bytes
+    """
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class PageCache:
+    """
+    Encoded response bodies per (denom, generation, limit, offset). A ranking generation never changes, so a page is
+    encoded once and served as bytes until the next generation replaces it. Pages of old generations are not
+    requested anymore and fall out of the LRU.
+    """
+
+    def __init__(self, size: int = PAGE_CACHE_SIZE):
+        self.size: int = size
+        self.pages: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, build: Callable[[], dict]) -> Tuple[str, bytes]:
+        """
+        Get an encoded page, encode it with build() if it is not cached yet.
+        :param key: (denom, generation, limit, offset) of a page or (denom, generation, "stats")
+        :param build: returns the response data of the page
+        :return: tuple of ETag and body
+        """
+        with self.lock:
+            page: Optional[Tuple[str, bytes]] = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+                PAGE_LOOKUPS.inc(result="hit")
+                return page
+        PAGE_LOOKUPS.inc(result="miss")
+        page = (etag(*key), encode(build()))
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+            PAGE_ENTRIES.set(len(self.pages))
+        return page
+
+    def clear(self) -> None:
+        with self.lock:
+            self.pages.clear()
+            PAGE_ENTRIES.set(0)
+
+
+def etag(*parts, started_at: str = STARTED_AT) -> str:
+    # snapshots carry the start time of the updater, all API workers tag a generation alike
+    return '"' + "-".join(str(part) for part in (started_at,) + parts) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag.
+    :param if_none_match: header value, may hold several tags or '*'
+    :param tag: current ETag
+    :return: True if the client already has the current version
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == tag:
+            return True
+    return False
+
+
+# Pages of all denoms
+PAGE_CACHE = PageCache()
@@ -0,0 +1,164 @@
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import richlist
+import price
+from richlist.balance import format_units, parse_units, scale_of
+from richlist.ranking import RankingIndex, RankingView
+from utils.metrics import counter
+
+# Seconds between two checks of the prices kept by price.main_current_price
+PORTFOLIO_PRICE_INTERVAL = float(os.getenv("PORTFOLIO_PRICE_INTERVAL_SEC")) if os.getenv("PORTFOLIO_PRICE_INTERVAL_SEC") else 10.0
+
+# Prices are kept by the price service with 8 decimals, portfolio values use the same precision
+PRICE_DECIMALS = 8
+
+REVALUED_WALLETS = counter("richlist_portfolio_revalued_wallets_total",
+                           "Portfolios valued again because a balance or a price changed.", ["reason"])
+
+
+class PortfolioIndex:
+    """
+    Ranking of all wallets by the value of all their balances in price.VS_CURRENCY. Values are integers with
+    PRICE_DECIMALS decimals, per denom total * price. The holders of every denom are tracked, a changed price values
+    only its holders again and a changed wallet only itself. Wallets without any priced balance are not ranked.
+
+    Fed by Rankings with the same records as the rankings per denom and published along with them.
+    """
+
+    def __init__(self, shared: dict, vs_currency: str = price.VS_CURRENCY):
+        """
+        :param shared: dict the ranking is published to, e.g. the SHARED_PORTFOLIO_DICT of the endpoint
+        :param vs_currency: currency of the values
+        """
+        self.vs_currency: str = vs_currency
+        self.index: RankingIndex = RankingIndex(vs_currency, decimals=PRICE_DECIMALS)
+        shared[vs_currency] = self.index
+        # denom -> price in units of PRICE_DECIMALS
+        self.prices: Dict[str, int] = {}
+        # latest record per wallet and the wallets holding a denom
+        self.records: Dict[str, dict] = {}
+        self.holders: Dict[str, Set[str]] = {}
+
+    def value(self, record: dict) -> Optional[dict]:
+        """
+        Value a wallet with the current prices.
+        :param record: wallet record of the rankings
+        :return: portfolio record or None if no balance of the wallet has a price
+        """
+        values: Dict[str, int] = {}
+        for denom, balance in record["balance"].items():
+            if denom in self.prices:
+                values[denom] = balance.total * self.prices[denom] // scale_of(balance.decimals)
+        if not values:
+            return None
+        return {
+            "wallet": record,
+            "value": sum(values.values()),
+            "values": values,
+            "prices": {denom: self.prices[denom] for denom in values},
+        }
+
+    def update(self, record: dict) -> None:
+        """
+        Value a changed wallet and reposition it.
+        :param record: wallet record of the rankings
+        :return: None
+        """
+        address: str = record["address"]
+        previous: Optional[dict] = self.records.get(address)
+        denoms: set = set(record["balance"])
+        for denom in (set(previous["balance"]) if previous else set()) - denoms:
+            self.holders[denom].discard(address)
+        for denom in denoms:
+            self.holders.setdefault(denom, set()).add(address)
+        self.records[address] = record
+        self.reposition(record)
+        REVALUED_WALLETS.inc(reason="balance")
+
+    def reposition(self, record: dict) -> None:
+        portfolio: Optional[dict] = self.value(record)
+        if portfolio is None:
+            self.index.discard(record["address"])
+        else:
+            self.index.update(record["address"], portfolio["value"], portfolio)
+
+    def set_prices(self, prices: Dict[str, str]) -> None:
+        """
+        Take new prices and value the holders of every denom whose price changed.
+        :param prices: denom -> price as decimal string
+        :return: None
+        """
+        units: Dict[str, int] = {denom: parse_units(amount, PRICE_DECIMALS) for denom, amount in prices.items()}
+        changed: Set[str] = {denom for denom in set(units) | set(self.prices) if units.get(denom) != self.prices.get(denom)}
+        if not changed:
+            return
+        self.prices = units
+        affected: Set[str] = set()
+        for denom in changed:
+            affected.update(self.holders.get(denom, ()))
+        for address in affected:
+            self.reposition(self.records[address])
+        REVALUED_WALLETS.inc(len(affected), reason="price")
+
+    def rebuild(self, records: List[dict]) -> None:
+        """
+        Value all wallets from scratch.
+        :param records: records of all wallets
+        :return: None
+        """
+        self.records = {}
+        self.holders = {}
+        entries: List[tuple] = []
+        for record in records:
+            self.records[record["address"]] = record
+            for denom in record["balance"]:
+                self.holders.setdefault(denom, set()).add(record["address"])
+            portfolio: Optional[dict] = self.value(record)
+            if portfolio is not None:
+                entries.append((-portfolio["value"], record["address"], portfolio))
+        self.index.rebuild(entries)
+
+    def publish(self) -> None:
+        self.index.publish()
+
+    def view(self) -> RankingView:
+        return self.index.view()
+
+
+def serialize_portfolio(portfolio: dict) -> dict:
+    """
+    Portfolio record in the format of RichListPortfolioWallet.
+    :param portfolio: record of the portfolio ranking
+    :return: dict with balances, prices and values as strings
+    """
+    data: dict = portfolio["wallet"].copy()
+    data["value"] = format_units(portfolio["value"], PRICE_DECIMALS)
+    data["balance"] = {
+        denom: {
+            "total": format_units(portfolio["wallet"]["balance"][denom].total,
+                                  portfolio["wallet"]["balance"][denom].decimals),
+            "price": format_units(portfolio["prices"][denom], PRICE_DECIMALS),
+            "value": format_units(value, PRICE_DECIMALS),
+        } for denom, value in portfolio["values"].items()
+    }
+    return data
+
+
+def follow_prices() -> None:
+    """
+    Threaded function passing the prices kept by price.main_current_price to the rankings whenever they changed.
+    :return: None
+    """
+    seen: Optional[str] = None
+    while True:
+        current: dict = price.SHARED_MEMORY_DICT["current"]
+        if current["epoch_seconds"] != seen and current["prices"]:
+            seen = current["epoch_seconds"]
+            prices: Dict[str, str] = {denom: vs_currencies[price.VS_CURRENCY]
+                                      for denom, vs_currencies in current["prices"].items()
+                                      if price.VS_CURRENCY in vs_currencies}
+            richlist.RANKINGS.set_prices(prices)
+            richlist.LOGGER.info(f"Valued portfolios with {len(prices)} prices")
+        time.sleep(PORTFOLIO_PRICE_INTERVAL)
@@ -0,0 +1,439 @@
+import itertools
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from richlist.balance import format_units, scale_of
+
+# Entries per chunk of a ranking, a change copies one chunk and the list of chunks
+RANKING_CHUNK_SIZE = int(os.getenv("RANKING_CHUNK_SIZE")) if os.getenv("RANKING_CHUNK_SIZE") else 512
+
+# Top percents of the wallets whose balance cutoffs are part of the statistics
+STATS_PERCENTILES = (1, 5, 10, 25, 50)
+# Top wallets whose share of the supply is part of the statistics
+STATS_CONCENTRATION = (10, 100, 1000)
+
+# Generation ids of all published views of this process
+GENERATIONS = itertools.count(1)
+
+
+class RankingView:
+    """
+    Immutable snapshot of a ranking. Chunks are never changed after they got published, so a view stays consistent
+    while the index is updated and can be read without any lock.
+    """
+
+    __slots__ = ("chunks", "maxes", "offsets", "size", "generation", "supply", "buckets")
+
+    def __init__(self, chunks: Tuple[list, ...], maxes: Tuple[tuple, ...], offsets: Tuple[int, ...], size: int,
+                 generation: int = 0, supply: int = 0, buckets: Optional[Dict[int, int]] = None):
+        self.chunks: Tuple[list, ...] = chunks
+        self.maxes: Tuple[tuple, ...] = maxes
+        self.offsets: Tuple[int, ...] = offsets
+        self.size: int = size
+        # unique id of this state of the ranking, used to cache and tag responses built from it
+        self.generation: int = generation
+        # sum of all totals in base units and wallets per balance bucket, see balance_bucket()
+        self.supply: int = supply
+        self.buckets: Dict[int, int] = buckets or {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.records(*item.indices(self.size)[:2])
+        if item < 0:
+            item += self.size
+        if not 0 <= item < self.size:
+            raise IndexError("ranking index out of range")
+        return self.records(item, item + 1)[0]
+
+    def records(self, start: int, stop: int) -> List[dict]:
+        """
+        Records from rank start (inclusive) to stop (exclusive).
+        :param start: first rank, 0 is the richest wallet
+        :param stop: rank to stop before
+        :return: list of wallet records
+        """
+        result: List[dict] = []
+        if start >= stop:
+            return result
+        chunk_index: int = max(0, bisect_right(self.offsets, start) - 1)
+        position: int = start - self.offsets[chunk_index] if self.offsets else 0
+        while chunk_index < len(self.chunks) and len(result) < stop - start:
+            chunk: list = self.chunks[chunk_index]
+            taken = chunk[position:position + stop - start - len(result)]
+            result.extend(entry[2] for entry in taken)
+            chunk_index += 1
+            position = 0
+        return result
+
+    def rank(self, key: tuple) -> int:
+        chunk_index: int = bisect_left(self.maxes, key)
+        if chunk_index == len(self.chunks):
+            return self.size
+        return self.offsets[chunk_index] + bisect_left(self.chunks[chunk_index], key)
+
+    def find(self, key: tuple) -> Optional[int]:
+        """
+        Position of an entry.
+        :param key: (-total, address) of the wallet
+        :return: rank or None if the view has no entry with this key
+        """
+        chunk_index: int = bisect_left(self.maxes, key)
+        if chunk_index == len(self.chunks):
+            return None
+        chunk: list = self.chunks[chunk_index]
+        position: int = bisect_left(chunk, key)
+        if position == len(chunk) or chunk[position][:2] != key:
+            return None
+        return self.offsets[chunk_index] + position
+
+
+class RankingIndex:
+    """
+    Ranking of all wallets owning a denom, sorted by (total descending, address). The entries are kept in sorted
+    chunks, repositioning a wallet is a binary search plus an insert into one small chunk instead of sorting all
+    wallets again. Changes become visible with the next publish(), chunks changed since then are copied once and
+    afterwards changed in place. Only one thread may write, any thread may read via view().
+    """
+
+    def __init__(self, denom: str, chunk_size: int = RANKING_CHUNK_SIZE, decimals: Optional[int] = None):
+        """
+        :param denom: denom of the ranking
+        :param chunk_size: entries per chunk
+        :param decimals: decimals of the ranked totals, taken from the balance of the denom in the records if not set
+        """
+        self.denom: str = denom
+        self.chunk_size: int = chunk_size
+        self.chunks: List[list] = []
+        self.maxes: List[tuple] = []
+        self.keys: Dict[str, tuple] = {}
+        # keys in the current view of the wallets changed since the last publish, None if they were not part of it
+        self.published: Dict[str, Optional[tuple]] = {}
+        # ids of chunks created since the last publish, no view references them yet
+        self.unpublished: set = set()
+        self.dirty: bool = False
+        self.supply: int = 0
+        self.buckets: Dict[int, int] = {}
+        # bucket every wallet got counted in, the decimals of its balance may differ from the ones of later wallets
+        self.wallet_buckets: Dict[str, int] = {}
+        self.fixed_decimals: bool = decimals is not None
+        self.decimals: int = decimals or 0
+        self.current: RankingView = RankingView((), (), (), 0, next(GENERATIONS))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def view(self) -> RankingView:
+        return self.current
+
+    def rank(self, address: str) -> Optional[int]:
+        """
+        Position of a wallet, 0 is the richest.
+        :param address: wallet address
+        :return: rank or None if the wallet does not own the denom
+        """
+        return self.locate(address)[1]
+
+    def locate(self, address: str) -> Tuple[RankingView, Optional[int]]:
+        """
+        Position of a wallet in the current view. A dict lookup of its key and a binary search over the chunks, no
+        rank per address has to be maintained, one changed wallet would move the ranks of all wallets in between.
+        :param address: wallet address
+        :return: tuple of the view and the rank in it, rank is None if the wallet is not part of the view
+        """
+        view: RankingView = self.current
+        for _ in range(2):
+            # wallets changed after the publish have another key in the view
+            key: Optional[tuple] = self.published.get(address, self.keys.get(address))
+            if key is None:
+                return view, None
+            position: Optional[int] = view.find(key)
+            if position is not None:
+                return view, position
+            if view is self.current:
+                return view, None
+            # published meanwhile, look it up in the new view
+            view = self.current
+        return view, None
+
+    def update(self, address: str, total: int, record: dict) -> None:
+        """
+        Insert or reposition a wallet.
+        :param address: wallet address
+        :param total: total balance of the denom in base units
+        :param record: data returned by the endpoint for this wallet
+        :return: None
+        """
+        self.discard(address)
+        entry: tuple = (-total, address, record)
+        key: tuple = entry[:2]
+        self.keys[address] = key
+        self.published.setdefault(address, None)
+        self.dirty = True
+        if not self.fixed_decimals:
+            self.decimals = record["balance"][self.denom].decimals
+        self.supply += total
+        bucket: int = balance_bucket(total, self.decimals)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.wallet_buckets[address] = bucket
+        if not self.chunks:
+            self.chunks.append(self.writable([entry]))
+            self.maxes.append(key)
+            return
+        chunk_index: int = min(bisect_left(self.maxes, key), len(self.chunks) - 1)
+        chunk: list = self.writable(self.chunks[chunk_index])
+        insort(chunk, entry)
+        if len(chunk) > 2 * self.chunk_size:
+            half: int = len(chunk) // 2
+            first, second = chunk[:half], chunk[half:]
+            self.unpublished.update((id(first), id(second)))
+            self.chunks[chunk_index:chunk_index + 1] = [first, second]
+            self.maxes[chunk_index:chunk_index + 1] = [chunk[half - 1][:2], chunk[-1][:2]]
+        else:
+            self.chunks[chunk_index] = chunk
+            self.maxes[chunk_index] = chunk[-1][:2]
+
+    def discard(self, address: str) -> None:
+        """
+        Remove a wallet if it is part of the ranking.
+        :param address: wallet address
+        :return: None
+        """
+        key: Optional[tuple] = self.keys.pop(address, None)
+        if key is None:
+            return
+        self.published.setdefault(address, key)
+        self.dirty = True
+        self.supply += key[0]
+        bucket: int = self.wallet_buckets.pop(address)
+        self.buckets[bucket] -= 1
+        if not self.buckets[bucket]:
+            del self.buckets[bucket]
+        chunk_index: int = bisect_left(self.maxes, key)
+        chunk: list = self.writable(self.chunks[chunk_index])
+        del chunk[bisect_left(chunk, key)]
+        if chunk:
+            self.chunks[chunk_index] = chunk
+            self.maxes[chunk_index] = chunk[-1][:2]
+        else:
+            del self.chunks[chunk_index]
+            del self.maxes[chunk_index]
+
+    def writable(self, chunk: list) -> list:
+        # published chunks may be read by other threads, change a copy of them
+        if id(chunk) in self.unpublished:
+            return chunk
+        chunk = list(chunk)
+        self.unpublished.add(id(chunk))
+        return chunk
+
+    def rebuild(self, entries: List[tuple]) -> None:
+        """
+        Replace the whole ranking.
+        :param entries: list of (-total, address, record)
+        :return: None
+        """
+        ranked: List[tuple] = sorted(entries, key=itemgetter(0, 1))
+        # keys of the current view until the new one got published
+        self.published = self.keys
+        self.keys = {entry[1]: entry[:2] for entry in ranked}
+        self.supply = 0
+        self.buckets = {}
+        self.wallet_buckets = {}
+        for entry in ranked:
+            if not self.fixed_decimals:
+                self.decimals = entry[2]["balance"][self.denom].decimals
+            bucket: int = balance_bucket(-entry[0], self.decimals)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+            self.wallet_buckets[entry[1]] = bucket
+            self.supply -= entry[0]
+        self.chunks = [ranked[i:i + self.chunk_size] for i in range(0, len(ranked), self.chunk_size)]
+        self.maxes = [chunk[-1][:2] for chunk in self.chunks]
+        self.dirty = True
+        self.publish()
+
+    def publish(self) -> None:
+        """
+        Make all changes visible to readers as a new generation.
+        :return: None
+        """
+        if not self.dirty:
+            return
+        offsets: List[int] = []
+        size: int = 0
+        for chunk in self.chunks:
+            offsets.append(size)
+            size += len(chunk)
+        self.unpublished = set()
+        self.dirty = False
+        # a single reference assignment, readers see either the old or the new view
+        self.current = RankingView(tuple(self.chunks), tuple(self.maxes), tuple(offsets), size, next(GENERATIONS),
+                                   self.supply, dict(self.buckets))
+        self.published = {}
+
+
+class Rankings:
+    """
+    Ranking indexes of all denoms. Fed with every changed wallet by the richlist update thread, which publishes the
+    changes after a batch of wallets.
+    """
+
+    def __init__(self, shared: dict, portfolio=None,
+                 on_publish: Optional[Callable[["RankingIndex", RankingView], None]] = None):
+        """
+        :param shared: dict the indexes are published to, e.g. the SHARED_MEMORY_DICT of the endpoint
+        :param portfolio: richlist.portfolio.PortfolioIndex fed with the same wallets, optional
+        :param on_publish: called with every ranking published with changes and its former view, optional
+        """
+        self.shared: dict = shared
+        self.portfolio = portfolio
+        self.on_publish: Optional[Callable[[RankingIndex, RankingView], None]] = on_publish
+        self.denoms: Dict[str, set] = {}
+        self.lock = threading.Lock()
+
+    def index(self, denom: str) -> RankingIndex:
+        if denom not in self.shared:
+            self.shared[denom] = RankingIndex(denom)
+        return self.shared[denom]
+
+    def update_wallet(self, wallet: dict) -> None:
+        """
+        Reposition a wallet in every ranking of its denoms and remove it from rankings of denoms it does not own
+        anymore.
+        :param wallet: changed wallet
+        :return: None
+        """
+        with self.lock:
+            address: str = wallet["address"]
+            denoms: set = set(wallet["balance"].keys())
+            for denom in self.denoms.get(address, set()) - denoms:
+                self.shared[denom].discard(address)
+            record: dict = wallet_record(wallet)
+            for denom in denoms:
+                self.index(denom).update(address, wallet["balance"][denom].total, record)
+            self.denoms[address] = denoms
+            if self.portfolio is not None:
+                self.portfolio.update(record)
+
+    def publish(self) -> None:
+        """
+        Publish a new generation of every changed ranking.
+        :return: None
+        """
+        with self.lock:
+            for index in list(self.shared.values()):
+                before: RankingView = index.view()
+                index.publish()
+                if self.on_publish is not None and index.view() is not before:
+                    self.on_publish(index, before)
+            if self.portfolio is not None:
+                self.portfolio.publish()
+
+    def set_prices(self, prices: Dict[str, str]) -> None:
+        """
+        Value the portfolios with new prices and publish them.
+        :param prices: denom -> price as decimal string
+        :return: None
+        """
+        if self.portfolio is None:
+            return
+        with self.lock:
+            self.portfolio.set_prices(prices)
+            self.portfolio.publish()
+
+    def rebuild(self, wallets: List[dict]) -> None:
+        """
+        Build all rankings from scratch.
+        :param wallets: all wallets
+        :return: None
+        """
+        with self.lock:
+            entries_per_denom: Dict[str, List[tuple]] = {}
+            records: List[dict] = []
+            self.denoms = {}
+            for wallet in wallets:
+                address: str = wallet["address"]
+                record: dict = wallet_record(wallet)
+                records.append(record)
+                self.denoms[address] = set(wallet["balance"])
+                for denom, balance in wallet["balance"].items():
+                    if denom not in entries_per_denom:
+                        entries_per_denom[denom] = []
+                    entries_per_denom[denom].append((-balance.total, address, record))
+            for denom, entries in entries_per_denom.items():
+                self.index(denom).rebuild(entries)
+            if self.portfolio is not None:
+                self.portfolio.rebuild(records)
+
+
+def balance_bucket(total: int, decimals: int) -> int:
+    """
+    Order of magnitude of a balance in whole coins: 0 below 1, 1 from 1 to below 10, 2 from 10 to below 100, ...
+    :param total: balance in base units
+    :param decimals: decimals of the denom
+    :return: bucket
+    """
+    coins: int = total // scale_of(decimals)
+    return len(str(coins)) if coins > 0 else 0
+
+
+def wallet_record(wallet: dict) -> dict:
+    """
+    Snapshot of a wallet shared by the rankings of all its denoms. Balances are replaced and not changed once the
+    wallet got published, so a shallow copy is enough.
+    :param wallet: wallet
+    :return: record
+    """
+    return wallet.copy()
+
+
+def serialize_record(record: dict, denom: str) -> dict:
+    """
+    Record in the format of RichListWallet, containing only the balance of one denom.
+    :param record: record of a ranking
+    :param denom: denom of the ranking
+    :return: dict with the balance as strings
+    """
+    data: dict = record.copy()
+    data["balance"] = record["balance"][denom].to_json()
+    return data
+
+
+def serialize_stats(view: RankingView, denom: str) -> dict:
+    """
+    Distribution statistics of a ranking in the format of RichListStats. Supply and buckets are maintained with every
+    change, cutoffs and shares are read from the view.
+    :param view: view of the ranking
+    :param denom: denom of the ranking
+    :return: dict with balances as strings
+    """
+    decimals: int = view[0]["balance"][denom].decimals if len(view) else 0
+    percentiles: List[dict] = []
+    for percent in STATS_PERCENTILES:
+        # balance of the poorest wallet within the top percent
+        position: int = max(1, len(view) * percent // 100) - 1
+        if position < len(view):
+            percentiles.append({"percent": percent, "wallets": position + 1,
+                                "balance": format_units(view[position]["balance"][denom].total, decimals)})
+    concentration: List[dict] = []
+    for top in STATS_CONCENTRATION:
+        held: int = sum(record["balance"][denom].total for record in view.records(0, top))
+        concentration.append({"top": top, "balance": format_units(held, decimals),
+                              "share": round(held / view.supply, 6) if view.supply else 0.0})
+    buckets: List[dict] = []
+    for bucket in sorted(view.buckets):
+        buckets.append({"min": "0" if bucket == 0 else str(pow(10, bucket - 1)), "max": str(pow(10, bucket)),
+                        "wallets": view.buckets[bucket]})
+    return {
+        "denom": denom,
+        "wallets": len(view),
+        "supply": format_units(view.supply, decimals),
+        "buckets": buckets,
+        "percentiles": percentiles,
+        "concentration": concentration
+    }
@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import richlist
+from richlist.history import balance_changes
+from richlist.scheduler import CALLS_PER_WALLET
+from richlist.writer import WriteBehindWriter
+from utils import PER_ITEM
+from utils.cosmos import (COSMOS_BASE_URI,
+                          get_delegator_delegations,
+                          get_delegator_unbonding_delegations,
+                          get_delegator_distribution,
+                          get_validator_distribution)
+from utils.exception import DelegationDoesNotExist, ValidatorDoesNotExist, RequestTimedOut, NodeIsCatchingUp, TooManyRequests
+from utils.metrics import gauge
+from utils.resilience import host_of
+from utils.rest import REST_BASE_URI, get_balance, get_profile
+
+# Upstream requests in flight at the same time over all wallets
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY")) if os.getenv("REFRESH_CONCURRENCY") else 32
+# Upstream requests in flight at the same time per host
+REFRESH_PER_HOST_CONCURRENCY = int(os.getenv("REFRESH_PER_HOST_CONCURRENCY")) if os.getenv("REFRESH_PER_HOST_CONCURRENCY") else 16
+# Refreshed wallets between two progress reports
+REFRESH_REPORT_EVERY = 100
+
+REFRESH_THROUGHPUT = gauge("richlist_refresh_wallets_per_second", "Wallets per second of the last refresh run.")
+IN_FLIGHT = gauge("richlist_refresh_in_flight_requests", "Upstream requests in flight per host.", ["host"])
+
+# Semaphores limiting the requests per host
+HOST_SEMAPHORES: Dict[str, threading.BoundedSemaphore] = {}
+HOST_SEMAPHORES_LOCK = threading.Lock()
+
+
+def host_semaphore(base_uri: str) -> threading.BoundedSemaphore:
+    host: str = host_of(base_uri)
+    with HOST_SEMAPHORES_LOCK:
+        if host not in HOST_SEMAPHORES:
+            HOST_SEMAPHORES[host] = threading.BoundedSemaphore(REFRESH_PER_HOST_CONCURRENCY)
+        return HOST_SEMAPHORES[host]
+
+
+def limited(base_uri: str, function: Callable, *args):
+    """
+    Call an upstream function while holding a slot of its host.
+    :param base_uri: base uri of the upstream called by the function
+    :param function: upstream function, e.g. get_balance
+    :param args: arguments of the function
+    :return: result of the function
+    """
+    host: str = host_of(base_uri)
+    with host_semaphore(base_uri):
+        IN_FLIGHT.inc(host=host)
+        try:
+            return function(*args)
+        finally:
+            IN_FLIGHT.dec(host=host)
+
+
+class RefreshEngine:
+    """
+    Refreshes many wallets concurrently. The five upstream calls of a wallet run at the same time on a shared pool of
+    REFRESH_CONCURRENCY workers, four while harvested delegations of the wallet are fresh. Wallets are started while
+    their calls fit into the pool, so at most REFRESH_CONCURRENCY calls are in flight, each host is limited to
+    REFRESH_PER_HOST_CONCURRENCY requests. Responses are applied
+    to the wallets by the calling thread only, so balance math and token lookups stay single threaded, and every
+    wallet gets its new balance in one assignment. Wallets are repositioned in the rankings right away, the rankings
+    are published every REFRESH_REPORT_EVERY wallets. Refreshed wallets are handed to the write behind queue.
+    """
+
+    def __init__(self, concurrency: int = REFRESH_CONCURRENCY):
+        self.concurrency: int = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="RichList Refresh")
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def submit_calls(self, address: str, validator) -> Dict[str, Future]:
+        submit = self.executor.submit
+        calls: Dict[str, Future] = {
+            "balance": submit(limited, REST_BASE_URI, get_balance, address),
+            "profile": submit(limited, REST_BASE_URI, get_profile, address),
+            "unbonding": submit(limited, COSMOS_BASE_URI, get_delegator_unbonding_delegations, address),
+        }
+        # harvested delegations replace the delegations call while they are fresh
+        harvested: Optional[Dict[str, int]] = richlist.HARVEST.take(address, int(richlist.BLOCK["block_height"]))
+        if harvested is None:
+            calls["delegations"] = submit(limited, COSMOS_BASE_URI, get_delegator_delegations, address)
+        else:
+            calls["harvested_delegations"] = Future()
+            calls["harvested_delegations"].set_result(harvested)
+        if validator:
+            calls["validator_distribution"] = submit(limited, COSMOS_BASE_URI, get_validator_distribution, validator)
+        else:
+            calls["delegator_distribution"] = submit(limited, COSMOS_BASE_URI, get_delegator_distribution, address)
+        return calls
+
+    def apply(self, wallet: dict, responses: Dict[str, dict], validator_gone: bool) -> List[Tuple[str, int, int]]:
+        """
+        Build the new wallet state from the responses and publish it at once.
+        :return: balance changes as (denom, height, delta) for the history
+        """
+        staged: dict = dict(wallet)
+        # Rest balance to avoid staking/unbonding not to be displayed correct
+        staged["balance"] = {}
+        if validator_gone:
+            richlist.LOGGER.info(f"Validator {wallet['username']} has no more delegations. Treat them as usual wallet.")
+            staged["validator"] = None
+            staged["username"] = None
+        richlist.apply_wallet_balance(staged, responses["balance"])
+        if "delegations" in responses:
+            richlist.apply_delegations(staged, responses["delegations"])
+        else:
+            richlist.apply_delegation_totals(staged, responses["harvested_delegations"])
+        richlist.apply_wallet_info(staged, responses["profile"])
+        richlist.apply_delegator_unbonding_delegation(staged, responses["unbonding"])
+        if "validator_distribution" in responses:
+            richlist.apply_validator_distribution(staged, responses["validator_distribution"])
+        else:
+            richlist.apply_delegator_distribution(staged, responses["delegator_distribution"])
+        block: dict = richlist.BLOCK
+        staged["last_checked_height"] = int(block["block_height"])
+        staged["last_checked_time"] = block["time"]
+        changes: List[Tuple[str, int, int]] = balance_changes(wallet, staged)
+        wallet.update(staged)
+        richlist.RANKINGS.update_wallet(wallet)
+        return changes
+
+    def refresh(self, wallets: Iterable[dict], writer: WriteBehindWriter) -> Tuple[int, int]:
+        """
+        Refresh wallets until all are done or an upstream becomes unhealthy. Failed wallets keep their last checked
+        height and are picked up again in the next round.
+        :param wallets: wallets to refresh
+        :param writer: write behind queue of the refreshed wallets
+        :return: tuple of updated and failed wallets
+        """
+        wallets = list(wallets)
+        total: int = len(wallets)
+        pending = iter(wallets)
+        # wallet address -> (wallet, futures, validator gone)
+        in_flight: Dict[str, Tuple[dict, Dict[str, Future], bool]] = {}
+        future_owner: Dict[Future, str] = {}
+        updated: int = 0
+        failed: int = 0
+        stopped: bool = False
+        # seconds a rate limited host asked to wait, no further wallets are started
+        retry_after: Optional[float] = None
+        start: float = time.perf_counter()
+
+        def start_wallet(wallet: dict, validator, validator_gone: bool) -> None:
+            calls = self.submit_calls(wallet["address"], validator)
+            in_flight[wallet["address"]] = (wallet, calls, validator_gone)
+            for future in calls.values():
+                future_owner[future] = wallet["address"]
+
+        def fill() -> None:
+            nonlocal stopped
+            # keep enough calls in flight to use every worker, one wallet at least if the pool is smaller than a wallet
+            while not stopped and (len(future_owner) + CALLS_PER_WALLET <= self.concurrency or not in_flight):
+                if not richlist.upstreams_available():
+                    richlist.LOGGER.warning(f"Upstream unhealthy, stop refresh after {updated + failed}/{total} wallets.")
+                    stopped = True
+                    return
+                wallet = next(pending, None)
+                if wallet is None:
+                    return
+                richlist.LOGGER.info(f"Start updating {wallet['address']}", extra=PER_ITEM)
+                start_wallet(wallet, wallet["validator"], False)
+
+        fill()
+        while in_flight:
+            done, _ = wait(list(future_owner.keys()), return_when=FIRST_COMPLETED)
+            finished: List[str] = []
+            for future in done:
+                address: str = future_owner.pop(future)
+                if address in in_flight and all(f.done() for f in in_flight[address][1].values()):
+                    finished.append(address)
+            for address in set(finished):
+                wallet, calls, validator_gone = in_flight.pop(address)
+                for future in calls.values():
+                    future_owner.pop(future, None)
+                try:
+                    responses: Dict[str, dict] = {name: future.result() for name, future in calls.items()}
+                    changes = self.apply(wallet, responses, validator_gone)
+                except (DelegationDoesNotExist, ValidatorDoesNotExist):
+                    if wallet["validator"] and not validator_gone:
+                        # Old unbonded validators can have no delegations which causes an API error. Fetch them again
+                        # as usual wallet
+                        start_wallet(wallet, None, True)
+                    else:
+                        richlist.FAILED_WALLETS.inc()
+                        failed += 1
+                    continue
+                except (RequestTimedOut, NodeIsCatchingUp) as error:
+                    richlist.LOGGER.info(f"Updating {address} failed: {error}. Skip wallet.", extra=PER_ITEM)
+                    richlist.FAILED_WALLETS.inc()
+                    failed += 1
+                    continue
+                except TooManyRequests as error:
+                    richlist.LOGGER.info(f"Updating {address} failed: {error}. Skip wallet.", extra=PER_ITEM)
+                    richlist.FAILED_WALLETS.inc()
+                    failed += 1
+                    if not stopped:
+                        richlist.LOGGER.warning(f"Upstream rate limited, stop refresh after {updated + failed}/{total} wallets.")
+                    stopped = True
+                    retry_after = max(retry_after or 0.0, error.retry_after or 0.0)
+                    continue
+                except Exception as error:
+                    # e.g. an unexpected response body or an unknown denom, one wallet must not end the refresh
+                    richlist.LOGGER.warning(f"Updating {address} failed: {error!r}. Skip wallet.")
+                    richlist.FAILED_WALLETS.inc()
+                    failed += 1
+                    continue
+                if "harvested_delegations" in calls:
+                    richlist.HARVEST.count_saved()
+                richlist.UPDATED_WALLETS.inc()
+                updated += 1
+                writer.put(wallet, changes)
+                if updated % REFRESH_REPORT_EVERY == 0:
+                    richlist.RANKINGS.publish()
+                    self.report(updated, total, start)
+            fill()
+
+        richlist.RANKINGS.publish()
+        self.report(updated, total, start)
+        if retry_after:
+            time.sleep(retry_after)
+        return updated, failed
+
+    def report(self, updated: int, total: int, start: float) -> None:
+        duration: float = time.perf_counter() - start
+        throughput: float = updated / duration if duration > 0 else 0.0
+        REFRESH_THROUGHPUT.set(throughput)
+        richlist.LOGGER.info(f"Updated {updated}/{total} wallets in {duration:.1f}s ({throughput:.2f} wallets/s).")
+
+
+def refresh_wallets(wallets: Iterable[dict], writer: WriteBehindWriter) -> Tuple[int, int]:
+    """
+    Refresh wallets with a short lived engine.
+    :param wallets: wallets to refresh
+    :param writer: write behind queue of the refreshed wallets
+    :return: tuple of updated and failed wallets
+    """
+    engine = RefreshEngine()
+    try:
+        return engine.refresh(wallets, writer)
+    finally:
+        engine.shutdown()
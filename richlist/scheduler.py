@@ -0,0 +1,187 @@
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils import timestamp_to_epoch_seconds
+from utils.metrics import gauge
+
+# Upstream calls per minute the wallet refresh may use, a wallet refresh costs CALLS_PER_WALLET calls
+REFRESH_CALLS_PER_MINUTE = float(os.getenv("REFRESH_CALLS_PER_MINUTE")) if os.getenv("REFRESH_CALLS_PER_MINUTE") else 12000.0
+# Max blocks a wallet ranked in the top REFRESH_TOP_RANK of any denom may be behind, every next rank bucket allows ten
+# times more
+REFRESH_TOP_MAX_STALENESS_BLOCKS = int(os.getenv("REFRESH_TOP_MAX_STALENESS_BLOCKS")) if os.getenv("REFRESH_TOP_MAX_STALENESS_BLOCKS") else 100
+REFRESH_TOP_RANK = int(os.getenv("REFRESH_TOP_RANK")) if os.getenv("REFRESH_TOP_RANK") else 100
+# Wallets seen on chain within these blocks are refreshed twice as often
+REFRESH_ACTIVE_BLOCKS = int(os.getenv("REFRESH_ACTIVE_BLOCKS")) if os.getenv("REFRESH_ACTIVE_BLOCKS") else 5000
+
+# Upstream calls of a wallet refresh: balance, profile, delegations, unbonding and distribution
+CALLS_PER_WALLET = 5
+# Rank buckets, a wallet belongs to the bucket of its best rank over all denoms
+RANK_BUCKETS: Tuple[int, ...] = (REFRESH_TOP_RANK, REFRESH_TOP_RANK * 10, REFRESH_TOP_RANK * 100)
+TAIL = "tail"
+PERCENTILES = (50, 90, 99, 100)
+
+STALENESS = gauge("richlist_staleness_blocks", "Blocks since the last refresh of the wallets per rank bucket.",
+                  ["bucket", "percentile"])
+SCHEDULED_WALLETS = gauge("richlist_scheduled_wallets", "Wallets selected for the last refresh run.", ["reason"])
+DEFERRED_WALLETS = gauge("richlist_deferred_wallets", "Due wallets left for later runs because of the call budget.")
+
+
+def bucket_name(bucket: int) -> str:
+    return f"top{RANK_BUCKETS[bucket]}" if bucket < len(RANK_BUCKETS) else TAIL
+
+
+def percentile(values: List[int], percent: int) -> int:
+    # values must be sorted
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, (len(values) * percent + 99) // 100 - 1))]
+
+
+class RefreshScheduler:
+    """
+    Decides which wallets are refreshed in the next run. Every wallet gets a refresh interval in blocks:
+
+    - wallets ranked high in any denom get short intervals, REFRESH_TOP_MAX_STALENESS_BLOCKS for the top
+      REFRESH_TOP_RANK, ten times more for every next bucket, the long tail uses the idle spread
+    - wallets seen on chain recently get half of their interval
+    - wallets changed on chain and wallets with a matured unbonding are refreshed right away
+
+    Wallets are refreshed by rank bucket, within a bucket changed wallets first and then the most overdue ones, as many
+    as the upstream call budget allows. The rest stays due and is picked up by the next runs, so a tight budget delays
+    the long tail but not the top wallets.
+    """
+
+    def __init__(self, calls_per_minute: float = REFRESH_CALLS_PER_MINUTE):
+        self.rate: float = calls_per_minute / 60
+        # allow one minute of calls at once, e.g. after startup
+        self.capacity: float = calls_per_minute
+        self.tokens: float = self.capacity
+        self.updated_at: float = time.monotonic()
+        # ranking views the rank buckets were computed from, views never change after they were published
+        self.bucket_views: List[Tuple[str, object]] = []
+        self.buckets: Dict[str, int] = {}
+
+    def budget(self) -> int:
+        """
+        Wallets which can be refreshed now.
+        :return: number of wallets
+        """
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return max(0, int(self.tokens // CALLS_PER_WALLET))
+
+    def spend(self, wallets: int) -> None:
+        self.charge(wallets * CALLS_PER_WALLET)
+
+    def charge(self, calls: float) -> None:
+        """
+        Take calls made outside of wallet refreshes from the budget, negative calls give back calls a refresh skipped.
+        :param calls: number of calls
+        :return: None
+        """
+        self.tokens = min(self.capacity, self.tokens - calls)
+
+    def rank_buckets(self, rankings: dict) -> Dict[str, int]:
+        """
+        Best rank bucket per wallet, wallets outside of all buckets are not part of the result. Computed once per set of
+        published ranking generations, select and staleness_report of the same cycle share the result.
+        :param rankings: denom -> RankingIndex, e.g. SHARED_MEMORY_DICT
+        :return: address -> bucket index
+        """
+        views: List[Tuple[str, object]] = [(denom, index.view()) for denom, index in list(rankings.items())]
+        if len(views) == len(self.bucket_views) and \
+                all(denom == cached_denom and view is cached_view
+                    for (denom, view), (cached_denom, cached_view) in zip(views, self.bucket_views)):
+            return self.buckets
+        buckets: Dict[str, int] = {}
+        for _, view in views:
+            records: List[dict] = view.records(0, RANK_BUCKETS[-1])
+            for rank, record in enumerate(records):
+                bucket: int = next(i for i, bound in enumerate(RANK_BUCKETS) if rank < bound)
+                if bucket < buckets.get(record["address"], len(RANK_BUCKETS)):
+                    buckets[record["address"]] = bucket
+        self.bucket_views, self.buckets = views, buckets
+        return buckets
+
+    @staticmethod
+    def interval(wallet: dict, bucket: int, block_height: int, idle_spread: float) -> float:
+        """
+        Blocks between two refreshes of a wallet.
+        :param wallet: wallet
+        :param bucket: rank bucket of the wallet
+        :param block_height: current block height
+        :param idle_spread: interval of the long tail
+        :return: interval in blocks
+        """
+        interval: float = idle_spread
+        if bucket < len(RANK_BUCKETS):
+            interval = min(interval, REFRESH_TOP_MAX_STALENESS_BLOCKS * pow(10, bucket))
+        if block_height - (wallet.get("last_seen_height") or 0) <= REFRESH_ACTIVE_BLOCKS:
+            interval /= 2
+        return interval
+
+    @staticmethod
+    def unbonding_matured(wallet: dict, block_epoch: float) -> bool:
+        completion: Optional[str] = wallet.get("unbonding_completion_time")
+        return bool(completion) and timestamp_to_epoch_seconds(completion) <= block_epoch
+
+    def select(self, wallets: Iterable[dict], changed: Set[str], rankings: dict, block_height: int, block_time: str,
+               idle_spread: Callable[[dict], float]) -> Tuple[List[dict], Set[str]]:
+        """
+        Select the wallets of the next run.
+        :param wallets: all wallets
+        :param changed: addresses of wallets changed on chain
+        :param rankings: denom -> RankingIndex
+        :param block_height: current block height
+        :param block_time: current block time
+        :param idle_spread: interval of a long tail wallet
+        :return: tuple of the selected wallets and the changed addresses which did not fit into the budget
+        """
+        buckets: Dict[str, int] = self.rank_buckets(rankings)
+        block_epoch: float = timestamp_to_epoch_seconds(block_time)
+        # (bucket, changed or matured first, most overdue first, wallet)
+        candidates: List[Tuple[int, int, float, dict]] = []
+        for wallet in wallets:
+            bucket: int = buckets.get(wallet["address"], len(RANK_BUCKETS))
+            if wallet["address"] in changed or self.unbonding_matured(wallet, block_epoch):
+                candidates.append((bucket, 0, 0.0, wallet))
+                continue
+            overdue: float = (block_height - wallet["last_checked_height"]) / \
+                self.interval(wallet, bucket, block_height, idle_spread(wallet))
+            if overdue > 1:
+                candidates.append((bucket, 1, -overdue, wallet))
+        candidates.sort(key=lambda candidate: candidate[:3])
+
+        budget: int = self.budget()
+        selected: List[dict] = [candidate[3] for candidate in candidates[:budget]]
+        deferred: Set[str] = {candidate[3]["address"] for candidate in candidates[budget:]
+                              if candidate[3]["address"] in changed}
+        self.spend(len(selected))
+        SCHEDULED_WALLETS.set(sum(1 for candidate in candidates[:budget] if not candidate[1]), reason="changed")
+        SCHEDULED_WALLETS.set(sum(1 for candidate in candidates[:budget] if candidate[1]), reason="due")
+        DEFERRED_WALLETS.set(len(candidates) - len(selected))
+        return selected, deferred
+
+    def staleness_report(self, wallets: Iterable[dict], rankings: dict, block_height: int) -> Dict[str, Dict[int, int]]:
+        """
+        Staleness percentiles in blocks per rank bucket, also exported as metric.
+        :param wallets: all wallets
+        :param rankings: denom -> RankingIndex
+        :param block_height: current block height
+        :return: bucket name -> percentile -> blocks
+        """
+        buckets: Dict[str, int] = self.rank_buckets(rankings)
+        staleness: Dict[int, List[int]] = {bucket: [] for bucket in range(len(RANK_BUCKETS) + 1)}
+        for wallet in wallets:
+            bucket: int = buckets.get(wallet["address"], len(RANK_BUCKETS))
+            staleness[bucket].append(max(0, block_height - wallet["last_checked_height"]))
+        report: Dict[str, Dict[int, int]] = {}
+        for bucket, values in staleness.items():
+            values.sort()
+            name: str = bucket_name(bucket)
+            report[name] = {percent: percentile(values, percent) for percent in PERCENTILES}
+            for percent, blocks in report[name].items():
+                STALENESS.set(blocks, bucket=name, percentile=str(percent))
+        return report
@@ -0,0 +1,281 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Set
+
+import richlist
+from richlist.harvest import DelegationHarvest
+from richlist.ranking import Rankings, wallet_record
+from richlist.scheduler import REFRESH_CALLS_PER_MINUTE, RefreshScheduler
+from richlist.store import WalletStore
+from utils import create_sub_dir, get_file_logger, path_parts_to_abs_path
+from utils.cache import set_block_height
+from utils.exception import NodeIsCatchingUp, RequestTimedOut, TooManyRequests
+from utils.metrics import counter, gauge
+from utils.rest import get_all_validators
+
+# Worker processes refreshing the wallets, 0 keeps the update thread inside the API process
+RICHLIST_WORKERS = int(os.getenv("RICHLIST_WORKERS")) if os.getenv("RICHLIST_WORKERS") else 0
+# Wallet records per message of the initial snapshot of a worker
+SNAPSHOT_BATCH = 1000
+# Seconds to wait for a worker to write its pending wallets on shutdown
+WORKER_STOP_TIMEOUT = 30
+# Seconds a worker waits for a command before it checks its update thread
+WORKER_CHECK_INTERVAL = 5
+
+MERGED_WALLETS = counter("richlist_shard_merged_wallets_total", "Wallet changes merged from the worker processes.",
+                         ["shard"])
+WORKERS_ALIVE = gauge("richlist_shard_workers_alive", "Worker processes currently running.")
+WORKER_RESTARTS = counter("richlist_shard_worker_restarts_total", "Worker processes started again after they died.")
+
+
+def shard_of(address: str, shards: int) -> int:
+    """
+    Shard owning a wallet, stable over restarts and processes.
+    :param address: wallet address
+    :param shards: number of shards
+    :return: shard index
+    """
+    return zlib.crc32(address.encode("utf-8")) % shards
+
+
+class ShardRankings(Rankings):
+    """
+    Rankings of the wallets owned by one worker process. The worker keeps its own rankings for the scheduler, every
+    publish also sends the wallets changed since the last publish to the coordinator as one batch.
+    """
+
+    def __init__(self, shared: dict, deltas: multiprocessing.Queue, shard: int):
+        super().__init__(shared)
+        self.deltas = deltas
+        self.shard: int = shard
+        self.changed: Dict[str, dict] = {}
+
+    def update_wallet(self, wallet: dict) -> None:
+        super().update_wallet(wallet)
+        with self.lock:
+            self.changed[wallet["address"]] = wallet_record(wallet)
+
+    def publish(self) -> None:
+        super().publish()
+        with self.lock:
+            records: List[dict] = list(self.changed.values())
+            self.changed = {}
+        if records:
+            self.deltas.put(("wallets", self.shard, records, True))
+
+    def rebuild(self, wallets: List[dict]) -> None:
+        super().rebuild(wallets)
+        records: List[dict] = [wallet_record(wallet) for wallet in wallets]
+        # the coordinator publishes once the last part of the snapshot arrived
+        for start in range(0, len(records), SNAPSHOT_BATCH):
+            self.deltas.put(("loaded", self.shard, records[start:start + SNAPSHOT_BATCH],
+                             start + SNAPSHOT_BATCH >= len(records)))
+        if not records:
+            self.deltas.put(("loaded", self.shard, [], True))
+
+
+def run_worker(shard: int, shards: int, deltas: multiprocessing.Queue, commands: multiprocessing.Queue) -> None:
+    """
+    Main program of a worker process. Runs the usual update thread restricted to the wallets of the shard, the block
+    and the changed wallets come from the coordinator.
+    :param shard: shard index of the worker
+    :param shards: number of shards
+    :param deltas: queue of wallet changes to the coordinator
+    :param commands: queue of blocks and the stop command from the coordinator
+    :return: None
+    """
+    # the coordinator decides when to stop, pending wallets are written then
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    richlist.SHARD = (shard, shards)
+    richlist.LOGGER = get_file_logger(f"richlist-worker-{shard}", terminal_log_level=richlist.LOG_LEVEL_TERMINAL,
+                                      file_log_level=richlist.LOG_LEVEL_FILE)
+    richlist.RANKINGS = ShardRankings(richlist.endpoint.SHARED_MEMORY_DICT, deltas, shard)
+    # the upstream budget and connections are shared by all workers
+    richlist.SCHEDULER = RefreshScheduler(REFRESH_CALLS_PER_MINUTE / shards)
+    richlist.refresh.REFRESH_PER_HOST_CONCURRENCY = max(1, richlist.refresh.REFRESH_PER_HOST_CONCURRENCY // shards)
+    update_thread = threading.Thread(target=richlist.update_richlist, name="RichList Update Thread", daemon=True)
+    update_thread.start()
+    while True:
+        try:
+            command: tuple = commands.get(timeout=WORKER_CHECK_INTERVAL)
+        except queue.Empty:
+            command = ("check",)
+        if not update_thread.is_alive():
+            # a worker without its update thread would never refresh its shard again, the coordinator restarts it
+            richlist.LOGGER.error(f"Update thread of worker {shard} ended, stopping the worker")
+            richlist.shutdown()
+            raise SystemExit(1)
+        if command[0] == "stop":
+            richlist.shutdown()
+            return
+        if command[0] == "check":
+            continue
+        if command[0] == "harvest":
+            _, height, totals, calls = command
+            richlist.HARVEST.replace(totals, height)
+            richlist.SCHEDULER.charge(calls)
+            continue
+        _, block, followed_since, height, changed = command
+        richlist.BLOCK = block
+        set_block_height(int(block["block_height"]))
+        richlist.FOLLOWER.followed_since = followed_since
+        richlist.FOLLOWER.height = height
+        if changed:
+            richlist.FOLLOWER.mark(changed)
+
+
+class Coordinator:
+    """
+    Splits the wallets over worker processes by address. Every worker owns the refresh and the persistence of its
+    wallets, so JSON parsing and balance math of different shards run on different cores.
+
+    The coordinator runs inside the API process. It forwards the block and the changed wallets of the block follower
+    to their owners and merges the wallet changes streamed back into the rankings served by the API. The delegations
+    are harvested once for all workers and every worker gets the delegators of its shard. A worker sends
+    its changes in batches and the rankings are published after complete batches only, and not before every worker
+    delivered its initial snapshot, so the API never serves half of a shard.
+    """
+
+    def __init__(self, shards: int = RICHLIST_WORKERS):
+        self.shards: int = shards
+        self.context = multiprocessing.get_context("spawn")
+        self.deltas = self.context.Queue()
+        self.commands: List[multiprocessing.Queue] = [self.context.Queue() for _ in range(shards)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * shards
+        self.loaded: Set[int] = set()
+        self.running: bool = False
+        # delegations of all shards, workers do not harvest on their own
+        self.harvest = DelegationHarvest(richlist.FOLLOWER.covers)
+        # height and delegators per shard of the last harvest, sent again to restarted workers
+        self.harvested: Optional[tuple] = None
+
+    def start(self) -> None:
+        # import the former wallet files once before the workers open the database
+        # the former files are decoded with the decimals of the tokens known from the last run
+        richlist.TOKENS.load(os.path.join(create_sub_dir(richlist.DATABASE_PATH), richlist.TOKEN_REGISTRY_FILE))
+        store: WalletStore = WalletStore(os.path.join(create_sub_dir(richlist.DATABASE_PATH), richlist.WALLET_STORE_FILE),
+                                         richlist.TOKENS.known_decimals)
+        migrated: int = store.migrate_json_files(
+            path_parts_to_abs_path(richlist.LEGACY_WALLET_PATH),
+            on_error=lambda filename, error: richlist.LOGGER.warning(f"Skipped unreadable wallet file {filename}: {error}"))
+        if migrated:
+            richlist.LOGGER.info(f"Migrated {migrated} wallet files into {store.path}")
+        store.close()
+        self.running = True
+        for shard in range(self.shards):
+            self.start_worker(shard)
+        threading.Thread(target=self.merge, name="RichList Shard Merge", daemon=True).start()
+        threading.Thread(target=self.dispatch, name="RichList Shard Dispatch", daemon=True).start()
+        threading.Thread(target=self.harvest_delegations, name="RichList Shard Harvest", daemon=True).start()
+        richlist.LOGGER.info(f"Started {self.shards} richlist workers")
+
+    def start_worker(self, shard: int) -> None:
+        if self.processes[shard] is not None:
+            # a killed worker may still hold the read lock of its queue, the new one gets a fresh queue
+            self.commands[shard].cancel_join_thread()
+            self.commands[shard] = self.context.Queue()
+        process = self.context.Process(target=run_worker, args=(shard, self.shards, self.deltas, self.commands[shard]),
+                                       name=f"RichList Worker {shard}", daemon=True)
+        process.start()
+        self.processes[shard] = process
+        if self.harvested is not None:
+            height, parts = self.harvested
+            # the calls were already charged to the budget of the former worker
+            self.commands[shard].put(("harvest", height, parts[shard], 0))
+
+    def stop(self) -> None:
+        """
+        Let every worker write its pending wallets and stop.
+        :return: None
+        """
+        self.running = False
+        for commands in self.commands:
+            commands.put(("stop",))
+        deadline: float = time.monotonic() + WORKER_STOP_TIMEOUT
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                richlist.LOGGER.warning(f"{process.name} did not stop in time")
+                process.terminate()
+                # commands the worker did not read must not block the exit of this process
+                self.commands[self.processes.index(process)].cancel_join_thread()
+        WORKERS_ALIVE.set(0)
+
+    def merge(self) -> None:
+        while True:
+            kind, shard, records, final = self.deltas.get()
+            for record in records:
+                richlist.WALLETS[record["address"]] = record
+                richlist.RANKINGS.update_wallet(record)
+            MERGED_WALLETS.inc(len(records), shard=str(shard))
+            if kind == "loaded" and final:
+                self.loaded.add(shard)
+                richlist.LOGGER.info(f"Worker {shard} loaded, {len(self.loaded)}/{self.shards} workers ready")
+            if final and len(self.loaded) == self.shards:
+                richlist.RANKINGS.publish()
+                richlist.TRACKED_WALLETS.set(len(richlist.WALLETS))
+
+    def dispatch(self) -> None:
+        last_height: Optional[int] = None
+        while self.running:
+            self.watch()
+            block: dict = richlist.BLOCK
+            changed: Set[str] = richlist.FOLLOWER.pop_changed()
+            if block and (changed or int(block["block_height"]) != last_height):
+                last_height = int(block["block_height"])
+                per_shard: List[Set[str]] = [set() for _ in range(self.shards)]
+                for address in changed:
+                    per_shard[shard_of(address, self.shards)].add(address)
+                for shard, commands in enumerate(self.commands):
+                    commands.put(("block", block, richlist.FOLLOWER.followed_since, richlist.FOLLOWER.height,
+                                  per_shard[shard]))
+            time.sleep(richlist.SECONDS_BETWEEN_BLOCK_FETCH)
+
+    def harvest_delegations(self) -> None:
+        """
+        Threaded function harvesting the delegations of all validators whenever they are due. One harvest for all
+        workers instead of one per worker, which would fetch every delegation list once per shard.
+        :return: None
+        """
+        while self.running:
+            block: dict = richlist.BLOCK
+            try:
+                if block and self.harvest.due(int(block["block_height"])):
+                    height: int = int(block["block_height"])
+                    validators: List[str] = [json_val["OperatorAddress"] for json_val in get_all_validators()]
+                    delegators, calls = self.harvest.harvest(validators, lambda address: True, height)
+                    parts: List[dict] = [{} for _ in range(self.shards)]
+                    for address, staked in self.harvest.totals.items():
+                        parts[shard_of(address, self.shards)][address] = staked
+                    self.harvested = (height, parts)
+                    for shard, commands in enumerate(self.commands):
+                        # every worker pays its share of the calls
+                        commands.put(("harvest", height, parts[shard], calls / self.shards))
+                    richlist.LOGGER.info(f"Harvested delegations of {delegators} delegators with {calls} calls")
+                time.sleep(richlist.SECONDS_BETWEEN_BLOCK_FETCH)
+            except (RequestTimedOut, NodeIsCatchingUp) as error:
+                richlist.LOGGER.warning(f"Harvesting delegations failed: {error}")
+                time.sleep(richlist.SECONDS_BETWEEN_BLOCK_FETCH)
+            except TooManyRequests as error:
+                richlist.LOGGER.warning(f"Harvesting delegations got rate limited: {error}")
+                time.sleep(max(richlist.SECONDS_BETWEEN_BLOCK_FETCH, error.retry_after or 0))
+
+    def watch(self) -> None:
+        # a dead worker loses only wallets not written yet, start it again from its stored wallets
+        alive: int = 0
+        for shard, process in enumerate(self.processes):
+            if process is not None and not process.is_alive() and self.running:
+                richlist.LOGGER.error(f"{process.name} died with exit code {process.exitcode}, starting it again")
+                WORKER_RESTARTS.inc()
+                self.start_worker(shard)
+                process = self.processes[shard]
+            if process is not None and process.is_alive():
+                alive += 1
+        WORKERS_ALIVE.set(alive)
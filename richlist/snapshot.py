@@ -0,0 +1,291 @@
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from richlist.pages import STARTED_AT, encode
+from richlist.portfolio import serialize_portfolio
+from richlist.ranking import RankingView, serialize_record, serialize_stats
+from utils.metrics import counter, histogram
+
+# API worker processes serving the rankings from snapshots, 0 serves them from memory inside the updater process
+RICHLIST_API_WORKERS = int(os.getenv("RICHLIST_API_WORKERS")) if os.getenv("RICHLIST_API_WORKERS") else 0
+# Seconds between two snapshots of the changed rankings
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL_SEC")) if os.getenv("SNAPSHOT_INTERVAL_SEC") else 2.0
+# Seconds an API worker serves a snapshot before it checks for a newer one
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL_SEC")) if os.getenv("SNAPSHOT_CHECK_INTERVAL_SEC") else 0.5
+# Environment variable telling the API worker processes where the snapshots are
+SNAPSHOT_PATH_ENV = "RICHLIST_SNAPSHOT_PATH"
+# Directory inside DATABASE_PATH holding the snapshots
+SNAPSHOT_DIRECTORY = "snapshots"
+
+DENOM = "denom"
+PORTFOLIO = "portfolio"
+
+# magic, generation, wallets, position of the address table, position of the meta data
+MAGIC = b"RLSNAP01"
+HEADER = struct.Struct("<8sQQQQ")
+# start of a record and start of the next one
+POSITIONS = struct.Struct("<QQ")
+POSITION = struct.Struct("<Q")
+# position and length of an address and its rank
+ADDRESS = struct.Struct("<QII")
+
+SNAPSHOTS_WRITTEN = counter("richlist_snapshots_written_total", "Ranking snapshots written for the API workers.",
+                            ["kind"])
+SNAPSHOT_DURATION = histogram("richlist_snapshot_seconds", "Duration of writing a ranking snapshot.")
+
+
+def snapshot_file(kind: str, name: str) -> str:
+    # denoms may contain characters not allowed in file names
+    return f"{kind}-{quote(name, safe='')}.snap"
+
+
+class Snapshot:
+    """
+    Read only view of a ranking generation written by SnapshotWriter, mapped into memory. Records are stored as the
+    encoded JSON of the API, each followed by a comma, in the order of the ranking. A page is one slice of the file,
+    nothing is decoded or encoded again. The file is replaced and never changed, the mapping of a replaced file stays
+    valid until the last request using it is done.
+
+    Layout: header, offset table of all records, records, address table sorted by address, addresses, meta data.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.key: tuple = snapshot_key(os.fstat(file.fileno()))
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.size, self.addresses, meta_position = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is no richlist snapshot")
+        meta: dict = json.loads(self.buffer[meta_position:].decode("utf-8"))
+        self.kind: str = meta["kind"]
+        self.name: str = meta["name"]
+        self.decimals: int = meta["decimals"]
+        self.started_at: str = meta["started_at"]
+        self.stats: Optional[bytes] = encode(meta["stats"]) if meta["stats"] is not None else None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def position(self, rank: int) -> int:
+        return POSITION.unpack_from(self.buffer, HEADER.size + rank * POSITION.size)[0]
+
+    def records(self, start: int, stop: int) -> bytes:
+        """
+        Encoded records from rank start (inclusive) to stop (exclusive).
+        :param start: first rank, 0 is the richest wallet
+        :param stop: rank to stop before
+        :return: records separated by commas
+        """
+        start, stop = min(start, self.size), min(stop, self.size)
+        if start >= stop:
+            return b""
+        # without the comma behind the last record
+        return self.buffer[self.position(start):self.position(stop) - 1]
+
+    def record(self, rank: int) -> bytes:
+        start, stop = POSITIONS.unpack_from(self.buffer, HEADER.size + rank * POSITION.size)
+        return self.buffer[start:stop - 1]
+
+    def page(self, head: dict, limit: int, offset: int) -> bytes:
+        """
+        Response body of a page, the same bytes as encode() of the page built from the ranking in memory.
+        :param head: fields in front of the totals, e.g. {"denom": "swth"}
+        :param limit: limit of the page
+        :param offset: offset of the page
+        :return: json as bytes
+        """
+        records: bytes = self.records(offset, offset + limit)
+        data: dict = dict(head, total=self.size, total_subset=max(0, min(self.size, offset + limit) - offset),
+                          limit=limit, offset=offset)
+        return encode(data)[:-1] + b',"wallets":[' + records + b"]}"
+
+    def find(self, address: str) -> Optional[int]:
+        """
+        Rank of a wallet, a binary search over the address table.
+        :param address: wallet address
+        :return: rank or None if the wallet is not part of the ranking
+        """
+        target: bytes = address.encode("utf-8")
+        low, high = 0, self.size
+        while low < high:
+            middle: int = (low + high) // 2
+            position, length, rank = ADDRESS.unpack_from(self.buffer, self.addresses + middle * ADDRESS.size)
+            current: bytes = self.buffer[position:position + length]
+            if current == target:
+                return rank
+            if current < target:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+
+def snapshot_key(stat: os.stat_result) -> tuple:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class SnapshotReader:
+    """
+    Latest snapshots of a directory for the API workers. A worker checks a file at most every SNAPSHOT_CHECK_INTERVAL
+    and maps a replaced file anew, requests in flight keep the mapping they started with.
+    """
+
+    def __init__(self, directory: str, check_interval: float = SNAPSHOT_CHECK_INTERVAL):
+        self.directory: str = directory
+        self.check_interval: float = check_interval
+        # file name -> (checked at, snapshot)
+        self.snapshots: Dict[str, Tuple[float, Optional[Snapshot]]] = {}
+        self.listing: Tuple[float, List[str]] = (0.0, [])
+
+    def get(self, kind: str, name: str) -> Optional[Snapshot]:
+        """
+        Latest snapshot of a ranking.
+        :param kind: DENOM or PORTFOLIO
+        :param name: denom or currency of the portfolio values
+        :return: snapshot or None if the updater did not write it yet
+        """
+        filename: str = snapshot_file(kind, name)
+        now: float = time.monotonic()
+        checked_at, snapshot = self.snapshots.get(filename, (0.0, None))
+        if now - checked_at < self.check_interval:
+            return snapshot
+        path: str = os.path.join(self.directory, filename)
+        try:
+            if snapshot is None or snapshot_key(os.stat(path)) != snapshot.key:
+                snapshot = Snapshot(path)
+        except FileNotFoundError:
+            snapshot = None
+        # a single assignment, concurrent requests see either the former or the new snapshot
+        self.snapshots[filename] = (now, snapshot)
+        return snapshot
+
+    def names(self, kind: str) -> List[str]:
+        """
+        Rankings of a kind with a snapshot.
+        :param kind: DENOM or PORTFOLIO
+        :return: denoms or currencies
+        """
+        now: float = time.monotonic()
+        listed_at, names = self.listing
+        if now - listed_at >= self.check_interval:
+            names = sorted(filename for filename in os.listdir(self.directory) if filename.endswith(".snap"))
+            self.listing = (now, names)
+        prefix: str = kind + "-"
+        return [unquote(filename[len(prefix):-len(".snap")]) for filename in names if filename.startswith(prefix)]
+
+
+class SnapshotWriter:
+    """
+    Writes every new generation of the rankings as one snapshot file per ranking for the API worker processes. Only
+    rankings whose generation changed are written. Records keep their encoded JSON as long as the wallet did not
+    change, so a snapshot encodes only the changed wallets.
+    """
+
+    def __init__(self, directory: str, rankings: dict, portfolios: dict):
+        """
+        :param directory: directory of the snapshots
+        :param rankings: denom -> RankingIndex, e.g. SHARED_MEMORY_DICT
+        :param portfolios: currency -> RankingIndex of the portfolios, e.g. SHARED_PORTFOLIO_DICT
+        """
+        self.directory: str = directory
+        self.sources: Dict[str, dict] = {DENOM: rankings, PORTFOLIO: portfolios}
+        # file name -> written generation
+        self.generations: Dict[str, int] = {}
+        # file name -> address -> (record, encoded record)
+        self.encoded: Dict[str, Dict[str, Tuple[dict, bytes]]] = {}
+
+    def write_changed(self) -> int:
+        """
+        Write all rankings published since their last snapshot.
+        :return: number of written snapshots
+        """
+        written: int = 0
+        for kind, source in self.sources.items():
+            for name, index in list(source.items()):
+                view: RankingView = index.view()
+                if self.generations.get(snapshot_file(kind, name)) != view.generation:
+                    with SNAPSHOT_DURATION.time():
+                        self.write(kind, name, view, index.decimals)
+                    written += 1
+        return written
+
+    def write(self, kind: str, name: str, view: RankingView, decimals: int) -> None:
+        """
+        Write a snapshot of a ranking view and replace the former one at once.
+        :param kind: DENOM or PORTFOLIO
+        :param name: denom or currency
+        :param view: view of the ranking
+        :param decimals: decimals of the ranked totals
+        :return: None
+        """
+        filename: str = snapshot_file(kind, name)
+        serialize: Callable[[dict], dict] = serialize_portfolio if kind == PORTFOLIO else \
+            (lambda record: serialize_record(record, name))
+        cached: Dict[str, Tuple[dict, bytes]] = self.encoded.get(filename, {})
+        encoded: Dict[str, Tuple[dict, bytes]] = {}
+        records: List[bytes] = []
+        addresses: List[Tuple[bytes, int]] = []
+        for chunk in view.chunks:
+            for _, address, record in chunk:
+                entry: Optional[Tuple[dict, bytes]] = cached.get(address)
+                if entry is None or entry[0] is not record:
+                    entry = (record, encode(serialize(record)) + b",")
+                encoded[address] = entry
+                addresses.append((address.encode("utf-8"), len(records)))
+                records.append(entry[1])
+        self.encoded[filename] = encoded
+        addresses.sort()
+
+        position: int = HEADER.size + (len(records) + 1) * POSITION.size
+        offsets: List[int] = []
+        for data in records:
+            offsets.append(position)
+            position += len(data)
+        offsets.append(position)
+        addresses_position: int = position
+        position += len(addresses) * ADDRESS.size
+        address_table: List[bytes] = []
+        for address, rank in addresses:
+            address_table.append(ADDRESS.pack(position, len(address), rank))
+            position += len(address)
+        meta: bytes = encode({
+            "kind": kind,
+            "name": name,
+            "decimals": decimals,
+            "started_at": STARTED_AT,
+            "stats": serialize_stats(view, name) if kind == DENOM else None,
+        })
+
+        path: str = os.path.join(self.directory, filename)
+        temporary: str = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(HEADER.pack(MAGIC, view.generation, len(records), addresses_position, position))
+            file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+            file.writelines(records)
+            file.writelines(address_table)
+            file.writelines(address for address, _ in addresses)
+            file.write(meta)
+        # readers map either the former or the new file, never a partly written one
+        os.replace(temporary, path)
+        self.generations[filename] = view.generation
+        SNAPSHOTS_WRITTEN.inc(kind=kind)
+
+    def run(self, interval: float = SNAPSHOT_INTERVAL, on_error: Optional[Callable[[Exception], None]] = None) -> None:
+        """
+        Threaded function writing the changed rankings every interval.
+        :param interval: seconds between two snapshots
+        :param on_error: called with the error of a failed snapshot, it is tried again with the next interval
+        :return: None
+        """
+        while True:
+            try:
+                self.write_changed()
+            except Exception as error:
+                if on_error is not None:
+                    on_error(error)
+            time.sleep(interval)
@@ -0,0 +1,144 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from richlist.balance import decode_wallet, encode
+from richlist.history import HistoryStore
+from utils import files_in_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallets (
+    address TEXT PRIMARY KEY,
+    last_checked_height INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+)
+"""
+
+
+class WalletStore:
+    """
+    All wallets in a single SQLite database in WAL mode. Wallets are stored as compact json, one row per wallet, and
+    written in batches with one transaction per batch. Readers never block the writer and a crash never leaves a
+    half written wallet behind.
+    """
+
+    def __init__(self, path: str, decimals: Optional[Callable[[str], Optional[int]]] = None):
+        """
+        :param path: file of the database
+        :param decimals: decimals of a denom or None if unknown, e.g. TokenRegistry.known_decimals. Stored balances
+        of unknown denoms are decoded with the decimals of their strings
+        """
+        self.path: str = path
+        self.decimals: Optional[Callable[[str], Optional[int]]] = decimals
+        self.lock = threading.Lock()
+        # worker processes share the database, a writer waits for the batch of another one
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # one fsync of the WAL per committed transaction, wallets are written in batches so this stays cheap
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute(SCHEMA)
+        # balance history, written in the same transactions as the wallets
+        self.history: HistoryStore = HistoryStore(self.connection, self.lock)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM wallets").fetchone()[0]
+
+    def load(self, owns: Optional[Callable[[str], bool]] = None) -> Iterator[dict]:
+        """
+        Iterate over all stored wallets.
+        :param owns: only wallets whose address passes this check, e.g. the wallets of a shard
+        :return: generator of wallets
+        """
+        with self.lock:
+            rows: List[tuple] = self.connection.execute("SELECT address, data FROM wallets").fetchall()
+        for address, data in rows:
+            if owns is None or owns(address):
+                yield decode_wallet(json.loads(data), self.decimals)
+
+    def heights(self, owns: Optional[Callable[[str], bool]] = None) -> Dict[str, int]:
+        """
+        Last checked height of every stored wallet, no wallet is decoded.
+        :param owns: only wallets whose address passes this check, e.g. the wallets of a shard
+        :return: address -> last checked height
+        """
+        with self.lock:
+            rows: List[tuple] = self.connection.execute("SELECT address, last_checked_height FROM wallets").fetchall()
+        return {address: height for address, height in rows if owns is None or owns(address)}
+
+    def load_many(self, addresses: Iterable[str]) -> Iterator[dict]:
+        """
+        Iterate over the stored wallets of some addresses, unknown addresses are skipped.
+        :param addresses: wallet addresses
+        :return: generator of wallets
+        """
+        addresses = list(addresses)
+        # below the limit of sqlite for host parameters of a statement
+        for start in range(0, len(addresses), 500):
+            chunk: List[str] = addresses[start:start + 500]
+            with self.lock:
+                rows: List[tuple] = self.connection.execute(
+                    f"SELECT data FROM wallets WHERE address IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for (data,) in rows:
+                yield decode_wallet(json.loads(data), self.decimals)
+
+    def save(self, wallets: Iterable[dict], changes: Iterable[Tuple[str, str, int, int]] = ()) -> None:
+        """
+        Insert or replace wallets and append their balance changes in a single transaction.
+        :param wallets: wallets to save
+        :param changes: list of (address, denom, height, delta) for the history
+        :return: None
+        """
+        rows: List[tuple] = [(wallet["address"], wallet["last_checked_height"], json.dumps(wallet, separators=(",", ":"), default=encode))
+                             for wallet in wallets]
+        changes = list(changes)
+        if not rows and not changes:
+            return
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO wallets (address, last_checked_height, data) "
+                                            "VALUES (?, ?, ?)", rows)
+                self.history.write(changes)
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                self.history.reset()
+                raise
+            self.connection.execute("COMMIT")
+
+    def migrate_json_files(self, directory: str, on_error: Optional[Callable[[str, Exception], None]] = None) -> int:
+        """
+        One shot import of the former wallet storage with one json file per wallet. The directory is renamed
+        afterwards so the import never runs twice. Unreadable files are skipped, the wallets are discovered again.
+        :param directory: directory containing <address>.json files
+        :param on_error: called with the file name and the error of a skipped file
+        :return: number of imported wallets
+        """
+        if not os.path.isdir(directory):
+            return 0
+        wallets: List[dict] = []
+        for filename in files_in_path(directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(filename, "r") as file:
+                    wallets.append(decode_wallet(json.loads(file.read()), self.decimals))
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+                # e.g. a file truncated by a crash of the former storage
+                if on_error is not None:
+                    on_error(filename, error)
+        self.save(wallets)
+        # a former migration may have left its directory behind
+        target: str = f"{directory.rstrip(os.sep)}.migrated"
+        attempt: int = 1
+        while os.path.exists(target):
+            target = f"{directory.rstrip(os.sep)}.migrated-{attempt}"
+            attempt += 1
+        os.rename(directory, target)
+        return len(wallets)
@@ -0,0 +1,150 @@
+import atexit
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import richlist
+from richlist.store import WalletStore
+from utils.metrics import counter, gauge, histogram
+
+# Wallets written in one transaction at most, a full batch is written right away
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH")) if os.getenv("WRITE_BEHIND_BATCH") else 500
+# Seconds a changed wallet may wait before it is written
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL_SEC")) if os.getenv("WRITE_BEHIND_INTERVAL_SEC") else 5.0
+
+QUEUE_DEPTH = gauge("richlist_write_behind_queue_depth", "Changed wallets waiting to be written.")
+FLUSH_DURATION = histogram("richlist_write_behind_flush_seconds", "Duration of writing a batch of wallets.")
+FLUSHED_WALLETS = counter("richlist_write_behind_flushed_wallets_total", "Wallets written by the write behind queue.")
+COALESCED_WALLETS = counter("richlist_write_behind_coalesced_total",
+                            "Wallet changes replaced by a newer change before they got written.")
+FLUSH_ERRORS = counter("richlist_write_behind_errors_total", "Batches which could not be written.")
+
+
+class WriteBehindWriter:
+    """
+    Writes changed wallets to the wallet store in a background thread. put() only stores a snapshot of the wallet and
+    returns, several changes of the same address before the next flush are written once. A batch is written when it
+    is full or the oldest change waited WRITE_BEHIND_INTERVAL seconds, every batch is one transaction.
+    """
+
+    def __init__(self, store: WalletStore, batch: int = WRITE_BEHIND_BATCH, interval: float = WRITE_BEHIND_INTERVAL):
+        self.store: WalletStore = store
+        self.batch: int = batch
+        self.interval: float = interval
+        self.pending: Dict[str, dict] = {}
+        # balance changes of the pending wallets, never coalesced, written with their wallet
+        self.changes: Dict[str, List[tuple]] = {}
+        self.oldest: Optional[float] = None
+        self.condition = threading.Condition()
+        self.running: bool = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name="RichList Write Behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """
+        Write everything pending and stop the thread.
+        :return: None
+        """
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        # changes put after the thread left its loop
+        self.flush()
+
+    def put(self, wallet: dict, changes: Iterable[Tuple[str, int, int]] = ()) -> None:
+        """
+        Queue a changed wallet. Never touches the disk.
+        :param wallet: changed wallet, a shallow copy is queued because balances are replaced but never changed
+        :param changes: balance changes of the wallet as (denom, height, delta) for the history
+        :return: None
+        """
+        snapshot: dict = wallet.copy()
+        with self.condition:
+            for denom, height, delta in changes:
+                self.changes.setdefault(snapshot["address"], []).append((snapshot["address"], denom, height, delta))
+            if snapshot["address"] in self.pending:
+                COALESCED_WALLETS.inc()
+            elif self.oldest is None:
+                self.oldest = time.monotonic()
+            self.pending[snapshot["address"]] = snapshot
+            QUEUE_DEPTH.set(len(self.pending))
+            if len(self.pending) >= self.batch:
+                self.condition.notify_all()
+
+    def __len__(self) -> int:
+        with self.condition:
+            return len(self.pending)
+
+    def take(self) -> Tuple[List[dict], Dict[str, List[tuple]]]:
+        with self.condition:
+            wallets: List[dict] = list(self.pending.values())
+            changes: Dict[str, List[tuple]] = self.changes
+            self.pending = {}
+            self.changes = {}
+            self.oldest = None
+            QUEUE_DEPTH.set(0)
+        return wallets, changes
+
+    def flush(self) -> None:
+        """
+        Write all pending wallets now, in batches of at most WRITE_BEHIND_BATCH wallets.
+        :return: None
+        """
+        wallets, changes = self.take()
+        for start in range(0, len(wallets), self.batch):
+            batch: List[dict] = wallets[start:start + self.batch]
+            try:
+                with FLUSH_DURATION.time():
+                    self.store.save(batch, [change for wallet in batch for change in changes.get(wallet["address"], ())])
+            except Exception:
+                FLUSH_ERRORS.inc()
+                self.requeue(wallets[start:], changes)
+                raise
+            FLUSHED_WALLETS.inc(len(batch))
+
+    def requeue(self, wallets: List[dict], changes: Dict[str, List[tuple]]) -> None:
+        # keep the changes, unless a newer change of the wallet got queued meanwhile, its balance changes follow the
+        # ones of the failed batch
+        with self.condition:
+            for wallet in wallets:
+                self.pending.setdefault(wallet["address"], wallet)
+                if wallet["address"] in changes:
+                    self.changes[wallet["address"]] = changes[wallet["address"]] + self.changes.get(wallet["address"], [])
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            QUEUE_DEPTH.set(len(self.pending))
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running:
+                    if len(self.pending) >= self.batch:
+                        break
+                    if self.oldest is not None:
+                        remaining: float = self.oldest + self.interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    else:
+                        self.condition.wait()
+                if not self.running:
+                    return
+            try:
+                self.flush()
+            except Exception as error:
+                # the wallets are queued again, try again after the interval
+                richlist.LOGGER.warning(f"Writing wallets failed: {error}. Retry in {self.interval}s.")
+                time.sleep(self.interval)
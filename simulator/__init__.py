@@ -0,0 +1,393 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+# Seed for all generated data, same seed and settings produce the same chain
+SEED = int(os.getenv("SIM_SEED")) if os.getenv("SIM_SEED") else 42
+# Wallets known to the simulated chain
+WALLET_COUNT = int(os.getenv("SIM_WALLETS")) if os.getenv("SIM_WALLETS") else 5000
+# Validators, each validator wallet is one of the first wallets
+VALIDATOR_COUNT = int(os.getenv("SIM_VALIDATORS")) if os.getenv("SIM_VALIDATORS") else 20
+# Liquidity pools with their own AMM wallet
+POOL_COUNT = int(os.getenv("SIM_POOLS")) if os.getenv("SIM_POOLS") else 5
+# Trades per second produced by the simulated exchange
+TRADES_PER_SECOND = float(os.getenv("SIM_TRADES_PER_SECOND")) if os.getenv("SIM_TRADES_PER_SECOND") else 5.0
+# Seconds per block
+BLOCK_TIME = float(os.getenv("SIM_BLOCK_TIME_SEC")) if os.getenv("SIM_BLOCK_TIME_SEC") else 2.0
+# Height of the first block when the simulator starts
+START_HEIGHT = int(os.getenv("SIM_START_HEIGHT")) if os.getenv("SIM_START_HEIGHT") else 7000000
+# Blocks until the balances of a wallet change
+BALANCE_EPOCH_BLOCKS = int(os.getenv("SIM_BALANCE_EPOCH_BLOCKS")) if os.getenv("SIM_BALANCE_EPOCH_BLOCKS") else 500
+# Mean transactions per block, each touches one or two wallets
+TRANSACTIONS_PER_BLOCK = float(os.getenv("SIM_TRANSACTIONS_PER_BLOCK")) if os.getenv("SIM_TRANSACTIONS_PER_BLOCK") else 2.0
+# Share of transfers sent to a wallet never seen before
+NEW_WALLET_RATE = float(os.getenv("SIM_NEW_WALLET_RATE")) if os.getenv("SIM_NEW_WALLET_RATE") else 0.05
+# Mean added latency per request in milliseconds and the jitter around it
+LATENCY_MS = float(os.getenv("SIM_LATENCY_MS")) if os.getenv("SIM_LATENCY_MS") else 0.0
+LATENCY_JITTER_MS = float(os.getenv("SIM_LATENCY_JITTER_MS")) if os.getenv("SIM_LATENCY_JITTER_MS") else 0.0
+# Share of tradehub/cosmos requests answered with 500 'Node is catching up'
+CATCHING_UP_RATE = float(os.getenv("SIM_CATCHING_UP_RATE")) if os.getenv("SIM_CATCHING_UP_RATE") else 0.0
+# Share of requests held for SIM_TIMEOUT_SEC before answering, to trigger client read timeouts
+TIMEOUT_RATE = float(os.getenv("SIM_TIMEOUT_RATE")) if os.getenv("SIM_TIMEOUT_RATE") else 0.0
+TIMEOUT_SEC = float(os.getenv("SIM_TIMEOUT_SEC")) if os.getenv("SIM_TIMEOUT_SEC") else 30.0
+
+# denom -> decimals, coingecko id and price in usd
+TOKENS = {
+    "swth": {"decimals": 8, "id": "switcheo", "usd": 0.05},
+    "eth1": {"decimals": 18, "id": "ethereum", "usd": 1800.0},
+    "usdc1": {"decimals": 6, "id": "usd-coin", "usd": 1.0},
+    "wbtc1": {"decimals": 8, "id": "wrapped-bitcoin", "usd": 50000.0},
+    "nneo2": {"decimals": 8, "id": "neo", "usd": 40.0},
+}
+MARKETS = [
+    {"name": "swth_usdc1", "base": "swth", "quote": "usdc1"},
+    {"name": "swth_eth1", "base": "swth", "quote": "eth1"},
+    {"name": "eth1_usdc1", "base": "eth1", "quote": "usdc1"},
+    {"name": "wbtc1_usdc1", "base": "wbtc1", "quote": "usdc1"},
+]
+VS_CURRENCIES = {"usd": 1.0, "eur": 0.85, "btc": 1 / 50000.0, "eth": 1 / 1800.0}
+
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+# Wall clock of block START_HEIGHT and trade id 0
+STARTED_AT: float = time.time()
+
+# Generated once on import
+WALLET_ADDRESSES: List[str] = []
+WALLET_INDEX: Dict[str, int] = {}
+VALIDATOR_ADDRESSES: List[str] = []
+VALIDATOR_INDEX: Dict[str, int] = {}
+VALIDATOR_DELEGATORS: Dict[int, List[int]] = {}
+
+# Random source of the error injection, seeded so a run can be repeated
+INJECTION_RANDOM = random.Random(SEED)
+
+
+def fake_address(prefix: str, index: int) -> str:
+    """
+    Deterministic bech32 looking address.
+    :param prefix: human readable part like 'swth' or 'swthvaloper'
+    :param index: number of the address
+    :return: address
+    """
+    digest: bytes = hashlib.sha512(f"{SEED}:{prefix}:{index}".encode("UTF-8")).digest()
+    body: str = "".join(BECH32_CHARSET[byte % 32] for byte in digest[:38])
+    return f"{prefix}1{body}"
+
+
+def wallet_random(index: int, *salt) -> random.Random:
+    return random.Random(f"{SEED}:{index}:" + ":".join(str(part) for part in salt))
+
+
+def setup() -> None:
+    """
+    Generate addresses and the delegation graph.
+    :return: None
+    """
+    WALLET_ADDRESSES.clear()
+    WALLET_INDEX.clear()
+    VALIDATOR_ADDRESSES.clear()
+    VALIDATOR_INDEX.clear()
+    VALIDATOR_DELEGATORS.clear()
+    for index in range(WALLET_COUNT + POOL_COUNT):
+        address: str = fake_address("swth", index)
+        WALLET_ADDRESSES.append(address)
+        WALLET_INDEX[address] = index
+    for index in range(VALIDATOR_COUNT):
+        address: str = fake_address("swthvaloper", index)
+        VALIDATOR_ADDRESSES.append(address)
+        VALIDATOR_INDEX[address] = index
+        VALIDATOR_DELEGATORS[index] = []
+    for index in range(WALLET_COUNT):
+        for validator, _ in delegations_of(index):
+            VALIDATOR_DELEGATORS[validator].append(index)
+
+
+def block_height(now: Optional[float] = None) -> int:
+    now = now if now is not None else time.time()
+    return START_HEIGHT + int((now - STARTED_AT) / BLOCK_TIME)
+
+
+def block_timestamp(height: int) -> str:
+    seconds: float = STARTED_AT + (height - START_HEIGHT) * BLOCK_TIME
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat()
+
+
+def base_units(denom: str, amount: float) -> str:
+    return str(int(amount * pow(10, TOKENS[denom]["decimals"])))
+
+
+def is_validator_wallet(index: int) -> bool:
+    return index < VALIDATOR_COUNT
+
+
+def delegations_of(index: int) -> List[tuple]:
+    """
+    Delegations of a wallet. Validator wallets self delegate, about 70% of the other wallets delegate to one up to
+    three validators.
+    :param index: wallet index
+    :return: list of (validator index, amount in swth)
+    """
+    if index >= WALLET_COUNT or VALIDATOR_COUNT == 0:
+        return []
+    rng = wallet_random(index, "delegations")
+    if is_validator_wallet(index):
+        return [(index, round(rng.uniform(1e6, 1e8), 8))]
+    if rng.random() > 0.7:
+        return []
+    validators = rng.sample(range(VALIDATOR_COUNT), min(VALIDATOR_COUNT, rng.randint(1, 3)))
+    # heavy tailed amounts, few whales and a long tail
+    return [(validator, round(rng.paretovariate(1.2) * 1000, 8)) for validator in validators]
+
+
+def balances_of(index: int, height: int) -> Dict[str, dict]:
+    """
+    Spendable, order and position balances of a wallet at a block height. Changes every BALANCE_EPOCH_BLOCKS blocks.
+    :param index: wallet index
+    :param height: block height
+    :return: dict in the format of '/get_balance'
+    """
+    rng = wallet_random(index, "balance")
+    epoch_rng = wallet_random(index, "epoch", height // BALANCE_EPOCH_BLOCKS)
+    balances = {}
+    for denom in TOKENS:
+        if denom != "swth" and rng.random() > 0.3:
+            continue
+        available: float = rng.paretovariate(1.1) * 100 / TOKENS[denom]["usd"] * epoch_rng.uniform(0.9, 1.1)
+        order: float = available * 0.1 if epoch_rng.random() < 0.2 else 0.0
+        balances[denom] = {
+            "denom": denom,
+            "available": "%.8f" % available,
+            "order": "%.8f" % order,
+            "position": "0.00000000",
+        }
+    return balances
+
+
+def unbonding_of(index: int, height: int) -> List[dict]:
+    # unbondings need a validator to unbond from
+    if VALIDATOR_COUNT == 0:
+        return []
+    rng = wallet_random(index, "unbonding", height // BALANCE_EPOCH_BLOCKS)
+    if rng.random() > 0.05:
+        return []
+    completion: int = height + rng.randint(1, 30 * 24 * 3600 // int(max(BLOCK_TIME, 1)))
+    return [{
+        "delegator_address": WALLET_ADDRESSES[index],
+        "validator_address": VALIDATOR_ADDRESSES[rng.randrange(VALIDATOR_COUNT)],
+        "entries": [{
+            "creation_height": str(height),
+            "completion_time": block_timestamp(completion),
+            "initial_balance": base_units("swth", rng.uniform(10, 10000)),
+            "balance": base_units("swth", rng.uniform(10, 10000)),
+        }]
+    }]
+
+
+def rewards_of(index: int, height: int) -> List[dict]:
+    total: float = sum(amount for _, amount in delegations_of(index))
+    if not total:
+        return []
+    # rewards grow with the blocks and reset every epoch as if they were claimed
+    blocks: int = height % BALANCE_EPOCH_BLOCKS
+    return [{"denom": "swth", "amount": "%.18f" % (total * 1e-6 * blocks * pow(10, TOKENS["swth"]["decimals"]))}]
+
+
+def delegation_entry(index: int, validator: int, amount: float) -> dict:
+    return {
+        "delegator_address": WALLET_ADDRESSES[index],
+        "validator_address": VALIDATOR_ADDRESSES[validator],
+        "shares": "%.18f" % amount,
+        "balance": {"denom": "swth", "amount": base_units("swth", amount)},
+    }
+
+
+def validator_delegations(validator: int) -> List[dict]:
+    entries: List[dict] = []
+    for index in VALIDATOR_DELEGATORS.get(validator, []):
+        for delegated_validator, amount in delegations_of(index):
+            if delegated_validator == validator:
+                entries.append(delegation_entry(index, validator, amount))
+    return entries
+
+
+def delegator_delegations(index: int) -> List[dict]:
+    return [delegation_entry(index, validator, amount) for validator, amount in delegations_of(index)]
+
+
+def validators() -> List[dict]:
+    return [{
+        "OperatorAddress": VALIDATOR_ADDRESSES[index],
+        "WalletAddress": WALLET_ADDRESSES[index],
+        "Description": {"moniker": f"Validator #{index}"},
+    } for index in range(VALIDATOR_COUNT)]
+
+
+def liquidity_pools() -> List[dict]:
+    return [{
+        "pool_id": str(pool + 1),
+        "pool_address": WALLET_ADDRESSES[WALLET_COUNT + pool],
+        "name": f"{MARKETS[pool % len(MARKETS)]['base'].upper()}-{MARKETS[pool % len(MARKETS)]['quote'].upper()} #{pool}",
+    } for pool in range(POOL_COUNT)]
+
+
+def profile_of(index: int, height: int) -> dict:
+    rng = wallet_random(index, "profile")
+    last_seen: int = max(START_HEIGHT - rng.randint(0, 1000000), height - rng.randint(0, 100000))
+    return {
+        "address": WALLET_ADDRESSES[index],
+        "username": f"user{index}" if rng.random() < 0.1 else "",
+        "last_seen_block": str(last_seen),
+        "last_seen_time": block_timestamp(last_seen),
+    }
+
+
+def transaction_count(height: int) -> int:
+    rng = wallet_random(height, "transactions")
+    return int(rng.expovariate(1 / TRANSACTIONS_PER_BLOCK)) if TRANSACTIONS_PER_BLOCK > 0 else 0
+
+
+def block_transactions(height: int) -> List[dict]:
+    """
+    Transactions of a block in the format of '/get_transactions', newest first. Transfers and delegations between
+    known wallets, a small share of transfers creates a new wallet.
+    :param height: block height
+    :return: list of transactions
+    """
+    transactions: List[dict] = []
+    count: int = transaction_count(height)
+    for position in range(count):
+        rng = wallet_random(height, "transaction", position)
+        sender: str = WALLET_ADDRESSES[rng.randrange(max(WALLET_COUNT, 1))]
+        amount: str = base_units("swth", rng.paretovariate(1.2) * 100)
+        if VALIDATOR_COUNT and rng.random() < 0.3:
+            msg_type: str = "delegate"
+            msg: dict = {"delegator_address": sender,
+                         "validator_address": VALIDATOR_ADDRESSES[rng.randrange(VALIDATOR_COUNT)],
+                         "amount": {"denom": "swth", "amount": amount}}
+        else:
+            if rng.random() < NEW_WALLET_RATE:
+                receiver: str = fake_address("swth", WALLET_COUNT + POOL_COUNT + height * 1000 + position)
+            else:
+                receiver: str = WALLET_ADDRESSES[rng.randrange(max(WALLET_COUNT, 1))]
+            msg_type: str = "send"
+            msg: dict = {"from_address": sender, "to_address": receiver, "amount": [{"denom": "swth", "amount": amount}]}
+        transactions.append({
+            "id": str(height * 1000 + position),
+            "hash": hashlib.sha256(f"{SEED}:{height}:{position}".encode("UTF-8")).hexdigest().upper(),
+            "address": sender,
+            "username": "",
+            "msgs": [{"msg_type": msg_type, "msg": json.dumps(msg)}],
+            "transaction_memo": "",
+            "block_height": str(height),
+            "block_time": block_timestamp(height),
+            "code": "0",
+        })
+    return list(reversed(transactions))
+
+
+def latest_trade_id(now: Optional[float] = None) -> int:
+    now = now if now is not None else time.time()
+    return int((now - STARTED_AT) * TRADES_PER_SECOND)
+
+
+def trade(trade_id: int) -> dict:
+    rng = wallet_random(trade_id, "trade")
+    market: dict = MARKETS[trade_id % len(MARKETS)]
+    base_price: float = TOKENS[market["base"]]["usd"] / TOKENS[market["quote"]]["usd"]
+    created: float = STARTED_AT + trade_id / TRADES_PER_SECOND if TRADES_PER_SECOND else STARTED_AT
+    quantity: float = rng.paretovariate(1.5) * 10 / TOKENS[market["base"]]["usd"]
+    height: int = block_height(created)
+    return {
+        "id": str(trade_id),
+        "block_created_at": datetime.datetime.fromtimestamp(created, datetime.timezone.utc).isoformat(),
+        "taker_address": WALLET_ADDRESSES[rng.randrange(max(WALLET_COUNT, 1))],
+        "maker_address": WALLET_ADDRESSES[rng.randrange(max(WALLET_COUNT, 1))],
+        "taker_side": "buy" if rng.random() < 0.5 else "sell",
+        "taker_fee_amount": "%.8f" % (quantity * 0.0025),
+        "taker_fee_denom": market["base"],
+        "maker_fee_amount": "%.8f" % (quantity * -0.0005),
+        "maker_fee_denom": market["base"],
+        "market": market["name"],
+        "price": "%.8f" % (base_price * rng.uniform(0.98, 1.02)),
+        "quantity": "%.8f" % quantity,
+        "block_height": str(height),
+    }
+
+
+def trades(after_id: Optional[int], before_id: Optional[int], limit: int = 200) -> List[dict]:
+    """
+    Trades in the open interval (after_id, before_id), newest first like the tradehub node.
+    """
+    latest: int = latest_trade_id()
+    upper: int = min(before_id - 1, latest) if before_id is not None else latest
+    lower: int = after_id + 1 if after_id is not None else 0
+    lower = max(lower, upper - limit + 1)
+    return [trade(trade_id) for trade_id in range(upper, lower - 1, -1)]
+
+
+def coingecko_id_to_denom(coin_id: str) -> Optional[str]:
+    for denom, token in TOKENS.items():
+        if token["id"] == coin_id:
+            return denom
+    return None
+
+
+def price_at(denom: str, epoch: float) -> float:
+    """
+    Deterministic random walk around the reference price of a denom, one step per hour.
+    """
+    hour: int = int(epoch // 3600)
+    rng = random.Random(f"{SEED}:{denom}:{hour}")
+    return TOKENS[denom]["usd"] * (1 + 0.1 * (rng.random() - 0.5))
+
+
+def market_chart_range(denom: str, vs_currency: str, from_epoch: int, to_epoch: int) -> dict:
+    rate: float = VS_CURRENCIES.get(vs_currency, 1.0)
+    start: int = int(from_epoch // 3600 + 1) * 3600
+    end: int = min(int(to_epoch), int(time.time()))
+    prices: List[list] = [[hour * 1000, price_at(denom, hour) * rate] for hour in range(start, end + 1, 3600)]
+    return {
+        "prices": prices,
+        "market_caps": [[point[0], point[1] * 1e8] for point in prices],
+        "total_volumes": [[point[0], point[1] * 1e6] for point in prices],
+    }
+
+
+def simple_price(coin_ids: List[str], vs_currencies: List[str]) -> dict:
+    now: float = time.time()
+    result: dict = {}
+    for coin_id in coin_ids:
+        denom: Optional[str] = coingecko_id_to_denom(coin_id)
+        if not denom:
+            continue
+        result[coin_id] = {vs: price_at(denom, now) * VS_CURRENCIES[vs] for vs in vs_currencies if vs in VS_CURRENCIES}
+    return result
+
+
+def tokens() -> List[dict]:
+    return [{
+        "name": denom.upper(),
+        "symbol": denom.rstrip("0123456789").upper(),
+        "denom": denom,
+        "decimals": token["decimals"],
+        "blockchain": "tradehub",
+    } for denom, token in TOKENS.items()]
+
+
+def injected_latency() -> float:
+    if not LATENCY_MS and not LATENCY_JITTER_MS:
+        return 0.0
+    return max(0.0, INJECTION_RANDOM.gauss(LATENCY_MS, LATENCY_JITTER_MS)) / 1000
+
+
+def inject_catching_up() -> bool:
+    return CATCHING_UP_RATE > 0 and INJECTION_RANDOM.random() < CATCHING_UP_RATE
+
+
+def inject_timeout() -> bool:
+    return TIMEOUT_RATE > 0 and INJECTION_RANDOM.random() < TIMEOUT_RATE
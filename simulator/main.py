@@ -0,0 +1,161 @@
+import asyncio
+import os
+import uvicorn
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+import simulator
+from utils.metrics import instrument_app
+
+# Port of the simulator, point BASE_URI_REST, BASE_URI_COSMOS, BASE_URI_TRADING and BASE_URI_COINGECKO to it
+SIM_PORT = int(os.getenv("SIM_PORT")) if os.getenv("SIM_PORT") else 8010
+
+# Paths answered by coingecko, the node errors are not injected into them
+COINGECKO_PREFIXES = ("/coins/", "/simple/")
+
+
+class InjectionMiddleware:
+    """
+    ASGI middleware adding latency, 'Node is catching up' errors and hanging requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        latency: float = simulator.injected_latency()
+        if latency:
+            await asyncio.sleep(latency)
+        if simulator.inject_timeout():
+            await asyncio.sleep(simulator.TIMEOUT_SEC)
+        if not scope["path"].startswith(COINGECKO_PREFIXES) and simulator.inject_catching_up():
+            response = PlainTextResponse("Node is catching up", status_code=500)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Tradehub, Cosmos and CoinGecko simulator",
+                  description="Serves deterministic synthetic data for all upstream endpoints used by the services.")
+    app.add_middleware(InjectionMiddleware)
+
+    def wallet_index(address: str):
+        return simulator.WALLET_INDEX.get(address)
+
+    @app.get("/get_blocks")
+    async def get_blocks(limit: int = Query(200, ge=1, le=200)):
+        height: int = simulator.block_height()
+        return JSONResponse([{
+            "block_height": str(height - i),
+            "time": simulator.block_timestamp(height - i),
+            "count": str(simulator.transaction_count(height - i)),
+            "proposer_address": simulator.VALIDATOR_ADDRESSES[(height - i) % max(simulator.VALIDATOR_COUNT, 1)]
+            if simulator.VALIDATOR_COUNT else "",
+        } for i in range(limit)])
+
+    @app.get("/get_transactions")
+    async def get_transactions(height: int, before_id: int = None, limit: int = Query(200, ge=1, le=200)):
+        transactions = simulator.block_transactions(height)
+        if before_id is not None:
+            transactions = [transaction for transaction in transactions if int(transaction["id"]) < before_id]
+        return JSONResponse(transactions[:limit])
+
+    @app.get("/get_all_validators")
+    async def get_all_validators():
+        return JSONResponse(simulator.validators())
+
+    @app.get("/get_tokens")
+    async def get_tokens():
+        return JSONResponse(simulator.tokens())
+
+    @app.get("/get_liquidity_pools")
+    async def get_liquidity_pools():
+        return JSONResponse(simulator.liquidity_pools())
+
+    @app.get("/get_balance")
+    async def get_balance(account: str):
+        index = wallet_index(account)
+        if index is None:
+            return JSONResponse({})
+        return JSONResponse(simulator.balances_of(index, simulator.block_height()))
+
+    @app.get("/get_profile")
+    async def get_profile(account: str):
+        index = wallet_index(account)
+        if index is None:
+            return JSONResponse({"address": account, "username": "", "last_seen_block": "0",
+                                 "last_seen_time": simulator.block_timestamp(simulator.START_HEIGHT)})
+        return JSONResponse(simulator.profile_of(index, simulator.block_height()))
+
+    @app.get("/get_markets")
+    async def get_markets():
+        return JSONResponse(simulator.MARKETS)
+
+    @app.get("/get_trades")
+    async def get_trades(after_id: int = None, before_id: int = None):
+        return JSONResponse(simulator.trades(after_id, before_id))
+
+    @app.get("/staking/validators/{validator}/delegations")
+    async def get_validator_delegations(validator: str, page: int = Query(1, ge=1), limit: int = Query(None, ge=1)):
+        if validator not in simulator.VALIDATOR_INDEX:
+            return PlainTextResponse('{"error":"validator does not exist: ' + validator + '"}', status_code=500)
+        delegations: list = simulator.validator_delegations(simulator.VALIDATOR_INDEX[validator])
+        if limit is not None:
+            delegations = delegations[(page - 1) * limit:page * limit]
+        return JSONResponse({"height": str(simulator.block_height()), "result": delegations})
+
+    @app.get("/staking/delegators/{address}/delegations")
+    async def get_delegator_delegations(address: str):
+        index = wallet_index(address)
+        return JSONResponse({"height": str(simulator.block_height()),
+                             "result": simulator.delegator_delegations(index) if index is not None else []})
+
+    @app.get("/staking/delegators/{address}/unbonding_delegations")
+    async def get_delegator_unbonding_delegations(address: str):
+        index = wallet_index(address)
+        height: int = simulator.block_height()
+        return JSONResponse({"height": str(height),
+                             "result": simulator.unbonding_of(index, height) if index is not None else []})
+
+    @app.get("/distribution/validators/{validator}")
+    async def get_validator_distribution(validator: str):
+        if validator not in simulator.VALIDATOR_INDEX:
+            return PlainTextResponse('{"error":"validator does not exist: ' + validator + '"}', status_code=500)
+        index: int = simulator.VALIDATOR_INDEX[validator]
+        rewards = simulator.rewards_of(index, simulator.block_height())
+        return JSONResponse({"height": str(simulator.block_height()), "result": {
+            "operator_address": simulator.WALLET_ADDRESSES[index],
+            "self_bond_rewards": rewards,
+            "val_commission": [{"denom": reward["denom"], "amount": "%.18f" % (float(reward["amount"]) * 0.1)}
+                               for reward in rewards],
+        }})
+
+    @app.get("/distribution/delegators/{address}/rewards")
+    async def get_delegator_distribution(address: str):
+        index = wallet_index(address)
+        rewards = simulator.rewards_of(index, simulator.block_height()) if index is not None else []
+        return JSONResponse({"height": str(simulator.block_height()),
+                             "result": {"rewards": [], "total": rewards or None}})
+
+    @app.get("/coins/{coin_id}/market_chart/range")
+    async def get_market_chart_range(coin_id: str, vs_currency: str, to: int, from_epoch: int = Query(..., alias="from")):
+        denom = simulator.coingecko_id_to_denom(coin_id)
+        if not denom:
+            return JSONResponse({"error": "Could not find coin with the given id"}, status_code=404)
+        return JSONResponse(simulator.market_chart_range(denom, vs_currency, from_epoch, to))
+
+    @app.get("/simple/price")
+    async def get_simple_price(ids: str, vs_currencies: str):
+        return JSONResponse(simulator.simple_price(ids.split(","), vs_currencies.split(",")))
+
+    instrument_app(app)
+    return app
+
+
+if __name__ == "__main__":
+    simulator.setup()
+    uvicorn.run(create_app(), host="0.0.0.0", port=SIM_PORT, loop="asyncio")
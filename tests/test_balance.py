@@ -0,0 +1,59 @@
+import json
+import unittest
+
+from richlist.balance import Balance, decode_wallet, encode, format_units
+
+
+# user-013
+class FormatUnitsTest(unittest.TestCase):
+
+    def test_without_decimals(self):
+        self.assertEqual(format_units(123, 0), "123")
+        self.assertEqual(format_units(-123, 0), "-123")
+
+    def test_with_decimals(self):
+        self.assertEqual(format_units(412369426603, 8), "4123.69426603")
+        self.assertEqual(format_units(-5, 8), "-0.00000005")
+
+
+# user-013
+class RoundTripTest(unittest.TestCase):
+
+    def round_trip(self, balance: Balance, decimals=None) -> Balance:
+        wallet: dict = {"address": "swth1", "balance": {"denom": balance}}
+        data: dict = json.loads(json.dumps(wallet, default=encode))
+        return decode_wallet(data, decimals)["balance"]["denom"]
+
+    def test_without_decimals(self):
+        balance = Balance(0)
+        balance.set("available", 123)
+        balance.set("staking", 7)
+        decoded: Balance = self.round_trip(balance)
+        self.assertEqual(decoded.decimals, 0)
+        self.assertEqual(decoded.available, 123)
+        self.assertEqual(decoded.total, 130)
+
+    def test_with_decimals(self):
+        balance = Balance(8)
+        balance.set("available", 412369426603)
+        decoded: Balance = self.round_trip(balance)
+        self.assertEqual(decoded.decimals, 8)
+        self.assertEqual(decoded.total, 412369426603)
+
+    def test_decimals_of_the_token(self):
+        # written before amounts without decimals lost their '.0'
+        data: dict = {"address": "swth1", "balance": {"denom": {"available": "123.0", "total": "123.0"}}}
+        decoded: Balance = decode_wallet(data, lambda denom: 0)["balance"]["denom"]
+        self.assertEqual(decoded.decimals, 0)
+        self.assertEqual(decoded.total, 123)
+
+    def test_unknown_token(self):
+        balance = Balance(8)
+        balance.set("rewards", 1)
+        decoded: Balance = self.round_trip(balance, lambda denom: None)
+        self.assertEqual(decoded.decimals, 8)
+        self.assertEqual(decoded.rewards, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from unittest import mock
+
+import utils.cosmos
+from utils.cache import MISSING_CACHE
+from utils.exception import DelegationDoesNotExist, ValidatorDoesNotExist
+
+
+# user-004
+class MissingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        MISSING_CACHE.clear()
+
+    def tearDown(self):
+        MISSING_CACHE.clear()
+
+    def test_failed_lookup_is_not_asked_again(self):
+        with mock.patch.object(utils.cosmos, "request_get",
+                               side_effect=ValidatorDoesNotExist("validator does not exist")) as request_get:
+            for _ in range(2):
+                with self.assertRaises(ValidatorDoesNotExist):
+                    utils.cosmos.get_validator_distribution("swthvaloper1")
+        self.assertEqual(request_get.call_count, 1)
+
+    def test_other_lookups_are_asked(self):
+        with mock.patch.object(utils.cosmos, "request_get",
+                               side_effect=DelegationDoesNotExist("delegation does not exist")) as request_get:
+            for address in ("swth1", "swth2"):
+                with self.assertRaises(DelegationDoesNotExist):
+                    utils.cosmos.get_delegator_delegations(address)
+        self.assertEqual(request_get.call_count, 2)
+
+    def test_successful_lookup_is_asked_again(self):
+        with mock.patch.object(utils.cosmos, "request_get", return_value={"result": []}) as request_get:
+            for _ in range(2):
+                self.assertEqual(utils.cosmos.get_delegator_delegations("swth1"), {"result": []})
+        self.assertEqual(request_get.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from richlist.balance import Balance
+from richlist.checkpoint import Checkpoint
+
+
+def balance(decimals: int, **units) -> Balance:
+    result = Balance(decimals)
+    for field, amount in units.items():
+        result.set(field, amount)
+    return result
+
+
+# user-024
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.directory.name, "checkpoint.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        wallets: list = [
+            {"address": "swth1a", "balance": {"swth": balance(8, available=5, staking=7, rewards=-1),
+                                              "eth": balance(18, available=pow(10, 30), orders=3)},
+             "last_checked_height": 10, "validator": None},
+            {"address": "swth1b", "balance": {}, "last_checked_height": 11, "validator": "swthvaloper1"},
+            {"address": "swth1c", "balance": {"swth": balance(8, unbonding=2)}, "last_checked_height": 12,
+             "validator": None},
+        ]
+        tokens: list = [{"denom": "swth", "decimals": 8}]
+        block: dict = {"block_height": "12", "time": "2021-06-01T00:00:00Z"}
+        self.assertEqual(Checkpoint(wallets, tokens, block, 1.5).write(self.path), os.path.getsize(self.path))
+
+        checkpoint = Checkpoint.read(self.path)
+        self.assertEqual(checkpoint.tokens, tokens)
+        self.assertEqual(checkpoint.block, block)
+        self.assertEqual(checkpoint.written_at, 1.5)
+        self.assertEqual(len(checkpoint.wallets), len(wallets))
+        for read, written in zip(checkpoint.wallets, wallets):
+            self.assertEqual(list(read), list(written))
+            self.assertEqual({key: value for key, value in read.items() if key != "balance"},
+                             {key: value for key, value in written.items() if key != "balance"})
+            self.assertEqual(set(read["balance"]), set(written["balance"]))
+            for denom, expected in written["balance"].items():
+                self.assertEqual(read["balance"][denom].decimals, expected.decimals)
+                self.assertEqual(read["balance"][denom].units(), expected.units())
+                self.assertEqual(read["balance"][denom].total, expected.total)
+
+    def test_replaces_former_checkpoint(self):
+        Checkpoint([{"address": "swth1a", "balance": {}}], [], {}).write(self.path)
+        Checkpoint([], [], {"block_height": "1"}).write(self.path)
+        self.assertEqual(Checkpoint.read(self.path).wallets, [])
+        self.assertEqual(os.listdir(self.directory.name), ["checkpoint.bin"])
+
+    def test_no_checkpoint(self):
+        with open(self.path, "wb") as file:
+            file.write(b"\0" * 64)
+        with self.assertRaises(ValueError):
+            Checkpoint.read(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
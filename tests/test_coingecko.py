@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+
+from utils.coingecko import PRIORITY_BACKFILL, PRIORITY_LIVE, TokenBucket
+
+
+# user-019
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(per_minute=60, burst=3)
+        start: float = time.monotonic()
+        for _ in range(3):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_live_before_backfill(self):
+        bucket = TokenBucket(per_minute=600, burst=1)
+        bucket.acquire()
+        served: list = []
+
+        def acquire(name: str, priority: int) -> None:
+            bucket.acquire(priority)
+            served.append(name)
+
+        threads: list = []
+        # the backfill callers wait already when the live caller arrives
+        for name, priority in (("backfill 1", PRIORITY_BACKFILL), ("backfill 2", PRIORITY_BACKFILL),
+                               ("live", PRIORITY_LIVE)):
+            thread = threading.Thread(target=acquire, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(served, ["live", "backfill 1", "backfill 2"])
+
+    def test_rate_limited(self):
+        bucket = TokenBucket(per_minute=6000, burst=1)
+        bucket.record_rate_limited(retry_after=0.2)
+        self.assertEqual(bucket.rate, bucket.max_rate / 2)
+        start: float = time.monotonic()
+        bucket.acquire(PRIORITY_LIVE)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        for _ in range(10):
+            bucket.record_success()
+        self.assertEqual(bucket.rate, bucket.max_rate)
+
+
+if __name__ == "__main__":
+    unittest.main()
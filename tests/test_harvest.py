@@ -0,0 +1,54 @@
+import unittest
+
+from richlist.harvest import DelegationHarvest
+
+
+# user-021
+class DelegationHarvestTest(unittest.TestCase):
+
+    def setUp(self):
+        # heights from which on the block follower saw every block
+        self.followed_from: int = 0
+        self.harvest = DelegationHarvest(lambda height: height >= self.followed_from, max_age=100)
+        self.harvest.replace({"swth1a": {"swth": 5}}, 1000)
+
+    def test_due(self):
+        self.assertTrue(DelegationHarvest(lambda height: True).due(1000))
+        self.assertFalse(self.harvest.due(1100))
+        self.assertTrue(self.harvest.due(1101))
+
+    def test_due_after_missed_blocks(self):
+        self.followed_from = 1050
+        # not before the follower follows the chain again
+        self.assertFalse(self.harvest.due(1040))
+        self.assertTrue(self.harvest.due(1060))
+
+    def test_take(self):
+        self.assertEqual(self.harvest.take("swth1a", 1050), {"swth": 5})
+        # wallets without delegations do not need the delegations call either
+        self.assertEqual(self.harvest.take("swth1b", 1050), {})
+        self.assertEqual(self.harvest.take("swth1a", 1101), None)
+
+    def test_take_changed_wallet(self):
+        self.harvest.invalidate(["swth1a"])
+        self.assertEqual(self.harvest.take("swth1a", 1050), None)
+        self.assertEqual(self.harvest.take("swth1b", 1050), {})
+        self.harvest.replace({"swth1a": {"swth": 6}}, 1060)
+        self.assertEqual(self.harvest.take("swth1a", 1070), {"swth": 6})
+
+    def test_take_after_missed_blocks(self):
+        self.followed_from = 1050
+        self.assertEqual(self.harvest.take("swth1a", 1060), None)
+
+    def test_saved_calls(self):
+        # taken amounts only count once the refresh of the wallet succeeded
+        self.harvest.take("swth1a", 1050)
+        self.assertEqual(self.harvest.pop_saved(), 0)
+        self.harvest.count_saved()
+        self.harvest.count_saved()
+        self.assertEqual(self.harvest.pop_saved(), 2)
+        self.assertEqual(self.harvest.pop_saved(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+
+import richlist.history
+from richlist.history import HistoryStore
+
+
+# user-020
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        connection = sqlite3.connect(":memory:", isolation_level=None)
+        self.store = HistoryStore(connection, threading.Lock())
+        # a keyframe after every third change
+        with mock.patch.object(richlist.history, "HISTORY_KEYFRAME_CHANGES", 3):
+            self.store.write([("a", "swth", 1, 10), ("b", "swth", 2, 5), ("a", "swth", 3, -4)])
+            self.store.write([("c", "swth", 4, 7), ("b", "swth", 5, -5)])
+
+    def keyframes(self) -> list:
+        return self.store.connection.execute("SELECT change_id, height FROM balance_keyframes").fetchall()
+
+    def test_keyframe_written(self):
+        self.assertEqual(self.keyframes(), [(3, 3)])
+
+    def test_ranking_before_keyframe(self):
+        self.assertEqual(self.store.ranking_at("swth", 2), [("a", 10), ("b", 5)])
+
+    def test_ranking_at_keyframe(self):
+        self.assertEqual(self.store.ranking_at("swth", 3), [("a", 6), ("b", 5)])
+
+    def test_ranking_replays_changes_after_keyframe(self):
+        # wallets without balance are not ranked
+        self.assertEqual(self.store.ranking_at("swth", 5), [("c", 7), ("a", 6)])
+
+    def test_late_change_below_keyframe_height(self):
+        # committed after the keyframe, but happened before its height
+        self.store.write([("d", "swth", 2, 1)])
+        self.assertEqual(self.store.ranking_at("swth", 3), [("a", 6), ("b", 5), ("d", 1)])
+
+    def test_unknown_denom(self):
+        self.assertEqual(self.store.ranking_at("eth", 5), [])
+
+    def test_wallet_history(self):
+        self.assertEqual(self.store.wallet_history("a"), [("swth", 1, 10), ("swth", 3, 6)])
+        self.assertEqual(self.store.wallet_history("b", "swth"), [("swth", 2, 5), ("swth", 5, 0)])
+        self.assertEqual(self.store.wallet_history("x"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import io
+import logging
+import unittest
+
+from utils.logs import DispatchHandler
+
+
+# user-008
+class DispatchHandlerTest(unittest.TestCase):
+
+    def record(self, name: str) -> logging.LogRecord:
+        return logging.LogRecord(name, logging.INFO, __file__, 1, "message", None, None)
+
+    def test_closed_stream_is_skipped(self):
+        stream = io.StringIO()
+        dispatch = DispatchHandler()
+        dispatch.add("test", [logging.StreamHandler(stream)])
+        stream.close()
+        dispatch.handle(self.record("test"))
+        dispatch.flush()
+
+    def test_open_stream_is_written(self):
+        stream = io.StringIO()
+        dispatch = DispatchHandler()
+        dispatch.add("test", [logging.StreamHandler(stream)])
+        dispatch.handle(self.record("test"))
+        dispatch.handle(self.record("other"))
+        self.assertEqual(stream.getvalue(), "message\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
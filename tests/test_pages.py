@@ -0,0 +1,82 @@
+import unittest
+
+from fastapi.testclient import TestClient
+
+import richlist.endpoint
+from richlist.api import create_app
+from richlist.balance import Balance
+from richlist.pages import PAGE_CACHE, PageCache, etag, etag_matches
+from richlist.ranking import RankingIndex
+
+
+def record(address: str, total: int) -> dict:
+    balance = Balance(0)
+    balance.set("available", total)
+    return {"address": address, "balance": {"swth": balance}}
+
+
+# user-015
+class EtagTest(unittest.TestCase):
+
+    def test_etag(self):
+        self.assertEqual(etag("swth", 3, 100, 0, started_at="a"), '"a-swth-3-100-0"')
+
+    def test_etag_matches(self):
+        tag: str = etag("swth", 3, started_at="a")
+        self.assertTrue(etag_matches(tag, tag))
+        self.assertTrue(etag_matches('"other", W/' + tag, tag))
+        self.assertTrue(etag_matches("*", tag))
+        self.assertFalse(etag_matches(None, tag))
+        self.assertFalse(etag_matches(etag("swth", 4, started_at="a"), tag))
+
+    def test_page_encoded_once(self):
+        cache = PageCache(size=1)
+        builds: list = []
+
+        def build() -> dict:
+            builds.append(1)
+            return {"page": len(builds)}
+
+        self.assertEqual(cache.get(("swth", 1, 10, 0), build)[1], b'{"page":1}')
+        self.assertEqual(cache.get(("swth", 1, 10, 0), build)[1], b'{"page":1}')
+        cache.get(("swth", 2, 10, 0), build)
+        # evicted by the newer generation
+        self.assertEqual(cache.get(("swth", 1, 10, 0), build)[1], b'{"page":3}')
+
+
+# user-015
+class NotModifiedTest(unittest.TestCase):
+
+    def setUp(self):
+        PAGE_CACHE.clear()
+        self.index = RankingIndex("swth")
+        for address, total in (("a", 3), ("b", 2)):
+            self.index.update(address, total, record(address, total))
+        self.index.publish()
+        richlist.endpoint.SHARED_MEMORY_DICT["swth"] = self.index
+        self.client = TestClient(create_app())
+
+    def tearDown(self):
+        richlist.endpoint.SHARED_MEMORY_DICT.pop("swth", None)
+        PAGE_CACHE.clear()
+
+    def test_not_modified_until_the_ranking_changed(self):
+        response = self.client.get("/richlist/swth/top")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([wallet["address"] for wallet in response.json()["wallets"]], ["a", "b"])
+        tag: str = response.headers["ETag"]
+        response = self.client.get("/richlist/swth/top", headers={"If-None-Match": tag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        # another page has another tag
+        self.assertEqual(self.client.get("/richlist/swth/top?limit=1", headers={"If-None-Match": tag}).status_code, 200)
+        self.index.update("c", 5, record("c", 5))
+        self.index.publish()
+        response = self.client.get("/richlist/swth/top", headers={"If-None-Match": tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], tag)
+        self.assertEqual(response.json()["wallets"][0]["address"], "c")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from richlist.ranking import RankingIndex
+
+
+# user-014
+class RankingIndexTest(unittest.TestCase):
+
+    def index(self, totals: dict) -> RankingIndex:
+        index = RankingIndex("swth", chunk_size=2, decimals=0)
+        for address, total in totals.items():
+            index.update(address, total, {"address": address})
+        index.publish()
+        return index
+
+    def addresses(self, index: RankingIndex) -> list:
+        return [record["address"] for record in index.view().records(0, len(index.view()))]
+
+    def test_sorted_by_total_and_address(self):
+        index = self.index({"c": 5, "a": 5, "b": 9, "d": 1, "e": 7, "f": 3})
+        self.assertEqual(self.addresses(index), ["b", "e", "a", "c", "f", "d"])
+        self.assertEqual(index.view().supply, 30)
+
+    def test_changes_are_visible_after_publish(self):
+        index = self.index({"a": 3, "b": 2, "c": 1})
+        view = index.view()
+        index.update("c", 10, {"address": "c"})
+        index.discard("a")
+        self.assertEqual(self.addresses(index), ["a", "b", "c"])
+        index.publish()
+        self.assertEqual(self.addresses(index), ["c", "b"])
+        self.assertEqual([record["address"] for record in view.records(0, 3)], ["a", "b", "c"])
+        self.assertGreater(index.view().generation, view.generation)
+
+    def test_locate(self):
+        index = self.index({address: total for total, address in enumerate("abcdefgh")})
+        for rank, address in enumerate("hgfedcba"):
+            view, position = index.locate(address)
+            self.assertIs(view, index.view())
+            self.assertEqual(position, rank)
+        self.assertEqual(index.locate("x")[1], None)
+
+    def test_locate_before_publish(self):
+        index = self.index({"a": 3, "b": 2})
+        index.update("b", 5, {"address": "b"})
+        index.update("c", 9, {"address": "c"})
+        # the published view still has the former position and no new wallet
+        self.assertEqual(index.rank("b"), 1)
+        self.assertEqual(index.rank("c"), None)
+        index.publish()
+        self.assertEqual(index.rank("b"), 1)
+        self.assertEqual(index.rank("c"), 0)
+        self.assertEqual(index.rank("a"), 2)
+
+    def test_rebuild(self):
+        index = self.index({"a": 1})
+        index.rebuild([(-4, "b", {"address": "b"}), (-6, "c", {"address": "c"}), (-4, "a", {"address": "a"})])
+        self.assertEqual(self.addresses(index), ["c", "a", "b"])
+        self.assertEqual(index.rank("b"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from richlist.balance import Balance
+from richlist.ranking import RankingIndex
+from richlist.scheduler import CALLS_PER_WALLET, RANK_BUCKETS, RefreshScheduler
+
+BLOCK_TIME = "2021-06-01T00:00:00Z"
+
+
+def record(address: str, total: int, denom: str) -> dict:
+    balance = Balance(0)
+    balance.set("available", total)
+    return {"address": address, "balance": {denom: balance}}
+
+
+def ranking(denom: str, addresses: list) -> RankingIndex:
+    index = RankingIndex(denom)
+    for rank, address in enumerate(addresses):
+        index.update(address, len(addresses) - rank, record(address, len(addresses) - rank, denom))
+    index.publish()
+    return index
+
+
+def wallet(address: str, last_checked_height: int) -> dict:
+    return {"address": address, "last_checked_height": last_checked_height, "last_seen_height": 0,
+            "unbonding_completion_time": None}
+
+
+# user-016
+class RankBucketsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addresses: list = [f"swth1{rank:04d}" for rank in range(RANK_BUCKETS[0] + 10)]
+        self.rankings: dict = {"swth": ranking("swth", self.addresses),
+                               # the last wallet of swth is in the top of eth
+                               "eth": ranking("eth", [self.addresses[-1]])}
+        self.scheduler = RefreshScheduler()
+
+    def test_best_bucket_over_all_denoms(self):
+        buckets: dict = self.scheduler.rank_buckets(self.rankings)
+        self.assertEqual(buckets[self.addresses[0]], 0)
+        self.assertEqual(buckets[self.addresses[RANK_BUCKETS[0] - 1]], 0)
+        self.assertEqual(buckets[self.addresses[RANK_BUCKETS[0]]], 1)
+        self.assertEqual(buckets[self.addresses[-1]], 0)
+
+    def test_computed_once_per_generation(self):
+        buckets: dict = self.scheduler.rank_buckets(self.rankings)
+        self.assertIs(self.scheduler.rank_buckets(self.rankings), buckets)
+        index: RankingIndex = self.rankings["swth"]
+        index.update("swth1new", 1000, record("swth1new", 1000, "swth"))
+        self.assertIs(self.scheduler.rank_buckets(self.rankings), buckets)
+        index.publish()
+        self.assertEqual(self.scheduler.rank_buckets(self.rankings)["swth1new"], 0)
+
+    def test_select_by_bucket_within_budget(self):
+        # budget of two wallets
+        scheduler = RefreshScheduler(calls_per_minute=2 * CALLS_PER_WALLET)
+        tail: str = self.addresses[RANK_BUCKETS[0]]
+        wallets: list = [wallet(tail, 0), wallet(self.addresses[1], 0), wallet(self.addresses[0], 990),
+                         wallet(self.addresses[2], 1000)]
+        # the changed tail wallet waits behind the overdue top wallet, the fresh top wallet is not due
+        selected, deferred = scheduler.select(wallets, {tail, self.addresses[2]}, self.rankings, 1000, BLOCK_TIME,
+                                              lambda _: 100000)
+        self.assertEqual([selected_wallet["address"] for selected_wallet in selected],
+                         [self.addresses[2], self.addresses[1]])
+        self.assertEqual(deferred, {tail})
+        # budget is spent
+        self.assertEqual(scheduler.select(wallets, set(), self.rankings, 1000, BLOCK_TIME, lambda _: 100000)[0], [])
+
+    def test_staleness_report(self):
+        wallets: list = [wallet(self.addresses[0], 900), wallet(self.addresses[1], 1000),
+                         wallet(self.addresses[RANK_BUCKETS[0]], 500), wallet("swth1unranked", 0)]
+        report: dict = self.scheduler.staleness_report(wallets, self.rankings, 1000)
+        self.assertEqual(report[f"top{RANK_BUCKETS[0]}"][100], 100)
+        self.assertEqual(report[f"top{RANK_BUCKETS[0]}"][50], 0)
+        self.assertEqual(report[f"top{RANK_BUCKETS[1]}"][100], 500)
+        self.assertEqual(report["tail"][100], 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import tempfile
+import unittest
+
+from richlist.balance import Balance
+from richlist.pages import encode
+from richlist.ranking import RankingIndex, serialize_record, serialize_stats
+from richlist.snapshot import DENOM, SnapshotReader, SnapshotWriter
+
+# denoms may contain characters not allowed in file names
+IBC = "ibc/27394FB092D2ECCD56123C74F36E4C1F926001CEADA9CA97EA622B25F41E5EB2"
+
+
+def record(address: str, total: int, denom: str = "swth") -> dict:
+    balance = Balance(8)
+    balance.set("available", total)
+    return {"address": address, "balance": {denom: balance}}
+
+
+# user-023
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rankings: dict = {"swth": RankingIndex("swth"), IBC: RankingIndex(IBC)}
+        for address, total in (("swth1a", 300), ("swth1b", 200), ("swth1c", 100), ("swth1d", 200)):
+            self.rankings["swth"].update(address, total, record(address, total))
+        self.rankings[IBC].update("swth1a", 5, record("swth1a", 5, IBC))
+        for index in self.rankings.values():
+            index.publish()
+        self.writer = SnapshotWriter(self.directory.name, self.rankings, {})
+        self.reader = SnapshotReader(self.directory.name, check_interval=0)
+        self.assertEqual(self.writer.write_changed(), 2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_page_matches_memory(self):
+        view = self.rankings["swth"].view()
+        snapshot = self.reader.get(DENOM, "swth")
+        self.assertEqual(snapshot.generation, view.generation)
+        for limit, offset in ((100, 0), (2, 1), (2, 3), (10, 10)):
+            wallets: list = [serialize_record(wallet, "swth") for wallet in view[offset:offset + limit]]
+            page: bytes = encode({"denom": "swth", "total": len(view), "total_subset": len(wallets), "limit": limit,
+                                  "offset": offset, "wallets": wallets})
+            self.assertEqual(snapshot.page({"denom": "swth"}, limit, offset), page)
+        self.assertEqual(snapshot.stats, encode(serialize_stats(view, "swth")))
+
+    def test_find(self):
+        snapshot = self.reader.get(DENOM, "swth")
+        for rank, address in enumerate(("swth1a", "swth1b", "swth1d", "swth1c")):
+            self.assertEqual(snapshot.find(address), rank)
+            self.assertEqual(json.loads(snapshot.record(rank))["address"], address)
+        self.assertEqual(snapshot.find("swth1x"), None)
+
+    def test_names(self):
+        self.assertEqual(sorted(self.reader.names(DENOM)), sorted([IBC, "swth"]))
+        self.assertEqual(self.reader.get(DENOM, IBC).decimals, 8)
+        self.assertEqual(self.reader.get(DENOM, "eth"), None)
+
+    def test_only_changed_rankings_are_written(self):
+        self.assertEqual(self.writer.write_changed(), 0)
+        self.rankings["swth"].update("swth1e", 400, record("swth1e", 400))
+        self.rankings["swth"].publish()
+        self.assertEqual(self.writer.write_changed(), 1)
+        snapshot = self.reader.get(DENOM, "swth")
+        self.assertEqual(snapshot.generation, self.rankings["swth"].view().generation)
+        self.assertEqual(snapshot.find("swth1e"), 0)
+        self.assertEqual(len(snapshot), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import json
+import unittest
+
+from utils.stream import iter_json_array
+
+
+def chunked(text: str, size: int) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+# user-003
+class IterJsonArrayTest(unittest.TestCase):
+
+    def test_items_of_key(self):
+        items: list = [{"a": 1}, {"b": [1, 2], "result": "c"}, 123, "x]y", None]
+        # a nested key of the same name and brackets in strings must not be taken for the array
+        text: str = json.dumps({"height": "5", "meta": {"result": [9], "note": "\"result\": ["}, "result": items})
+        for size in range(1, 8):
+            self.assertEqual(list(iter_json_array(chunked(text, size), "result")), items, f"chunk size {size}")
+
+    def test_document_is_array(self):
+        self.assertEqual(list(iter_json_array(chunked(" [12345, 6.5 ,\n7]", 1))), [12345, 6.5, 7])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array(['{"result": []}'], "result")), [])
+
+    def test_key_not_found(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"height": "5"}'], "result"))
+
+    def test_value_is_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"result": {"a": 1}}'], "result"))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"a": 1}']))
+
+    def test_not_terminated(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"result": [1, 2'], "result"))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['[{"a": 1}, {"b"']))
+
+
+if __name__ == "__main__":
+    unittest.main()
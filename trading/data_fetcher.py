@@ -1,4 +1,5 @@
 import asyncio
+import os
 import time
 from decimal import Decimal
 from typing import List
@@ -7,6 +8,7 @@ from aiohttp import ClientSession
 from requests import HTTPError
 import iso8601
 from utils.postgresql import connect, config
+from utils.metrics import counter, gauge, histogram, start_http_server
 from price.data_fetcher import get_historic_price
 
 SQL_CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS public.trades
@@ -28,10 +30,18 @@ SQL_CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS public.trades
     CONSTRAINT trades_pkey PRIMARY KEY (id)
 )'''
 
-HOST = "http://164.132.169.19:5001"
+HOST = os.getenv("BASE_URI_TRADING") or "http://164.132.169.19:5001"
 
 MARKETS = {}
 
+BATCH_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FETCH_DURATION = histogram("trading_fetch_batch_seconds", "Duration of fetching a batch of trades.", buckets=BATCH_BUCKETS)
+INSERT_DURATION = histogram("trading_insert_batch_seconds", "Duration of pricing and inserting a batch of trades.",
+                            buckets=BATCH_BUCKETS)
+FETCHED_TRADES = counter("trading_fetched_trades_total", "Trades fetched from the tradehub node.")
+PARALLEL_REQUESTS = gauge("trading_parallel_requests", "Parallel trade requests of the next batch.")
+HIGHEST_TRADE_ID = gauge("trading_highest_trade_id", "Highest trade id stored in the database.")
+
 async def get_markets():
     async with ClientSession() as session:
         url = f"{HOST}/get_markets"
@@ -195,12 +205,14 @@ async def fast_data_fetch(start_id, result, session):
 async def main():
     db_config = config("trading/database.ini")
     create_tables(db_config)
+    start_http_server()
     max_parallel_requests = 100
     parallel_requests = 1
     await update_markets()
     while True:
         highest_db_id, count = get_max_trade_id_and_count(db_config)
         print(f"[{count}]Highest Trade ID in database: {highest_db_id}")
+        HIGHEST_TRADE_ID.set(highest_db_id)
         result = []
         start_time = time.time()
         print(f"Start requesting with {parallel_requests} parallel requests")
@@ -208,11 +220,15 @@ async def main():
             await asyncio.gather(*[fast_data_fetch(highest_db_id+i*200, result, session) for i in range(parallel_requests)])
         duration = time.time() - start_time
         print(f"Fetching took took {duration:.3}s")
+        FETCH_DURATION.observe(duration)
+        FETCHED_TRADES.inc(len(result))
         start_time = time.time()
         insert_trades(db_config, result, highest_db_id)
         duration = time.time() - start_time
         print(f"Inserting took {duration:.3}s")
+        INSERT_DURATION.observe(duration)
         parallel_requests = min(int((len(result) / 200) * 2)+1, max_parallel_requests)
+        PARALLEL_REQUESTS.set(parallel_requests)
         if len(result) < 200:
             time.sleep(2)
 
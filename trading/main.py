@@ -1,6 +1,7 @@
 import uvicorn
 from fastapi import FastAPI
 from endpoint import API_ROUTER
+from utils.metrics import instrument_app
 
 
 if __name__ == "__main__":
@@ -16,4 +17,5 @@ if __name__ == "__main__":
                   version="0.1.0",
                   openapi_tags=tags_metadata)
     app.include_router(API_ROUTER, prefix="/trading", tags=["Trading"])
+    instrument_app(app)
     uvicorn.run(app, host="0.0.0.0", port=8003, loop="asyncio")
\ No newline at end of file
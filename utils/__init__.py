@@ -1,19 +1,36 @@
+import asyncio
+import codecs
 import datetime
+import inspect
 import logging
 import os
+import threading
 import time
-from typing import List, Optional, Union
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, List, Optional, Tuple, Type, Union
 
 from iso8601 import parse_date
 
 from utils.exception import *
+from utils.client import get_session, get_async_session
+from utils.logs import PER_ITEM, attach
+from utils.stream import iter_json_array
+from utils.metrics import (UPSTREAM_REJECTED, UPSTREAM_RETRIES, UPSTREAM_TIMEOUTS, observe_upstream,
+                           path_template)
+from utils.resilience import CircuitBreaker, RetryBudget, backoff_delay, get_circuit_breaker, get_retry_budget
 import requests
 import json
 
 REQUEST_LOGGER = None
 
+# Loggers configured by get_file_logger per name
+FILE_LOGGERS = {}
+LOGGER_LOCK = threading.Lock()
+
 REQUEST_CONNECT_TIMEOUT = float(os.getenv("REQUEST_CONNECT_TIMEOUT_SEC")) if os.getenv("REQUEST_CONNECT_TIMEOUT_SEC") else 5.0
 REQUEST_READ_TIMEOUT = float(os.getenv("REQUEST_READ_TIMEOUT_SEC")) if os.getenv("REQUEST_READ_TIMEOUT_SEC") else 5.0
+# Bytes read at once from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 def get_request_logger():
@@ -23,56 +40,258 @@ def get_request_logger():
     return REQUEST_LOGGER
 
 
-def request_get(path: str, base_uri: str, params: dict = None, retries: int = 3, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)):
-    try:
-        response = requests.get(base_uri + path, params=params, timeout=timeout, verify=False, stream=True)
-        get_request_logger().debug(f"request done size: {len(response.content)} bytes")
-        if not 200 <= response.status_code < 300:
-            if response.status_code == 500 and response.content.decode("UTF-8").startswith("Node is catching up"):
-                raise NodeIsCatchingUp("Node is catching up")
-            elif response.status_code == 500 and response.content.decode("UTF-8").startswith('{"error":"delegation does not exist"}'):
-                raise DelegationDoesNotExist("Delegation does not exist.")
-            elif response.status_code == 500 and response.content.decode("UTF-8").startswith('{"error":"validator does not exist: '):
-                raise ValidatorDoesNotExist("Validator does not exist.")
-            else:
-                get_request_logger().critical(f"Request {base_uri + path} params: {params}: {response.status_code} - {response.content}")
-        return json.loads(response.content)
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-        if retries > 0:
-            get_request_logger().debug(f"Request {base_uri + path} params: {params} timeout. Retry")
-            return request_get(path, base_uri, params, retries-1)
+def raise_for_response(uri: str, params: Optional[dict], status_code: int, content: bytes, headers=None) -> None:
+    """
+    Map known Tradehub/Cosmos error responses to exceptions. Unknown errors are only logged.
+    :param uri: requested uri
+    :param params: request params
+    :param status_code: response status code
+    :param content: raw response body
+    :param headers: response headers
+    :return: None
+    """
+    if not 200 <= status_code < 300:
+        if status_code == 429:
+            raise TooManyRequests(f"Request {uri} got rate limited", retry_after=parse_retry_after(headers))
+        elif status_code == 500 and content.decode("UTF-8").startswith("Node is catching up"):
+            raise NodeIsCatchingUp("Node is catching up")
+        elif status_code == 500 and content.decode("UTF-8").startswith('{"error":"delegation does not exist"}'):
+            raise DelegationDoesNotExist("Delegation does not exist.")
+        elif status_code == 500 and content.decode("UTF-8").startswith('{"error":"validator does not exist: '):
+            raise ValidatorDoesNotExist("Validator does not exist.")
         else:
+            get_request_logger().critical(f"Request {uri} params: {params}: {status_code} - {content}")
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Parse the Retry-After header, which is either in seconds or a http date.
+    :param headers: response headers
+    :return: seconds to wait or None if not provided
+    """
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def record_response(breaker: CircuitBreaker, uri: str, params: Optional[dict], status_code: int, content: bytes,
+                    headers=None) -> None:
+    """
+    Report the response to the circuit of the host and raise mapped errors. Known "does not exist" errors and rate
+    limits are valid answers of a healthy host, catching up and other server errors count as failure.
+    """
+    try:
+        raise_for_response(uri, params, status_code, content, headers)
+    except NodeIsCatchingUp:
+        breaker.record_failure()
+        raise
+    except (DelegationDoesNotExist, ValidatorDoesNotExist, TooManyRequests):
+        breaker.record_success()
+        raise
+    if status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+# Transport errors of requests which are retried
+TRANSPORT_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+
+async def send_with_retries(path: str, base_uri: str, params: Optional[dict], retries: int, send: Callable,
+                            transport_errors: Tuple[Type[Exception], ...], sleep: Callable) -> Tuple[Any, float]:
+    """
+    Send a request guarded by the circuit breaker and the retry budget of its host, retrying transport errors with
+    backoff. Shared by all transports: send and sleep are plain functions for requests, see run_sync, and coroutine
+    functions for aiohttp.
+    :param path: requested path
+    :param base_uri: base uri of the upstream
+    :param params: request params
+    :param retries: max retries after transport errors
+    :param send: sends one attempt and returns its result, e.g. the response and its body
+    :param transport_errors: exceptions of the transport counted as timeout
+    :param sleep: time.sleep or asyncio.sleep
+    :return: tuple of the result of the successful attempt and its start from time.perf_counter
+    """
+    breaker: CircuitBreaker = get_circuit_breaker(base_uri)
+    budget: RetryBudget = get_retry_budget(base_uri)
+    budget.record_request()
+    attempt: int = 0
+    while True:
+        if not breaker.allow_request():
+            UPSTREAM_REJECTED.inc(host=breaker.host, path=path_template(path))
+            raise CircuitOpen(f"Circuit of {breaker.host} is open, request {base_uri + path} rejected")
+        start: float = time.perf_counter()
+        try:
+            result = send()
+            if inspect.isawaitable(result):
+                result = await result
+            return result, start
+        except transport_errors:
+            breaker.record_failure()
+            UPSTREAM_TIMEOUTS.inc(host=breaker.host, path=path_template(path))
+            if attempt < retries and budget.can_retry():
+                UPSTREAM_RETRIES.inc(host=breaker.host, path=path_template(path))
+                delay: float = backoff_delay(attempt)
+                get_request_logger().debug(f"Request {base_uri + path} params: {params} timeout. Retry in {delay:.2f}s")
+                slept = sleep(delay)
+                if inspect.isawaitable(slept):
+                    await slept
+                attempt += 1
+                continue
             get_request_logger().debug(f"Request {base_uri + path} params: {params} timeout!!!!")
             raise RequestTimedOut(f"Request {base_uri + path} params: {params} timeout!!!!")
+        except Exception:
+            # do not leave a half open circuit waiting for a trial result that never comes
+            breaker.record_failure()
+            raise
+
+
+def run_sync(coroutine):
+    """
+    Run a coroutine which never suspends without an event loop, e.g. send_with_retries with a blocking transport.
+    :param coroutine: coroutine object
+    :return: result of the coroutine
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("Coroutine suspended outside of an event loop")
+
+
+def request_get(path: str, base_uri: str, params: dict = None, retries: int = 3, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)):
+    def send():
+        response = get_session().get(base_uri + path, params=params, timeout=timeout)
+        return response, response.content
+
+    (response, content), start = run_sync(send_with_retries(path, base_uri, params, retries, send, TRANSPORT_ERRORS,
+                                                            time.sleep))
+    breaker: CircuitBreaker = get_circuit_breaker(base_uri)
+    observe_upstream(breaker.host, path, time.perf_counter() - start, response.status_code, len(content))
+    get_request_logger().debug(f"request done size: {len(content)} bytes")
+    record_response(breaker, base_uri + path, params, response.status_code, content, response.headers)
+    return json.loads(content)
+
+
+def request_get_stream(path: str, base_uri: str, params: dict = None, key: Optional[str] = "result", retries: int = 3, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)):
+    """
+    Streaming variant of request_get for responses holding a large JSON array. Items are decoded and yielded while the
+    response is still downloading, so the memory peak is bounded by a single item instead of the whole response.
+    Retries only happen until the response started, a failure in the middle of the stream raises RequestTimedOut. A
+    non 2xx response raises its mapped error or UnexpectedResponse.
+
+    :param key: key of the array in the top level object, None if the response itself is the array
+    :return: generator of the array items
+    """
+    def send():
+        return get_session().get(base_uri + path, params=params, timeout=timeout, stream=True)
+
+    response, start = run_sync(send_with_retries(path, base_uri, params, retries, send, TRANSPORT_ERRORS, time.sleep))
+    breaker: CircuitBreaker = get_circuit_breaker(base_uri)
+
+    try:
+        if not 200 <= response.status_code < 300:
+            observe_upstream(breaker.host, path, time.perf_counter() - start, response.status_code, len(response.content))
+            record_response(breaker, base_uri + path, params, response.status_code, response.content, response.headers)
+            # an outage must not look like an empty list to the caller
+            raise UnexpectedResponse(f"Request {base_uri + path} params: {params}: {response.status_code}")
+
+        size: int = 0
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+        def chunks():
+            nonlocal size
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                yield text_decoder.decode(chunk)
+            yield text_decoder.decode(b"", final=True)
+
+        stream = chunks()
+        try:
+            yield from iter_json_array(stream, key)
+            # read the rest after the array, so the connection can go back to the pool
+            for _ in stream:
+                pass
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            breaker.record_failure()
+            UPSTREAM_TIMEOUTS.inc(host=breaker.host, path=path_template(path))
+            raise RequestTimedOut(f"Request {base_uri + path} params: {params} timed out while streaming!!!!")
+        observe_upstream(breaker.host, path, time.perf_counter() - start, response.status_code, size)
+        breaker.record_success()
+        get_request_logger().debug(f"stream done size: {size} bytes")
+    finally:
+        response.close()
+
+
+async def request_get_async(path: str, base_uri: str, params: dict = None, retries: int = 3, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)):
+    """
+    Async variant of request_get using the pooled aiohttp session of the running loop.
+    """
+    from aiohttp import ClientError, ClientTimeout
+
+    connect_timeout, read_timeout = timeout
+
+    async def send():
+        session = await get_async_session()
+        async with session.get(base_uri + path, params=params,
+                               timeout=ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)) as response:
+            return response, await response.read()
+
+    (response, content), start = await send_with_retries(path, base_uri, params, retries, send,
+                                                         (asyncio.TimeoutError, ClientError), asyncio.sleep)
+    breaker: CircuitBreaker = get_circuit_breaker(base_uri)
+    observe_upstream(breaker.host, path, time.perf_counter() - start, response.status, len(content))
+    get_request_logger().debug(f"request done size: {len(content)} bytes")
+    record_response(breaker, base_uri + path, params, response.status, content, response.headers)
+    return json.loads(content)
 
 
 def get_file_logger(name: str,
                     terminal_log_level: Optional[Union[str, int]] = logging.INFO,
                     file_log_level: Optional[Union[str, int]] = logging.INFO):
+    """
+    Get a logger writing to the terminal and to 'database/logs/{name}.log'. Handlers are configured only on the first
+    call per name. Records are queued and written by a background thread, so logging never blocks the caller on I/O.
+    """
+    with LOGGER_LOCK:
+        if name in FILE_LOGGERS:
+            return FILE_LOGGERS[name]
+
+        path: str = create_sub_dir(["..", "database", "logs"])
 
-    path: str = create_sub_dir(["..", "database", "logs"])
+        terminal_log_level: int = logging.getLevelName(terminal_log_level) if isinstance(terminal_log_level, str) else terminal_log_level
+        file_log_level: int = logging.getLevelName(file_log_level) if isinstance(file_log_level, str) else file_log_level
 
-    logger = logging.getLogger(name)
-    logger.setLevel(terminal_log_level)
+        logger = logging.getLogger(name)
+        logger.setLevel(min(terminal_log_level, file_log_level))
 
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(terminal_log_level)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setLevel(terminal_log_level)
 
-    # create formatter
-    stream_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    # add formatter to ch
-    stream_handler.setFormatter(stream_formatter)
+        # create formatter
+        stream_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        # add formatter to ch
+        stream_handler.setFormatter(stream_formatter)
 
-    # add ch to logger
-    logger.addHandler(stream_handler)
+        file_handler = logging.FileHandler(f"{path}/{name}.log")
+        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler.setFormatter(file_formatter)
+        file_handler.setLevel(file_log_level)
 
-    file_handler = logging.FileHandler(f"{path}/{name}.log")
-    file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_formatter)
-    file_handler.setLevel(file_log_level)
-    logger.addHandler(file_handler)
+        # both handlers run in the listener thread
+        attach(logger, [stream_handler, file_handler])
 
-    return logger
+        FILE_LOGGERS[name] = logger
+        return logger
 
 
 def create_sub_dir(path_parts: List[str]):
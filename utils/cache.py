@@ -0,0 +1,181 @@
+import copy
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple, Type
+
+from utils.exception import DelegationDoesNotExist, ValidatorDoesNotExist
+
+# Max entries per cache until the least recently used entry is evicted
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES")) if os.getenv("CACHE_MAX_ENTRIES") else 1024
+# Seconds a failed lookup is remembered and answered with the same error
+CACHE_NEGATIVE_TTL = float(os.getenv("CACHE_NEGATIVE_TTL_SEC")) if os.getenv("CACHE_NEGATIVE_TTL_SEC") else 10.0
+# Errors which are the answer of a healthy upstream and would be the same again. Timeouts, open circuits, rate limits
+# and catching up nodes pass and the next caller asks the upstream again
+CACHED_ERRORS: Tuple[Type[Exception], ...] = (DelegationDoesNotExist, ValidatorDoesNotExist)
+
+
+class CacheEntry:
+
+    __slots__ = ("value", "error", "expires_at", "height", "max_block_spread")
+
+    def __init__(self, value: Any, error: Optional[Exception], expires_at: float, height: int,
+                 max_block_spread: Optional[int]):
+        self.value = value
+        self.error = error
+        self.expires_at = expires_at
+        self.height = height
+        self.max_block_spread = max_block_spread
+
+
+class ResponseCache:
+    """
+    Thread safe LRU cache with a TTL per entry. Entries can additionally expire once the chain moved more than
+    `max_block_spread` blocks past the height they were stored at. Failed lookups are stored as well, so a missing
+    item is not asked again for every caller.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, negative_ttl: float = CACHE_NEGATIVE_TTL):
+        self.max_entries: int = max_entries
+        self.negative_ttl: float = negative_ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.block_height: int = 0
+        self.lock = threading.Lock()
+        self.hits: int = 0
+        self.negative_hits: int = 0
+        self.misses: int = 0
+        self.expirations: int = 0
+        self.evictions: int = 0
+
+    def get(self, key: Any) -> Tuple[bool, Optional[CacheEntry]]:
+        """
+        Lookup a key.
+        :param key: hashable key
+        :return: tuple with found flag and the entry
+        """
+        with self.lock:
+            entry: Optional[CacheEntry] = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            if entry.expires_at <= time.time() or \
+                    (entry.max_block_spread is not None and self.block_height - entry.height >= entry.max_block_spread):
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            if entry.error is not None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry
+
+    def set(self, key: Any, value: Any, ttl: float, max_block_spread: Optional[int] = None) -> None:
+        """
+        Store a value.
+        :param key: hashable key
+        :param value: value to store, callers must not modify it afterwards
+        :param ttl: seconds until the entry expires
+        :param max_block_spread: blocks until the entry expires, None to only use the ttl
+        :return: None
+        """
+        self.put(key, CacheEntry(value, None, time.time() + ttl, self.block_height, max_block_spread))
+
+    def set_error(self, key: Any, error: Exception) -> None:
+        """
+        Store a failed lookup for `negative_ttl` seconds.
+        :param key: hashable key
+        :param error: raised exception, will be raised again on hit
+        :return: None
+        """
+        self.put(key, CacheEntry(None, error, time.time() + self.negative_ttl, self.block_height, None))
+
+    def put(self, key: Any, entry: CacheEntry) -> None:
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def set_block_height(self, height: int) -> None:
+        """
+        Publish the current block height. Entries with a block spread are checked against it on the next lookup.
+        :param height: current block height
+        :return: None
+        """
+        with self.lock:
+            if height > self.block_height:
+                self.block_height = height
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Hit and miss statistics. Every hit, including cached failures, saved one upstream call.
+        :return: dict with counters
+        """
+        with self.lock:
+            lookups: int = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+
+# Cache shared by all upstream REST helpers
+RESPONSE_CACHE = ResponseCache()
+# Cache of per wallet and per validator lookups. Only failed lookups are stored, balances must stay fresh
+MISSING_CACHE = ResponseCache()
+
+
+def set_block_height(height: int) -> None:
+    """
+    Publish the current block height to the shared response cache.
+    :param height: current block height
+    :return: None
+    """
+    RESPONSE_CACHE.set_block_height(height)
+
+
+def cached(ttl: Optional[float], max_block_spread: Optional[int] = None, cache: ResponseCache = RESPONSE_CACHE,
+           errors: Tuple[Type[Exception], ...] = CACHED_ERRORS) -> Callable:
+    """
+    Decorator caching the result of a function per call arguments. Raised exceptions of the given types are cached as
+    failed lookups, every hit raises a copy of them.
+    :param ttl: seconds until a result expires, None to only cache failed lookups
+    :param max_block_spread: blocks until a result expires, None to only use the ttl
+    :param cache: cache to store results in
+    :param errors: exception types to cache
+    :return: decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (function.__module__, function.__name__, args, tuple(sorted(kwargs.items())))
+            found, entry = cache.get(key)
+            if found:
+                if entry.error is not None:
+                    # raising the stored instance again would chain the tracebacks of all callers onto it
+                    raise copy.copy(entry.error)
+                return entry.value
+            try:
+                value = function(*args, **kwargs)
+            except errors as error:
+                cache.set_error(key, error)
+                raise
+            if ttl is not None:
+                cache.set(key, value, ttl, max_block_spread)
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Max different hosts kept in the connection pool of the sync session
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS")) if os.getenv("HTTP_POOL_CONNECTIONS") else 10
+# Max open connections per host, requests exceeding this limit wait for a free connection
+POOL_MAX_PER_HOST = int(os.getenv("HTTP_POOL_MAX_PER_HOST")) if os.getenv("HTTP_POOL_MAX_PER_HOST") else 20
+# Max open connections in total for the async session
+POOL_MAX_TOTAL = int(os.getenv("HTTP_POOL_MAX_TOTAL")) if os.getenv("HTTP_POOL_MAX_TOTAL") else 100
+# Seconds an idle keep-alive connection is held open by the async session
+KEEP_ALIVE_TIMEOUT = float(os.getenv("HTTP_KEEP_ALIVE_TIMEOUT_SEC")) if os.getenv("HTTP_KEEP_ALIVE_TIMEOUT_SEC") else 30.0
+
+# Shared sync session, created lazily
+SESSION: Optional[requests.Session] = None
+SESSION_LOCK = threading.Lock()
+
+# Async sessions per event loop, an aiohttp session can not be shared between loops
+ASYNC_SESSIONS: Dict[int, object] = {}
+
+
+def get_session() -> requests.Session:
+    """
+    Get the process wide requests session. The session keeps connections alive and pools them per host, so repeated
+    requests against the same sentry reuse the TCP connection instead of doing a new handshake.
+    :return: shared session
+    """
+    global SESSION
+    if SESSION is None:
+        with SESSION_LOCK:
+            if SESSION is None:
+                session = requests.Session()
+                # pool_block waits for a free connection instead of opening more than POOL_MAX_PER_HOST
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                      pool_maxsize=POOL_MAX_PER_HOST,
+                                      pool_block=True,
+                                      max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.verify = False
+                SESSION = session
+    return SESSION
+
+
+def close_session() -> None:
+    """
+    Close the shared sync session and all pooled connections.
+    :return: None
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is not None:
+            SESSION.close()
+            SESSION = None
+
+
+async def get_async_session():
+    """
+    Get the aiohttp session of the running event loop. Connections are pooled with a total and a per host limit and
+    kept alive between requests.
+    :return: shared aiohttp.ClientSession of the current loop
+    """
+    # aiohttp is only required by the async variant
+    from aiohttp import ClientSession, TCPConnector
+
+    loop = asyncio.get_event_loop()
+    session = ASYNC_SESSIONS.get(id(loop))
+    if session is None or session.closed:
+        connector = TCPConnector(limit=POOL_MAX_TOTAL,
+                                 limit_per_host=POOL_MAX_PER_HOST,
+                                 keepalive_timeout=KEEP_ALIVE_TIMEOUT,
+                                 ssl=False)
+        session = ClientSession(connector=connector)
+        ASYNC_SESSIONS[id(loop)] = session
+    return session
+
+
+async def close_async_session() -> None:
+    """
+    Close the aiohttp session of the running event loop.
+    :return: None
+    """
+    loop = asyncio.get_event_loop()
+    session = ASYNC_SESSIONS.pop(id(loop), None)
+    if session is not None and not session.closed:
+        await session.close()
+
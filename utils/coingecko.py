@@ -1,20 +1,154 @@
+import heapq
+import itertools
+import threading
+import time
 from typing import Optional, List
 from utils import request_get
+from utils.exception import TooManyRequests
+from utils.metrics import counter, gauge
 import os
 
 COINGECKO_BASE_URI = os.getenv("BASE_URI_COINGECKO") or "https://api.coingecko.com/api/v3"
 
+# Requests per minute allowed by coingecko for all callers of this process together
+REQUESTS_PER_MINUTE = float(os.getenv("REQUESTS_PER_MINUTE")) if os.getenv("REQUESTS_PER_MINUTE") else 50.0
+# Requests which can be sent at once after an idle period
+REQUESTS_BURST = float(os.getenv("REQUESTS_BURST")) if os.getenv("REQUESTS_BURST") else 5.0
+# Seconds to pause after a 429 without Retry-After header
+RATE_LIMIT_PAUSE = float(os.getenv("RATE_LIMIT_PAUSE_SEC")) if os.getenv("RATE_LIMIT_PAUSE_SEC") else 60.0
+# Attempts of a request which got rate limited
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES")) if os.getenv("RATE_LIMIT_RETRIES") else 5
 
-def get_historical_price(coin: str, vs_currency: str, from_epoch: int, to_epoch: int) -> List:
-    return request_get(path=f"/coins/{coin}/market_chart/range", base_uri=COINGECKO_BASE_URI, params={
+# Lower value goes first, live prices must not wait behind the historical backfill
+PRIORITY_LIVE = 0
+PRIORITY_BACKFILL = 10
+
+RATE_LIMITER_RATE = gauge("coingecko_rate_limit_per_minute", "Current request rate of the coingecko rate limiter.")
+RATE_LIMITER_WAITING = gauge("coingecko_rate_limit_waiting", "Callers waiting for a coingecko request token.",
+                             ["priority"])
+RATE_LIMITED = counter("coingecko_rate_limited_total", "Requests answered with 429 by coingecko.")
+
+
+class TokenBucket:
+    """
+    Token bucket shared by all threads of a process. Waiting callers are served by priority, then in arrival order.
+    The rate halves on every 429 and all callers pause for the Retry-After time, afterwards the rate recovers step by
+    step with every successful request until the configured maximum is reached again.
+    """
+
+    def __init__(self, per_minute: float = REQUESTS_PER_MINUTE, burst: float = REQUESTS_BURST):
+        self.max_rate: float = per_minute / 60
+        self.min_rate: float = self.max_rate / 16
+        self.rate: float = self.max_rate
+        self.capacity: float = burst
+        self.tokens: float = burst
+        self.updated_at: float = time.monotonic()
+        self.paused_until: float = 0.0
+        self.waiters: list = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        RATE_LIMITER_RATE.set(self.rate * 60)
+
+    def refill(self, now: float) -> None:
+        # no tokens are earned while paused
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def acquire(self, priority: int = PRIORITY_BACKFILL) -> None:
+        """
+        Block until a request may be sent.
+        :param priority: lower values are served first
+        :return: None
+        """
+        with self.condition:
+            entry: tuple = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, entry)
+            RATE_LIMITER_WAITING.inc(priority=priority)
+            try:
+                while True:
+                    now: float = time.monotonic()
+                    self.refill(now)
+                    if self.waiters[0] == entry and now >= self.paused_until and self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    if now < self.paused_until:
+                        wait: float = self.paused_until - now
+                    else:
+                        wait: float = (1.0 - self.tokens) / self.rate if self.tokens < 1.0 else 0.0
+                    # only the head can take the next token, everybody else is woken up once it is gone
+                    self.condition.wait(wait if self.waiters[0] == entry else None)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                RATE_LIMITER_WAITING.dec(priority=priority)
+                self.condition.notify_all()
+
+    def record_success(self) -> None:
+        """
+        Increase the rate again after it was lowered by a 429.
+        :return: None
+        """
+        with self.condition:
+            if self.rate < self.max_rate:
+                self.refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+                RATE_LIMITER_RATE.set(self.rate * 60)
+
+    def record_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """
+        Halve the rate and pause all callers.
+        :param retry_after: seconds from the Retry-After header
+        :return: None
+        """
+        with self.condition:
+            now: float = time.monotonic()
+            self.refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + (retry_after if retry_after is not None else RATE_LIMIT_PAUSE))
+            self.updated_at = self.paused_until
+            RATE_LIMITER_RATE.set(self.rate * 60)
+            self.condition.notify_all()
+
+
+# Single bucket for every coingecko request of this process
+RATE_LIMITER = TokenBucket()
+
+
+def coingecko_get(path: str, params: dict, priority: int):
+    """
+    Request coingecko through the shared rate limiter. Rate limited requests are retried once the bucket allows it.
+    :param path: api path
+    :param params: query parameters
+    :param priority: see PRIORITY_LIVE and PRIORITY_BACKFILL
+    :return: json response
+    """
+    for attempt in range(RATE_LIMIT_RETRIES):
+        RATE_LIMITER.acquire(priority)
+        try:
+            data = request_get(path=path, base_uri=COINGECKO_BASE_URI, params=params)
+        except TooManyRequests as error:
+            RATE_LIMITED.inc()
+            RATE_LIMITER.record_rate_limited(error.retry_after)
+            if attempt + 1 == RATE_LIMIT_RETRIES:
+                raise
+            continue
+        RATE_LIMITER.record_success()
+        return data
+
+
+def get_historical_price(coin: str, vs_currency: str, from_epoch: int, to_epoch: int,
+                         priority: int = PRIORITY_BACKFILL) -> List:
+    return coingecko_get(path=f"/coins/{coin}/market_chart/range", params={
         "vs_currency": vs_currency,
         "from": from_epoch,
         "to": to_epoch
-    })
+    }, priority=priority)
 
 
-def get_price(coins: List[str], vs_currencies: List[str]) -> List:
-    return request_get(path="/simple/price", base_uri=COINGECKO_BASE_URI, params={
+def get_price(coins: List[str], vs_currencies: List[str], priority: int = PRIORITY_LIVE) -> List:
+    return coingecko_get(path="/simple/price", params={
         "ids": ",".join(coins),
         "vs_currencies": ",".join(vs_currencies)
-    })
\ No newline at end of file
+    }, priority=priority)
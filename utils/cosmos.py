@@ -1,4 +1,5 @@
-from utils import request_get
+from utils import request_get, request_get_stream
+from utils.cache import MISSING_CACHE, cached
 import os
 
 COSMOS_BASE_URI = os.getenv("BASE_URI_COSMOS") or "http://164.132.169.19:1318"
@@ -12,10 +13,17 @@ def get_validator_delegations(swthvaloper: str):
     return request_get(f"/staking/validators/{swthvaloper}/delegations", base_uri=COSMOS_BASE_URI)
 
 
+def iter_validator_delegations(swthvaloper: str, page: int = 1, limit: int = 1000):
+    return request_get_stream(f"/staking/validators/{swthvaloper}/delegations", base_uri=COSMOS_BASE_URI,
+                              params={"page": page, "limit": limit}, key="result")
+
+
+@cached(ttl=None, cache=MISSING_CACHE)
 def get_delegator_delegations(address: str):
     return request_get(f"/staking/delegators/{address}/delegations", base_uri=COSMOS_BASE_URI)
 
 
+@cached(ttl=None, cache=MISSING_CACHE)
 def get_validator_distribution(swthvaloper: str):
     return request_get(f"/distribution/validators/{swthvaloper}", base_uri=COSMOS_BASE_URI)
 
@@ -12,3 +12,18 @@ class DelegationDoesNotExist(Exception):
 
 class ValidatorDoesNotExist(Exception):
     pass
+
+
+class CircuitOpen(RequestTimedOut):
+    pass
+
+
+class UnexpectedResponse(RequestTimedOut):
+    pass
+
+
+class TooManyRequests(Exception):
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
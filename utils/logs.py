@@ -0,0 +1,126 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+# Per item messages (one line per wallet, trade, ...) allowed per second and logger, the rest is counted and dropped
+PER_ITEM_LOGS_PER_SECOND = float(os.getenv("LOG_PER_ITEM_PER_SECOND")) if os.getenv("LOG_PER_ITEM_PER_SECOND") else 5.0
+
+# Pass as `extra` to mark a message as per item message, e.g. LOGGER.info("...", extra=PER_ITEM)
+PER_ITEM = {"per_item": True}
+
+
+class PerItemRateLimitFilter(logging.Filter):
+    """
+    Rate limits records marked with PER_ITEM. Runs in the logging thread before the record is queued, so dropped
+    records cost nearly nothing. The next passing record tells how many similar ones got dropped.
+    """
+
+    def __init__(self, per_second: float = PER_ITEM_LOGS_PER_SECOND):
+        super().__init__()
+        self.per_second: float = per_second
+        self.tokens: float = per_second
+        self.updated_at: float = time.monotonic()
+        self.suppressed: int = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "per_item", False) or record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            now: float = time.monotonic()
+            self.tokens = min(self.per_second, self.tokens + (now - self.updated_at) * self.per_second)
+            self.updated_at = now
+            if self.tokens < 1.0:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1.0
+            if self.suppressed:
+                record.msg = f"{record.getMessage()} ({self.suppressed} similar messages suppressed)"
+                record.args = None
+                self.suppressed = 0
+        return True
+
+
+class DispatchHandler(logging.Handler):
+    """
+    Runs in the listener thread and hands a record to the stream and file handlers of its logger.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.handlers: Dict[str, List[logging.Handler]] = {}
+
+    def add(self, name: str, handlers: List[logging.Handler]) -> None:
+        self.handlers[name] = handlers
+
+    def handle(self, record: logging.LogRecord) -> None:
+        for handler in self.handlers.get(record.name, []):
+            if record.levelno >= handler.level and not stream_closed(handler):
+                handler.handle(record)
+
+    def flush(self) -> None:
+        for handlers in list(self.handlers.values()):
+            for handler in handlers:
+                if stream_closed(handler):
+                    continue
+                try:
+                    handler.flush()
+                except ValueError:
+                    # closed by another thread meanwhile
+                    pass
+
+
+def stream_closed(handler: logging.Handler) -> bool:
+    # e.g. a terminal stream replaced and closed by a test runner before the interpreter exits
+    stream = getattr(handler, "stream", None)
+    return stream is not None and getattr(stream, "closed", False)
+
+
+# One unbounded queue and one listener thread for all loggers, callers never wait for the terminal or the disk
+LOG_QUEUE: queue.Queue = queue.Queue(-1)
+DISPATCH_HANDLER = DispatchHandler()
+LOG_LISTENER: Optional[QueueListener] = None
+LISTENER_LOCK = threading.Lock()
+
+
+def start_listener() -> None:
+    global LOG_LISTENER
+    with LISTENER_LOCK:
+        if LOG_LISTENER is None:
+            LOG_LISTENER = QueueListener(LOG_QUEUE, DISPATCH_HANDLER)
+            LOG_LISTENER.start()
+            atexit.register(stop_listener)
+
+
+def stop_listener() -> None:
+    """
+    Write all queued records and stop the listener thread. Registered with atexit after the logging module, so it
+    runs before logging.shutdown closes the file handlers.
+    :return: None
+    """
+    global LOG_LISTENER
+    with LISTENER_LOCK:
+        if LOG_LISTENER is not None:
+            LOG_LISTENER.stop()
+            DISPATCH_HANDLER.flush()
+            LOG_LISTENER = None
+
+
+def attach(logger: logging.Logger, handlers: List[logging.Handler]) -> None:
+    """
+    Route a logger through the shared queue to the given handlers.
+    :param logger: logger to configure
+    :param handlers: handlers executed in the listener thread
+    :return: None
+    """
+    DISPATCH_HANDLER.add(logger.name, handlers)
+    queue_handler = QueueHandler(LOG_QUEUE)
+    queue_handler.addFilter(PerItemRateLimitFilter())
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    start_listener()
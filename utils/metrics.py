@@ -0,0 +1,391 @@
+import abc
+import bisect
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.cache import MISSING_CACHE, RESPONSE_CACHE
+from utils.resilience import CLOSED, HALF_OPEN, OPEN, circuit_states
+
+# Port of the standalone metrics server used by processes without an API
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else 9100
+
+# Default histogram buckets in seconds, fitting for upstream and API request latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Histogram buckets in seconds for long running jobs like a richlist update cycle
+JOB_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0, 7200.0)
+
+MEDIA_TYPE = "text/plain; version=0.0.4"
+CONTENT_TYPE = f"{MEDIA_TYPE}; charset=utf-8"
+
+# Addresses and coin ids in upstream paths are replaced to keep the number of label values small
+ADDRESS_SEGMENT = re.compile(r"^t?swth(valoper)?1[0-9a-z]+$")
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs: List[str] = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{escape_label(extra[1])}"')
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: Tuple[str, ...] = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """
+        Lines of the metric in the Prometheus text format.
+        :return: list of lines
+        """
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        # for totals counted elsewhere, e.g. by a collector, a counter never goes down
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = max(self.values.get(key, 0.0), value)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+                                for key, value in items]
+
+
+class Gauge(Metric):
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+                                for key, value in items]
+
+
+class Histogram(Metric):
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets)) + (float("inf"),)
+        # per label set: bucket counts (not cumulative), sum, count
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        index: int = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            data = self.values[key]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = [(key, (list(data[0]), data[1], data[2])) for key, data in self.values.items()]
+        lines: List[str] = self.header()
+        for key, (counts, total, count) in items:
+            cumulative: int = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.label_names, key, ("le", format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Timer:
+    """
+    Context manager observing the elapsed seconds into a histogram.
+    """
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram: Histogram = histogram
+        self.labels: dict = labels
+        self.start: float = 0.0
+        self.duration: float = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.duration = time.perf_counter() - self.start
+        self.histogram.observe(self.duration, **self.labels)
+
+
+# All metrics of this process by name
+REGISTRY: Dict[str, Metric] = {}
+REGISTRY_LOCK = threading.Lock()
+# Functions called before rendering to refresh gauges of state kept elsewhere
+COLLECTORS: List[Callable[[], None]] = []
+
+
+def get_or_create(cls, name: str, documentation: str, labels: Sequence[str] = (), **kwargs) -> Metric:
+    with REGISTRY_LOCK:
+        if name not in REGISTRY:
+            REGISTRY[name] = cls(name, documentation, labels, **kwargs)
+        metric = REGISTRY[name]
+    if not isinstance(metric, cls):
+        raise ValueError(f"Metric '{name}' is already registered as {metric.type}")
+    return metric
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+    return get_or_create(Counter, name, documentation, labels)
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+    return get_or_create(Gauge, name, documentation, labels)
+
+
+def histogram(name: str, documentation: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return get_or_create(Histogram, name, documentation, labels, buckets=buckets)
+
+
+def register_collector(collector: Callable[[], None]) -> None:
+    """
+    Register a function which updates gauges right before the metrics are rendered.
+    :param collector: function without arguments
+    :return: None
+    """
+    if collector not in COLLECTORS:
+        COLLECTORS.append(collector)
+
+
+def render() -> str:
+    """
+    Render all metrics in the prometheus text exposition format.
+    :return: metrics as text
+    """
+    for collector in list(COLLECTORS):
+        collector()
+    lines: List[str] = []
+    for name in sorted(REGISTRY.keys()):
+        lines += REGISTRY[name].render()
+    return "\n".join(lines) + "\n"
+
+
+def path_template(path: str) -> str:
+    """
+    Replace wallet/operator addresses and coin ids of an upstream path with placeholders.
+    :param path: requested path, e.g. '/staking/delegators/swth1.../delegations'
+    :return: path template, e.g. '/staking/delegators/{address}/delegations'
+    """
+    segments: List[str] = path.split("/")
+    for i, segment in enumerate(segments):
+        if ADDRESS_SEGMENT.match(segment):
+            segments[i] = "{address}"
+        elif i > 0 and segments[i - 1] == "coins" and segment:
+            segments[i] = "{id}"
+    return "/".join(segments)
+
+
+UPSTREAM_LATENCY = histogram("upstream_request_duration_seconds",
+                             "Latency of upstream requests including reading the body.", ["host", "path"])
+UPSTREAM_BYTES = counter("upstream_response_bytes_total", "Bytes received from upstream.", ["host", "path"])
+UPSTREAM_RESPONSES = counter("upstream_responses_total", "Upstream responses by status code.",
+                             ["host", "path", "status"])
+UPSTREAM_RETRIES = counter("upstream_retries_total", "Retried upstream requests.", ["host", "path"])
+UPSTREAM_TIMEOUTS = counter("upstream_timeouts_total", "Timed out or refused upstream requests.", ["host", "path"])
+UPSTREAM_REJECTED = counter("upstream_rejected_total", "Requests rejected by an open circuit.", ["host", "path"])
+
+API_LATENCY = histogram("api_request_duration_seconds", "Latency of API requests per route.", ["method", "route"])
+API_RESPONSES = counter("api_responses_total", "API responses per route and status code.",
+                        ["method", "route", "status"])
+
+
+CIRCUIT_STATE = gauge("upstream_circuit_state", "1 for the current circuit state of an upstream host.",
+                      ["host", "state"])
+CIRCUIT_FAILURES = gauge("upstream_circuit_failures", "Consecutive failures of an upstream host.", ["host"])
+CACHE_LOOKUPS = counter("response_cache_lookups_total", "Lookups of the shared response cache by result.", ["result"])
+CACHE_ENTRIES = gauge("response_cache_entries", "Entries in the shared response cache.")
+MISSING_CACHE_HITS = counter("missing_cache_hits_total", "Per wallet and per validator lookups answered with a cached "
+                                                         "failure.")
+
+
+def collect_upstream_state() -> None:
+    for host, state in circuit_states().items():
+        for name in (CLOSED, HALF_OPEN, OPEN):
+            CIRCUIT_STATE.set(1 if state["state"] == name else 0, host=host, state=name)
+        CIRCUIT_FAILURES.set(state["failures"], host=host)
+    stats: dict = RESPONSE_CACHE.stats()
+    for result in ("hits", "negative_hits", "misses", "expirations", "evictions"):
+        CACHE_LOOKUPS.set_total(stats[result], result=result)
+    CACHE_ENTRIES.set(stats["entries"])
+    MISSING_CACHE_HITS.set_total(MISSING_CACHE.stats()["negative_hits"])
+
+
+register_collector(collect_upstream_state)
+
+
+def observe_upstream(host: str, path: str, seconds: float, status: int, size: int) -> None:
+    """
+    Record a finished upstream request.
+    :param host: host of the upstream
+    :param path: requested path, will be templated
+    :param seconds: duration including reading the body
+    :param status: response status code
+    :param size: body size in bytes
+    :return: None
+    """
+    template: str = path_template(path)
+    UPSTREAM_LATENCY.observe(seconds, host=host, path=template)
+    UPSTREAM_BYTES.inc(size, host=host, path=template)
+    UPSTREAM_RESPONSES.inc(host=host, path=template, status=status)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and status code per route template of a starlette/FastAPI app.
+    """
+
+    def __init__(self, app, router=None):
+        self.app = app
+        self.router = router
+
+    def route_of(self, scope) -> str:
+        from starlette.routing import Match
+
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start: float = time.perf_counter()
+        status: list = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route: str = self.route_of(scope)
+            API_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=route)
+            API_RESPONSES.inc(method=scope["method"], route=route, status=status[0])
+
+
+def instrument_app(app) -> None:
+    """
+    Record latency and status codes of all routes of a FastAPI app and serve the metrics on '/metrics'.
+    :param app: FastAPI app
+    :return: None
+    """
+    from starlette.responses import Response
+
+    app.add_middleware(MetricsMiddleware, router=app.router)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(render(), media_type=MEDIA_TYPE)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body: bytes = render().encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_http_server(port: int = METRICS_PORT, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve '/metrics' in a daemon thread. Used by the data fetcher processes which have no API.
+    :param port: port to listen on
+    :param host: interface to bind
+    :return: running server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.setName("Metrics Server")
+    thread.start()
+    return server
@@ -0,0 +1,193 @@
+import os
+import random
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlsplit
+
+# Base delay in seconds of the exponential backoff
+BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE_SEC")) if os.getenv("RETRY_BACKOFF_BASE_SEC") else 0.5
+# Upper limit in seconds of a single backoff delay
+BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX_SEC")) if os.getenv("RETRY_BACKOFF_MAX_SEC") else 10.0
+# Retries allowed per request on average, e.g. 0.2 allows one retry for every five requests
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO")) if os.getenv("RETRY_BUDGET_RATIO") else 0.2
+# Retries always allowed regardless of the ratio, so a quiet host can still be retried
+RETRY_BUDGET_MIN = float(os.getenv("RETRY_BUDGET_MIN")) if os.getenv("RETRY_BUDGET_MIN") else 10.0
+# Consecutive failures until the circuit of a host opens
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD")) if os.getenv("CIRCUIT_FAILURE_THRESHOLD") else 5
+# Seconds an open circuit rejects requests before a trial request is let through
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT_SEC")) if os.getenv("CIRCUIT_RESET_TIMEOUT_SEC") else 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with full jitter. Spreads retries of many threads over the whole window instead of letting
+    them hit the upstream at the same moment.
+    :param attempt: number of the retry starting with 0
+    :param base: delay of the first retry
+    :param maximum: highest possible delay
+    :return: delay in seconds
+    """
+    return random.uniform(0, min(maximum, base * pow(2, attempt)))
+
+
+class RetryBudget:
+    """
+    Limits retries to a share of the requests sent to a host. Every request deposits `ratio` tokens, every retry
+    withdraws one. If an upstream is down the budget runs dry and requests fail fast instead of multiplying the load.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, minimum: float = RETRY_BUDGET_MIN):
+        self.ratio: float = ratio
+        self.maximum: float = minimum
+        self.tokens: float = minimum
+        self.lock = threading.Lock()
+
+    def record_request(self) -> None:
+        with self.lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def can_retry(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    Per host circuit. After `failure_threshold` consecutive failures the circuit opens and requests are rejected
+    without touching the network. After `reset_timeout` seconds a single trial request is let through (half open),
+    its result closes or opens the circuit again.
+    """
+
+    def __init__(self, host: str,
+                 failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.host: str = host
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.state: str = CLOSED
+        self.failures: int = 0
+        self.opened_at: float = 0.0
+        self.trial_running: bool = False
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """
+        Check if a request may be sent. Moves an open circuit to half open once the reset timeout passed.
+        :return: True if the request can be sent
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.trial_running = False
+            if self.state == HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def is_available(self) -> bool:
+        """
+        Check without side effects if requests to this host have a chance to get through.
+        :return: False while the circuit is open
+        """
+        with self.lock:
+            return self.state != OPEN or time.time() - self.opened_at >= self.reset_timeout
+
+    def retry_after(self) -> float:
+        """
+        Seconds until an open circuit allows the next trial request.
+        :return: seconds or 0.0 if requests are allowed
+        """
+        with self.lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+            self.trial_running = False
+
+
+# Circuits and retry budgets per host
+CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+RETRY_BUDGETS: Dict[str, RetryBudget] = {}
+REGISTRY_LOCK = threading.Lock()
+
+
+def host_of(uri: str) -> str:
+    """
+    Small helper to get the host with port of an uri.
+    :param uri: full uri or base uri
+    :return: host:port
+    """
+    return urlsplit(uri).netloc or uri
+
+
+def get_circuit_breaker(uri: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of the host of an uri. Creates a closed circuit for unknown hosts.
+    :param uri: full uri or base uri
+    :return: circuit breaker
+    """
+    host: str = host_of(uri)
+    if host not in CIRCUIT_BREAKERS:
+        with REGISTRY_LOCK:
+            if host not in CIRCUIT_BREAKERS:
+                CIRCUIT_BREAKERS[host] = CircuitBreaker(host)
+    return CIRCUIT_BREAKERS[host]
+
+
+def get_retry_budget(uri: str) -> RetryBudget:
+    """
+    Get the retry budget of the host of an uri.
+    :param uri: full uri or base uri
+    :return: retry budget
+    """
+    host: str = host_of(uri)
+    if host not in RETRY_BUDGETS:
+        with REGISTRY_LOCK:
+            if host not in RETRY_BUDGETS:
+                RETRY_BUDGETS[host] = RetryBudget()
+    return RETRY_BUDGETS[host]
+
+
+def is_available(uri: str) -> bool:
+    """
+    Check if the host of an uri is currently considered healthy enough to send requests to.
+    :param uri: full uri or base uri
+    :return: False if the circuit of the host is open
+    """
+    return get_circuit_breaker(uri).is_available()
+
+
+def circuit_states() -> Dict[str, dict]:
+    """
+    Snapshot of all known circuits.
+    :return: dict host -> state, consecutive failures and seconds until the next trial request
+    """
+    return {
+        host: {
+            "state": breaker.state,
+            "failures": breaker.failures,
+            "retry_after": breaker.retry_after(),
+        } for host, breaker in list(CIRCUIT_BREAKERS.items())
+    }
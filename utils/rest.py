@@ -1,14 +1,28 @@
 from typing import Optional
 from utils import request_get
+from utils.cache import cached
 import os
 
 REST_BASE_URI = os.getenv("BASE_URI_REST") or "http://164.132.169.19:5002"
 
+# Seconds until slow changing data like tokens, validators and pools is requested again
+CACHE_TTL = float(os.getenv("REST_CACHE_TTL_SEC")) if os.getenv("REST_CACHE_TTL_SEC") else 600.0
+# Blocks until cached validators and pools are requested again
+CACHE_MAX_BLOCK_SPREAD = int(os.getenv("REST_CACHE_MAX_BLOCK_SPREAD")) if os.getenv("REST_CACHE_MAX_BLOCK_SPREAD") else 1000
+
 
 def get_blocks(limit: Optional[int] = 200):
     return request_get("/get_blocks", base_uri=REST_BASE_URI, params={"limit": limit})
 
 
+def get_transactions(height: int, before_id: Optional[int] = None, limit: Optional[int] = 200):
+    params: dict = {"height": height, "limit": limit}
+    if before_id is not None:
+        params["before_id"] = before_id
+    return request_get("/get_transactions", base_uri=REST_BASE_URI, params=params)
+
+
+@cached(ttl=CACHE_TTL, max_block_spread=CACHE_MAX_BLOCK_SPREAD)
 def get_all_validators():
     return request_get("/get_all_validators", base_uri=REST_BASE_URI)
 
@@ -21,9 +35,11 @@ def get_profile(address: str):
     return request_get("/get_profile", base_uri=REST_BASE_URI, params={"account": address})
 
 
+@cached(ttl=CACHE_TTL)
 def get_tokens():
     return request_get("/get_tokens", base_uri=REST_BASE_URI)
 
 
+@cached(ttl=CACHE_TTL, max_block_spread=CACHE_MAX_BLOCK_SPREAD)
 def get_liquidity_pools():
     return request_get("/get_liquidity_pools", base_uri=REST_BASE_URI)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import json
+from typing import Iterable, Iterator, Optional
+
+
+def iter_json_array(chunks: Iterable[str], key: Optional[str] = None) -> Iterator:
+    """
+    Incrementally decode the items of a JSON array from text chunks. Only the item currently decoded and the not yet
+    consumed rest of the last chunk are held in memory.
+
+    :param chunks: iterable of decoded text chunks, e.g. from a streamed response
+    :param key: key of the array in the top level object, None if the document itself is the array
+    :return: generator of the decoded items
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer: str = ""
+    position: int = 0
+
+    def read() -> bool:
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                # drop the consumed part to keep the buffer small
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+
+    # scan until the opening bracket of the requested array
+    depth: int = 0
+    in_string: bool = False
+    escape: bool = False
+    string: list = []
+    last_string: Optional[str] = None
+    value_key: Optional[str] = None
+    while True:
+        if position >= len(buffer):
+            if not read():
+                raise ValueError(f"JSON array '{key}' not found in response")
+            continue
+        char: str = buffer[position]
+        position += 1
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                last_string = "".join(string)
+                continue
+            if depth == 1:
+                string.append(char)
+            continue
+        if char.isspace():
+            continue
+        if key is None:
+            if char == "[":
+                break
+            raise ValueError("JSON document is not an array")
+        # first character of a value in the top level object
+        if depth == 1 and value_key is not None:
+            if value_key == key:
+                if char == "[":
+                    break
+                raise ValueError(f"JSON value of '{key}' is not an array")
+            value_key = None
+        if char == '"':
+            in_string = True
+            string = []
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+        elif char == ":" and depth == 1:
+            value_key = last_string
+
+    # decode item by item
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            if not read():
+                raise ValueError("JSON array is not terminated")
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # item is not complete yet
+            if not read():
+                raise
+            continue
+        if end >= len(buffer) or buffer[end] not in " \t\r\n,]":
+            # a number could continue in the next chunk, decode again once the delimiter is known
+            if read():
+                continue
+            raise ValueError("JSON array is not terminated")
+        position = end
+        yield item
@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from utils.metrics import counter, gauge
+
+# Seconds between two background refreshes of the token registry
+TOKEN_REFRESH_INTERVAL = float(os.getenv("TOKEN_REFRESH_INTERVAL_SEC")) if os.getenv("TOKEN_REFRESH_INTERVAL_SEC") else 600.0
+# Seconds an unknown denom is answered with an error before the tokens are fetched again for it
+TOKEN_UNKNOWN_TTL = float(os.getenv("TOKEN_UNKNOWN_TTL_SEC")) if os.getenv("TOKEN_UNKNOWN_TTL_SEC") else 60.0
+
+TOKEN_REFRESHES = counter("token_registry_refreshes_total", "Fetches of the token list.", ["reason"])
+TOKEN_MISSES = counter("token_registry_misses_total", "Lookups of denoms not in the registry.", ["result"])
+TOKENS_KNOWN = gauge("token_registry_tokens", "Tokens known to the registry.")
+
+
+class Token:
+    """
+    Metadata of a denom with its scale factor and formats computed once, conversions are table lookups.
+    """
+
+    __slots__ = ("denom", "decimals", "scale", "float_format", "data")
+
+    def __init__(self, data: dict):
+        """
+        :param data: token as returned by get_tokens
+        """
+        self.data: dict = data
+        self.denom: str = data["denom"]
+        self.decimals: int = int(data["decimals"])
+        self.scale: int = pow(10, self.decimals)
+        self.float_format: str = "%%.%df" % self.decimals
+
+    def to_float(self, units) -> float:
+        """
+        Convert base units to a human readable float.
+        :param units: amount in base units
+        :return: amount as float
+        """
+        return units / self.scale
+
+    def format_float(self, amount: float) -> str:
+        """
+        Format a human readable float with the decimals of the denom.
+        :param amount: amount as float
+        :return: amount as decimal string
+        """
+        return self.float_format % amount
+
+
+class TokenRegistry:
+    """
+    Tokens by denom, kept in a json file so a restart knows all tokens without asking the upstream. The registry is
+    refreshed in the background, a lookup of an unknown denom fetches the tokens at most once per TOKEN_UNKNOWN_TTL
+    and answers with an error in between, so a bogus denom can not make every conversion download all tokens.
+    """
+
+    def __init__(self, fetch: Callable[[], List[dict]], path: Optional[str] = None,
+                 unknown_ttl: float = TOKEN_UNKNOWN_TTL):
+        """
+        :param fetch: returns all tokens uncached, e.g. the function wrapped by utils.rest.get_tokens
+        :param path: json file of the registry, None keeps it in memory only
+        :param unknown_ttl: seconds an unknown denom is not looked up again
+        """
+        self.fetch: Callable[[], List[dict]] = fetch
+        self.path: Optional[str] = path
+        self.unknown_ttl: float = unknown_ttl
+        self.tokens: Dict[str, Token] = {}
+        # denom -> monotonic time until which it is known to be missing
+        self.unknown: Dict[str, float] = {}
+        self.refreshed_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __contains__(self, denom: str) -> bool:
+        return denom in self.tokens
+
+    def load(self, path: Optional[str] = None) -> int:
+        """
+        Read the tokens stored by the last refresh.
+        :param path: json file of the registry, replaces the path given at construction
+        :return: number of loaded tokens
+        """
+        if path is not None:
+            self.path = path
+        if self.path is None or not os.path.isfile(self.path):
+            return 0
+        with open(self.path, "r") as file:
+            self.set_tokens(json.loads(file.read()))
+        return len(self.tokens)
+
+    def save(self, tokens: List[dict]) -> None:
+        if self.path is None:
+            return
+        # write the new file aside first, a crash never leaves a truncated registry. Worker processes may share the file
+        temporary: str = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            file.write(json.dumps(tokens, separators=(",", ":")))
+        os.replace(temporary, self.path)
+
+    def set_tokens(self, tokens: List[dict]) -> None:
+        # replaced at once, lookups of other threads see either the former or the new tokens
+        self.tokens = {token["denom"]: Token(token) for token in tokens}
+        TOKENS_KNOWN.set(len(self.tokens))
+
+    def refresh(self, reason: str = "interval", since: Optional[float] = None) -> int:
+        """
+        Fetch all tokens and store them if they changed.
+        :param reason: reason of the refresh for the metrics
+        :param since: skip the fetch if another thread refreshed after this monotonic time
+        :return: number of known tokens
+        """
+        with self.lock:
+            if since is not None and self.refreshed_at is not None and self.refreshed_at >= since:
+                return len(self.tokens)
+            tokens: List[dict] = self.fetch()
+            TOKEN_REFRESHES.inc(reason=reason)
+            if [token.data for token in self.tokens.values()] != tokens:
+                self.set_tokens(tokens)
+                self.save(tokens)
+            self.unknown = {denom: until for denom, until in self.unknown.items() if denom not in self.tokens}
+            self.refreshed_at = time.monotonic()
+        return len(self.tokens)
+
+    def get(self, denom: str) -> Token:
+        """
+        Get a token, fetch the tokens if the denom is unknown and was not looked up within the TTL.
+        :param denom: denom of the asset
+        :return: token
+        """
+        token: Optional[Token] = self.tokens.get(denom)
+        if token is not None:
+            return token
+        if self.unknown.get(denom, 0.0) > time.monotonic():
+            TOKEN_MISSES.inc(result="cached")
+            raise RuntimeError(f"Could not find token info about {denom} even after refetching!")
+        # several threads missing the same denom wait for one refresh
+        self.refresh(reason="unknown", since=time.monotonic())
+        token = self.tokens.get(denom)
+        if token is not None:
+            TOKEN_MISSES.inc(result="found")
+        else:
+            TOKEN_MISSES.inc(result="unknown")
+            self.unknown[denom] = time.monotonic() + self.unknown_ttl
+            raise RuntimeError(f"Could not find token info about {denom} even after refetching!")
+        return token
+
+    def decimals(self, denom: str) -> int:
+        return self.get(denom).decimals
+
+    def known_decimals(self, denom: str) -> Optional[int]:
+        # never fetches, e.g. for decoding stored wallets before the first refresh
+        token: Optional[Token] = self.tokens.get(denom)
+        return token.decimals if token is not None else None
+
+    def follow(self, interval: float = TOKEN_REFRESH_INTERVAL,
+               on_error: Optional[Callable[[Exception], None]] = None) -> None:
+        """
+        Threaded function refreshing the tokens every interval.
+        :param interval: seconds between two refreshes
+        :param on_error: called with the error of a failed refresh, the registry keeps the former tokens
+        :return: None
+        """
+        # tokens loaded from disk are used for the first interval, a start never waits for the upstream
+        delay: float = interval if self.tokens else 0.0
+        while True:
+            time.sleep(delay)
+            delay = interval
+            try:
+                self.refresh()
+            except Exception as error:
+                if on_error is not None:
+                    on_error(error)